@@ -0,0 +1,400 @@
+#!/usr/bin/python
+
+# Disable some pylint messages
+# pylint: disable=C0103,R0201,R0904,W0511
+# C0103 : Invalid name "%s" (should match %s)
+# R0201 : Method could be a function
+# R0904 : Too many public methods
+# W0511 : TODO/FIXME/XXX
+# W0212 : Access to a protected member %s of a client class
+
+"""
+Selection of the computational backend.
+
+The pure-Python code in Matrix and VectorArray is the reference
+implementation and is always available. When NumPy is importable, a
+backend built on ndarrays may be selected instead; the objects and their
+API stay exactly the same, only the heavy kernels are handed to NumPy.
+"""
+
+import os
+import unittest
+from array import array
+
+try:
+    import numpy
+except ImportError: # pragma: no cover
+    numpy = None
+
+########################################################################
+class _NumpyKernels:
+
+    """Kernels for the 'numpy' backend. Each one takes and returns the
+    same plain Python data that the reference implementation stores, and
+    must give the same results as the reference up to rounding."""
+
+    name = 'numpy'
+
+    @staticmethod
+    def _toArray(data):
+        """Wrap an array('d') as a flat ndarray without copying it."""
+        return numpy.frombuffer(data, dtype=numpy.float64)
+
+    @staticmethod
+    def _fromArray(a):
+        """Copy an ndarray into a new array('d')."""
+        rv = array('d')
+        rv.fromstring(numpy.ascontiguousarray(a, numpy.float64).tostring())
+        return rv
+
+    # Matrix kernels. Matrices are passed as flat row-major array('d')
+    # objects along with their dimensions.
+
+    def multm(self, a, b, nrows, ninner, ncols):
+        """Return the matrix product of the nrows x ninner matrix a and the
+        ninner x ncols matrix b."""
+        return self._fromArray(numpy.dot(
+            self._toArray(a).reshape(nrows, ninner),
+            self._toArray(b).reshape(ninner, ncols)))
+
+    def multv(self, a, nrows, ncols, v):
+        """Return the product of the nrows x ncols matrix a and the vector
+        v, as a list."""
+        return numpy.dot(self._toArray(a).reshape(nrows, ncols),
+                         numpy.array(v[:], numpy.float64)).tolist()
+
+    def ludecomp(self, data, n):
+        """LU-decompose the n x n matrix in data with the same pivoting rule
+        as the reference Matrix.ludecomp(), returning (LU, index, d). The
+        elimination is done one column at a time with whole-submatrix
+        updates."""
+        a = self._toArray(data).reshape(n, n).copy()
+        big = numpy.abs(a).max(axis=1)
+        if (big == 0.0).any():
+            raise ValueError('Singular matrix error')
+        vv = 1.0 / big
+        index = [ 0 ] * n
+        d = 1.0
+        TINY = 1e-20
+        for j in range(n):
+            dum = vv[j:] * numpy.abs(a[j:, j])
+            # The reference picks the last of equal candidates.
+            imax = n - 1 - int(numpy.argmax(dum[::-1]))
+            if j != imax:
+                a[[j, imax]] = a[[imax, j]]
+                d = -d
+                vv[imax] = vv[j]
+            index[j] = imax
+            if a[j, j] == 0:
+                a[j, j] = TINY
+            a[j+1:, j] *= 1.0 / a[j, j]
+            a[j+1:, j+1:] -= numpy.outer(a[j+1:, j], a[j, j+1:])
+        return (self._fromArray(a), index, d)
+
+    def batchSolve(self, a, b, n):
+        """Solve the stacked n x n systems in a for the stacked right hand
+        sides in b, as BatchSolver.solve() does. Systems are rejected as
+        singular by the determinant tolerance of the closed-form
+        solvers."""
+        count = len(b) // n
+        A = numpy.asarray(a, numpy.float64).reshape(count, n, n)
+        B = numpy.asarray(b, numpy.float64).reshape(count, n, 1)
+        m = numpy.abs(A).max(axis=(1, 2))
+        tolerance = n * numpy.finfo(numpy.float64).eps * m ** n
+        if (numpy.abs(numpy.linalg.det(A)) <= tolerance).any():
+            raise ValueError('Singular matrix error')
+        try:
+            return self._fromArray(numpy.linalg.solve(A, B))
+        except numpy.linalg.LinAlgError:
+            raise ValueError('Singular matrix error')
+
+    # SparseMatrix kernels. Matrices are passed as their CSR arrays.
+
+    def _csr(self, indptr, indices, data):
+        """Wrap the CSR arrays as ndarrays, and expand the row pointers
+        into the row index of every stored element."""
+        ptr = numpy.frombuffer(indptr, dtype=numpy.intc)
+        rows = numpy.repeat(numpy.arange(len(ptr) - 1), numpy.diff(ptr))
+        return (rows, numpy.frombuffer(indices, dtype=numpy.intc),
+                self._toArray(data))
+
+    def csrMultv(self, indptr, indices, data, nrows, x):
+        """Return the product of a CSR matrix and the sequence x."""
+        (rows, cols, values) = self._csr(indptr, indices, data)
+        x = numpy.array(x, numpy.float64)
+        return self._fromArray(numpy.bincount(
+            rows, weights=values * x[cols], minlength=nrows))
+
+    def csrTransposeMultv(self, indptr, indices, data, ncols, x):
+        """Return the product of the transpose of a CSR matrix and the
+        sequence x."""
+        (rows, cols, values) = self._csr(indptr, indices, data)
+        x = numpy.array(x, numpy.float64)
+        return self._fromArray(numpy.bincount(
+            cols, weights=values * x[rows], minlength=ncols))
+
+    def csrConjugateGradient(self, indptr, indices, data, diag, b, x,
+                             tolerance, maxIterations):
+        """The Jacobi-preconditioned conjugate gradient iteration of
+        SparseMatrix.conjugateGradient(). Returns (x, iterations,
+        converged)."""
+        (rows, cols, values) = self._csr(indptr, indices, data)
+        n = len(b)
+        def multv(v):
+            'Return the matrix-vector product.'
+            return numpy.bincount(rows, weights=values * v[cols],
+                                  minlength=n)
+        inverse = 1.0 / self._toArray(diag)
+        b = numpy.array(b, numpy.float64)
+        x = numpy.array(x, numpy.float64)
+        r = b - multv(x)
+        limit = (tolerance * numpy.sqrt(b.dot(b))) ** 2
+        z = inverse * r
+        p = z
+        rz = r.dot(z)
+        iterations = 0
+        while r.dot(r) > limit:
+            if iterations >= maxIterations:
+                return (self._fromArray(x), iterations, False)
+            Ap = multv(p)
+            alpha = rz / p.dot(Ap)
+            x = x + alpha * p
+            r = r - alpha * Ap
+            z = inverse * r
+            (rz, rzOld) = (r.dot(z), rz)
+            p = z + (rz / rzOld) * p
+            iterations += 1
+        return (self._fromArray(x), iterations, True)
+
+    # VectorArray kernels. Arrays of 3-vectors are passed as flat
+    # array('d') objects.
+
+    def _rows(self, a, b):
+        """View two flat arrays of the same length as rows of
+        3-vectors."""
+        return (self._toArray(a).reshape(-1, 3),
+                self._toArray(b).reshape(-1, 3))
+
+    def add(self, a, b):
+        """Return the flat array a + b."""
+        (x, y) = self._rows(a, b)
+        return self._fromArray(x + y)
+
+    def sub(self, a, b):
+        """Return the flat array a - b."""
+        (x, y) = self._rows(a, b)
+        return self._fromArray(x - y)
+
+    def dot(self, a, b):
+        """Return the row-wise dot products of a and b."""
+        (x, y) = self._rows(a, b)
+        return self._fromArray(numpy.einsum('ij,ij->i', x, y))
+
+    def cross(self, a, b):
+        """Return the row-wise cross products of a and b."""
+        (x, y) = self._rows(a, b)
+        return self._fromArray(numpy.cross(x, y))
+
+    def norm(self, a):
+        """Return the norms of the 3-vectors in a."""
+        x = self._toArray(a).reshape(-1, 3)
+        return self._fromArray(numpy.sqrt(numpy.einsum('ij,ij->i', x, x)))
+
+    def transform3(self, a, m):
+        """Return the 3-vectors in the flat sequence a multiplied by the
+        3x3 matrix whose elements, in row order, are m."""
+        x = numpy.asarray(a, numpy.float64).reshape(-1, 3)
+        return self._fromArray(x.dot(numpy.array(m).reshape(3, 3).T))
+
+    def normalize(self, a):
+        """Normalize the 3-vectors in a, in place."""
+        x = self._toArray(a).reshape(-1, 3)
+        n = numpy.sqrt(numpy.einsum('ij,ij->i', x, x))
+        if (n == 0.0).any():
+            raise ZeroDivisionError('float division by zero')
+        x /= n[:, numpy.newaxis]
+
+    # QuaternionArray kernels. Arrays of quaternions are passed as flat
+    # array('d') objects of interleaved w, x, y, z values.
+
+    @staticmethod
+    def _quaternionProduct(p, q):
+        """Return the row-wise products of the n x 4 ndarrays p and q."""
+        (w1, x1, y1, z1) = p.T
+        (w2, x2, y2, z2) = q.T
+        return numpy.column_stack((w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                                   w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                                   w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                                   w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2))
+
+    def quaternionMulq(self, a, b):
+        """Return the row-wise quaternion products of a and b."""
+        return self._fromArray(self._quaternionProduct(
+            self._toArray(a).reshape(-1, 4), self._toArray(b).reshape(-1, 4)))
+
+    def quaternionNormalize(self, a):
+        """Normalize the quaternions in a, in place."""
+        q = self._toArray(a).reshape(-1, 4)
+        n = numpy.sqrt(numpy.einsum('ij,ij->i', q, q))
+        if (n == 0.0).any():
+            raise ZeroDivisionError('float division by zero')
+        q /= n[:, numpy.newaxis]
+
+    def quaternionInterpolate(self, a, b, t, threshold):
+        """Interpolate between the unit quaternions in a and b along the
+        shorter arc, at the parameters t. With threshold None this is
+        nlerp; otherwise it is slerp, except for pairs whose cosine is
+        above threshold, which are interpolated linearly."""
+        p = self._toArray(a).reshape(-1, 4)
+        q = self._toArray(b).reshape(-1, 4)
+        t = numpy.array(t, numpy.float64)
+        cosine = numpy.einsum('ij,ij->i', p, q)
+        sign = numpy.where(cosine < 0.0, -1.0, 1.0)
+        cosine = numpy.abs(cosine)
+        s0 = 1.0 - t
+        s1 = t.copy()
+        if threshold is not None:
+            spherical = cosine <= threshold
+            angle = numpy.arccos(cosine[spherical])
+            r = 1.0 / numpy.sin(angle)
+            s0[spherical] = numpy.sin(s0[spherical] * angle) * r
+            s1[spherical] = numpy.sin(s1[spherical] * angle) * r
+        rv = s0[:, numpy.newaxis] * p + (sign * s1)[:, numpy.newaxis] * q
+        if threshold is None or not spherical.all():
+            n = numpy.sqrt(numpy.einsum('ij,ij->i', rv, rv))
+            rv /= n[:, numpy.newaxis]
+        return self._fromArray(rv)
+
+    def quaternionChain(self, a):
+        """Return the product of the quaternions in a, in order, as a
+        (w, x, y, z) tuple, by pairwise reduction."""
+        q = self._toArray(a).reshape(-1, 4)
+        while len(q) > 1:
+            odd = len(q) % 2
+            product = self._quaternionProduct(q[0:len(q)-odd:2], q[1::2])
+            if odd:
+                product = numpy.vstack((product, q[-1:]))
+            q = product
+        return tuple(q[0].tolist())
+
+########################################################################
+class Backend:
+
+    """Backend : selects the implementation of the heavy kernels.
+
+    'python' is the pure-Python reference and is always available.
+    'numpy' is available when NumPy can be imported.
+
+    Backend.mKernels holds the kernels of the selected backend, or None for
+    the reference implementation, so that the check made by each kernel is
+    a single attribute lookup. The initial backend is 'python', unless the
+    MATH3D_BACKEND environment variable names another one.
+    """
+
+    PYTHON = 'python'
+    NUMPY = 'numpy'
+
+    mKernels = None
+
+    @staticmethod
+    def available():
+        """Return the names of the backends which can be selected."""
+        names = [ Backend.PYTHON ]
+        if numpy is not None:
+            names.append(Backend.NUMPY)
+        return names
+
+    @staticmethod
+    def current():
+        """Return the name of the selected backend."""
+        if Backend.mKernels is None:
+            return Backend.PYTHON
+        return Backend.mKernels.name
+
+    @staticmethod
+    def select(name):
+        """Select a backend by name. Returns the name of the backend which
+        was previously selected, so that it can be restored."""
+        previous = Backend.current()
+        if name == Backend.PYTHON:
+            Backend.mKernels = None
+        elif name == Backend.NUMPY:
+            if numpy is None:
+                raise ImportError('The numpy backend requires NumPy.')
+            Backend.mKernels = _NumpyKernels()
+        else:
+            raise ValueError("backend '%s' not recognized" % name)
+        return previous
+
+Backend.select(os.environ.get('MATH3D_BACKEND', Backend.PYTHON))
+
+########################################################################
+# Backend Unit Tests
+class BackendTest(unittest.TestCase):
+    """Unit tests for Backend class."""
+
+    def setUp(self):
+        'Remember the selected backend.'
+        self.mPrevious = Backend.current()
+
+    def tearDown(self):
+        'Restore the selected backend.'
+        Backend.select(self.mPrevious)
+
+    def testSelect(self):
+        'Test backend selection.'
+        assert Backend.PYTHON in Backend.available()
+        assert Backend.select(Backend.PYTHON) == self.mPrevious
+        assert Backend.current() == Backend.PYTHON
+        assert Backend.mKernels is None
+
+        hitError = False
+        try:
+            Backend.select('fortran')
+        except ValueError:
+            hitError = True
+        assert hitError
+        assert Backend.current() == Backend.PYTHON
+
+        if Backend.NUMPY in Backend.available():
+            assert Backend.select(Backend.NUMPY) == Backend.PYTHON
+            assert Backend.current() == Backend.NUMPY
+            assert Backend.mKernels is not None
+        else:
+            hitError = False
+            try:
+                Backend.select(Backend.NUMPY)
+            except ImportError:
+                hitError = True
+            assert hitError
+
+    def testKernelsMatchReference(self):
+        'Test every available backend against the reference kernels.'
+        # Imported here, since Matrix itself depends on this module.
+        from Matrix import Matrix
+        from Vector import Vector
+        import random
+        rng = random.Random(11)
+        rows = [ [ rng.uniform(-1, 1) for j in range(7) ] for i in range(7) ]
+        other = [ [ rng.uniform(-1, 1) for j in range(4) ] for i in range(7) ]
+        v = Vector(*[ rng.uniform(-1, 1) for j in range(7) ])
+
+        def compute():
+            'Run the kernels with the selected backend.'
+            A = Matrix(*rows)
+            LU = A.clone()
+            (index, d) = LU.ludecomp()
+            return (A.multm(Matrix(*other)), A.multv(v), A.transpose(),
+                    LU, index, d)
+
+        Backend.select(Backend.PYTHON)
+        (M0, V0, T0, LU0, index0, d0) = compute()
+        for name in Backend.available():
+            Backend.select(name)
+            (M, V, T, LU, index, d) = compute()
+            assert T == T0, name
+            assert (index, d) == (index0, d0), name
+            assert (V - V0).norm() < 1e-12, name
+            for i in range(7):
+                assert (M.getRow(i) - M0.getRow(i)).norm() < 1e-12, name
+                assert (LU.getRow(i) - LU0.getRow(i)).norm() < 1e-12, name
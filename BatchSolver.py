@@ -0,0 +1,273 @@
+#!/usr/bin/python
+
+# Disable some pylint messages
+# pylint: disable=C0103,R0201,R0904,R0914,W0511,W0212
+# C0103 : Invalid name "%s" (should match %s)
+# R0201 : Method could be a function
+# R0904 : Too many public methods
+# R0914 : Too many local variables
+# W0511 : TODO/FIXME/XXX
+# W0212 : Access to a protected member %s of a client class
+
+"""
+BatchSolver definition.
+"""
+
+import sys
+import unittest
+from array import array
+from itertools import izip
+from Matrix import Matrix
+from Backend import Backend
+
+# A system is treated as singular when a pivot is no larger than
+# n * EPSILON * max|a_ij|, or its determinant no larger than
+# n * EPSILON * max|a_ij| ** n.
+EPSILON = sys.float_info.epsilon
+
+########################################################################
+class BatchSolver:
+
+    """
+    BatchSolver : solves many independent n x n linear systems in one call.
+
+    The systems are passed stacked in flat arrays: A holds count matrices
+    of n * n elements each, every one in row-major order, and B holds the
+    count right hand sides of n elements each. The solutions come back
+    stacked the same way, as an array('d') of count * n elements. An
+    array of 3-vectors, such as VectorArray.mV, can be passed as B
+    directly when n is 3.
+
+    Systems of order 4 or less are solved in closed form, by Cramer's rule
+    through the adjugate, with one pass over the stack and no per-system
+    objects. Larger systems are factored one by one with
+    Matrix.ludecomp().
+
+    A system counts as singular when its determinant (n <= 4) or any LU
+    pivot (n > 4) is no larger than a tolerance relative to its largest
+    element, so nearly singular systems raise instead of returning
+    meaningless solutions.
+    """
+
+    @staticmethod
+    def solve(n, A, B):
+        """Solve the stacked systems [A_k] * x_k = b_k, returning the
+        stacked solutions. Raises ValueError if any system is singular
+        or nearly so, and IndexError if the arrays do not hold whole systems."""
+        if n < 1:
+            raise IndexError('n must be >= 1.')
+        count = len(B) // n
+        if len(B) != count * n or len(A) != count * n * n:
+            raise IndexError(
+                'A must hold %s x %s matrices for the %s vectors in B.' %
+                (n, n, len(B) / float(n)))
+        if count == 0:
+            return array('d')
+
+        k = Backend.mKernels
+        if k is not None:
+            return k.batchSolve(A, B, n)
+
+        if n == 1:
+            return BatchSolver._solve1(A, B)
+        elif n == 2:
+            return BatchSolver._solve2(A, B)
+        elif n == 3:
+            return BatchSolver._solve3(A, B)
+        elif n == 4:
+            return BatchSolver._solve4(A, B)
+        return BatchSolver._solveLU(n, A, B)
+
+    @staticmethod
+    def _interleave(columns):
+        """Interleave lists of solution components into one flat
+        array('d')."""
+        n = len(columns)
+        x = array('d', [ 0.0 ]) * (n * len(columns[0]))
+        for i in range(n):
+            x[i::n] = array('d', columns[i])
+        return x
+
+    @staticmethod
+    def _solve1(A, B):
+        """Closed-form solve of 1 x 1 systems."""
+        x = []
+        for (a, b) in izip(A, B):
+            if a == 0.0:
+                raise ValueError('Singular matrix error')
+            x.append(b / a)
+        return array('d', x)
+
+    @staticmethod
+    def _solve2(A, B):
+        """Closed-form solve of 2 x 2 systems."""
+        (x0, x1) = ([], [])
+        for (a00, a01, a10, a11, b0, b1) in izip(
+                A[0::4], A[1::4], A[2::4], A[3::4], B[0::2], B[1::2]):
+            det = a00 * a11 - a01 * a10
+            m = max(abs(a00), abs(a01), abs(a10), abs(a11))
+            if abs(det) <= 2.0 * EPSILON * m * m:
+                raise ValueError('Singular matrix error')
+            r = 1.0 / det
+            x0.append((a11 * b0 - a01 * b1) * r)
+            x1.append((a00 * b1 - a10 * b0) * r)
+        return BatchSolver._interleave([ x0, x1 ])
+
+    @staticmethod
+    def _solve3(A, B):
+        """Closed-form solve of 3 x 3 systems."""
+        (x0, x1, x2) = ([], [], [])
+        columns = [ A[i::9] for i in range(9) ] + [ B[i::3] for i in range(3) ]
+        for (a00, a01, a02, a10, a11, a12, a20, a21, a22,
+             b0, b1, b2) in izip(*columns):
+            c00 = a11 * a22 - a12 * a21
+            c01 = a12 * a20 - a10 * a22
+            c02 = a10 * a21 - a11 * a20
+            det = a00 * c00 + a01 * c01 + a02 * c02
+            m = max(abs(a00), abs(a01), abs(a02), abs(a10), abs(a11),
+                    abs(a12), abs(a20), abs(a21), abs(a22))
+            if abs(det) <= 3.0 * EPSILON * m * m * m:
+                raise ValueError('Singular matrix error')
+            r = 1.0 / det
+            x0.append((c00 * b0 + (a02 * a21 - a01 * a22) * b1 +
+                       (a01 * a12 - a02 * a11) * b2) * r)
+            x1.append((c01 * b0 + (a00 * a22 - a02 * a20) * b1 +
+                       (a02 * a10 - a00 * a12) * b2) * r)
+            x2.append((c02 * b0 + (a01 * a20 - a00 * a21) * b1 +
+                       (a00 * a11 - a01 * a10) * b2) * r)
+        return BatchSolver._interleave([ x0, x1, x2 ])
+
+    @staticmethod
+    def _solve4(A, B):
+        """Closed-form solve of 4 x 4 systems, with the adjugate built
+        from 2 x 2 minors as in Matrix4.inverse()."""
+        (x0, x1, x2, x3) = ([], [], [], [])
+        columns = [ A[i::16] for i in range(16) ] + \
+            [ B[i::4] for i in range(4) ]
+        for (a00, a01, a02, a03, a10, a11, a12, a13,
+             a20, a21, a22, a23, a30, a31, a32, a33,
+             b0, b1, b2, b3) in izip(*columns):
+            s0 = a00 * a11 - a10 * a01
+            s1 = a00 * a12 - a10 * a02
+            s2 = a00 * a13 - a10 * a03
+            s3 = a01 * a12 - a11 * a02
+            s4 = a01 * a13 - a11 * a03
+            s5 = a02 * a13 - a12 * a03
+            c0 = a20 * a31 - a30 * a21
+            c1 = a20 * a32 - a30 * a22
+            c2 = a20 * a33 - a30 * a23
+            c3 = a21 * a32 - a31 * a22
+            c4 = a21 * a33 - a31 * a23
+            c5 = a22 * a33 - a32 * a23
+            det = s0 * c5 - s1 * c4 + s2 * c3 + s3 * c2 - s4 * c1 + s5 * c0
+            m = max(abs(a00), abs(a01), abs(a02), abs(a03),
+                    abs(a10), abs(a11), abs(a12), abs(a13),
+                    abs(a20), abs(a21), abs(a22), abs(a23),
+                    abs(a30), abs(a31), abs(a32), abs(a33))
+            m *= m
+            if abs(det) <= 4.0 * EPSILON * m * m:
+                raise ValueError('Singular matrix error')
+            r = 1.0 / det
+            x0.append(((a11 * c5 - a12 * c4 + a13 * c3) * b0 +
+                       (a02 * c4 - a01 * c5 - a03 * c3) * b1 +
+                       (a31 * s5 - a32 * s4 + a33 * s3) * b2 +
+                       (a22 * s4 - a21 * s5 - a23 * s3) * b3) * r)
+            x1.append(((a12 * c2 - a10 * c5 - a13 * c1) * b0 +
+                       (a00 * c5 - a02 * c2 + a03 * c1) * b1 +
+                       (a32 * s2 - a30 * s5 - a33 * s1) * b2 +
+                       (a20 * s5 - a22 * s2 + a23 * s1) * b3) * r)
+            x2.append(((a10 * c4 - a11 * c2 + a13 * c0) * b0 +
+                       (a01 * c2 - a00 * c4 - a03 * c0) * b1 +
+                       (a30 * s4 - a31 * s2 + a33 * s0) * b2 +
+                       (a21 * s2 - a20 * s4 - a23 * s0) * b3) * r)
+            x3.append(((a11 * c1 - a10 * c3 - a12 * c0) * b0 +
+                       (a00 * c3 - a01 * c1 + a02 * c0) * b1 +
+                       (a31 * s1 - a30 * s3 - a32 * s0) * b2 +
+                       (a20 * s3 - a21 * s1 + a22 * s0) * b3) * r)
+        return BatchSolver._interleave([ x0, x1, x2, x3 ])
+
+    @staticmethod
+    def _solveLU(n, A, B):
+        """Solve larger systems one at a time by LU decomposition.
+        Matrix.ludecomp() replaces a zero pivot with a tiny one and carries
+        on, so the pivots are checked here."""
+        x = array('d')
+        nn = n * n
+        for k in range(len(B) // n):
+            a = array('d', A[k*nn:(k+1)*nn])
+            tolerance = n * EPSILON * max(abs(v) for v in a)
+            LU = Matrix._fromArray(n, n, a)
+            (index, d) = LU.ludecomp()
+            lu = LU.mV
+            for i in range(n):
+                if abs(lu[i*n + i]) <= tolerance:
+                    raise ValueError('Singular matrix error')
+            x.extend(LU.lubacksub(index, list(B[k*n:(k+1)*n])))
+        return x
+
+########################################################################
+# BatchSolver tests
+class BatchSolverTest(unittest.TestCase):
+
+    """Unit tests for BatchSolver."""
+
+    def testSolve(self):
+        'Test batched solves against one-at-a-time LU solves.'
+        import random
+        rng = random.Random(17)
+        count = 25
+        for n in range(1, 7):
+            A = array('d', [ rng.uniform(-1, 1) for i in range(count*n*n) ])
+            B = array('d', [ rng.uniform(-1, 1) for i in range(count*n) ])
+            for i in range(count):
+                # Keep the systems well conditioned.
+                for j in range(n):
+                    A[i*n*n + j*n + j] += 3.0
+            X = BatchSolver.solve(n, A, B)
+            assert len(X) == count * n
+            for i in range(count):
+                LU = Matrix._fromArray(n, n, A[i*n*n:(i+1)*n*n])
+                (index, d) = LU.ludecomp()
+                x = LU.lubacksub(index, list(B[i*n:(i+1)*n]))
+                for j in range(n):
+                    assert abs(X[i*n + j] - x[j]) < 1e-12, (n, i, j)
+
+        assert BatchSolver.solve(3, [], []) == array('d')
+        assert list(BatchSolver.solve(2, [ 2, 0, 0, 4 ], [ 1, 1 ])) == \
+            [ 0.5, 0.25 ]
+
+    def testErrors(self):
+        'Test singular systems and bad sizes.'
+        for (n, A, B) in ((1, [ 0 ], [ 1 ]),
+                          (2, [ 1, 2, 2, 4 ], [ 1, 1 ]),
+                          (3, [ 1, 0, 0, 0, 1, 0, 0, 0, 0 ], [ 1, 1, 1 ]),
+                          (4, [ 0 ] * 16, [ 1 ] * 4),
+                          (5, [ 1 ] * 20 + [ 0 ] * 5, [ 1 ] * 5),
+                          # Nearly singular: the determinant rounds to a
+                          # tiny nonzero value.
+                          (3, [ .1, .2, .3, .4, .5, .6, .7, .8, .9 ],
+                           [ 1, 1, 1 ]),
+                          # Two equal rows, no zero elements.
+                          (5, [ 1 ] * 25, [ 1, 2, 1, 1, 1 ]),
+                          (6, [ 2, 1, 3, 1, 4, 1,
+                                1, 5, 2, 6, 1, 3,
+                                2, 1, 3, 1, 4, 1,
+                                3, 2, 1, 4, 2, 5,
+                                1, 1, 2, 3, 5, 8,
+                                4, 3, 2, 1, 2, 3 ], [ 1 ] * 6)):
+            hitError = False
+            try:
+                BatchSolver.solve(n, A, B)
+            except ValueError:
+                hitError = True
+            assert hitError, n
+
+        for (n, A, B) in ((3, [ 1 ] * 9, [ 1 ] * 4),
+                          (3, [ 1 ] * 8, [ 1 ] * 3),
+                          (0, [], [])):
+            hitError = False
+            try:
+                BatchSolver.solve(n, A, B)
+            except IndexError:
+                hitError = True
+            assert hitError, n
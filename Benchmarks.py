@@ -0,0 +1,510 @@
+#!/usr/bin/python
+
+# Disable some pylint messages
+# pylint: disable=C0103,R0201,R0904,W0511,W0212
+# C0103 : Invalid name "%s" (should match %s)
+# R0201 : Method could be a function
+# R0904 : Too many public methods
+# W0511 : TODO/FIXME/XXX
+# W0212 : Access to a protected member %s of a client class
+
+"""
+Benchmarks for the library.
+
+Run this module to time the benchmark suite and print the results, or
+write them as JSON to track regressions between releases, e.g.
+
+python Benchmarks.py
+python Benchmarks.py --json results.json --repeat 7
+python Benchmarks.py --filter matrix --backend numpy
+python Benchmarks.py --compare
+
+See python Benchmarks.py --help for all the options.
+"""
+
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+import timeit
+import unittest
+from array import array
+from cStringIO import StringIO
+
+from Vector import Vector
+from Matrix import Matrix
+from Quaternion import Quaternion
+from QuaternionArray import QuaternionArray
+from CoordinateSys import CoordinateSys
+from TriangleGroup import TriangleGroup
+from Backend import Backend
+
+########################################################################
+class Benchmarks:
+
+    """Benchmarks : the benchmark suite, and timings of the optimized
+    kernels against the reference implementations they replace.
+
+    Each benchmark in the suite is a function of no arguments, timed with
+    timeit after its data has been built. measure() runs it a few times to
+    warm up, picks a number of calls per timing that makes each timing
+    last at least minTime, and then reports the per-call time over
+    several repeats.
+    """
+
+    # Version of the JSON layout written by toJson().
+    FORMAT = 1
+
+    @staticmethod
+    def bestTime(func, repeat=3):
+        """Return the best of repeat timings of one call to func, in
+        seconds."""
+        return min(timeit.repeat(func, number=1, repeat=repeat))
+
+    @staticmethod
+    def randomMatrix(nrows, ncols, seed=0):
+        """Return an nrows x ncols matrix of uniform random elements."""
+        rng = random.Random(seed)
+        return Matrix._fromArray(nrows, ncols, array(
+            'd', [ rng.uniform(-1, 1) for i in range(nrows * ncols) ]))
+
+    @staticmethod
+    def compareMultm(sizes=(25, 50, 100, 200), repeat=3):
+        """Time the naive i-j-k multiply against Matrix.multm() for square
+        matrices of each size. Returns a list of (size, naive, multm)
+        tuples, in seconds."""
+        results = []
+        for n in sizes:
+            A = Benchmarks.randomMatrix(n, n, 1)
+            B = Benchmarks.randomMatrix(n, n, 2)
+            naive = Benchmarks.bestTime(
+                lambda: Matrix._multmNaive(A.mV, B.mV, n, n, n), repeat)
+            fast = Benchmarks.bestTime(lambda: A.multm(B), repeat)
+            results.append((n, naive, fast))
+        return results
+
+    @staticmethod
+    def compareStrassen(sizes=(64, 128, 192, 256), cutoff=None, repeat=1):
+        """Time the classic Matrix.multm() against Strassen's multiply for
+        square matrices of each size, to locate the crossover. Returns a
+        list of (size, classic, strassen) tuples, in seconds."""
+        results = []
+        for n in sizes:
+            A = Benchmarks.randomMatrix(n, n, 1)
+            B = Benchmarks.randomMatrix(n, n, 2)
+            classic = Benchmarks.bestTime(lambda: A.multm(B), repeat)
+            strassen = Benchmarks.bestTime(
+                lambda: A.multm(B, Matrix.STRASSEN, cutoff), repeat)
+            results.append((n, classic, strassen))
+        return results
+
+    @staticmethod
+    def compareMulq(count=10000, repeat=3):
+        """Time count quaternion products with the Vector-based
+        Quaternion.mul1(), with the component-wise Quaternion.mul2() and
+        Quaternion.mulq(), and as one batched QuaternionArray.mulq().
+        Returns a (count, mul1, mul2, mulq, batched) tuple, in seconds."""
+        rng = random.Random(3)
+        qs = [ Quaternion(*[ rng.uniform(-1, 1) for j in range(4) ])
+               for i in range(2 * count) ]
+        pairs = zip(qs[:count], qs[count:])
+        qa = QuaternionArray.fromQuaternions(qs[:count])
+        qb = QuaternionArray.fromQuaternions(qs[count:])
+        mul1 = Benchmarks.bestTime(
+            lambda: [ p.mul1(q) for (p, q) in pairs ], repeat)
+        mul2 = Benchmarks.bestTime(
+            lambda: [ p.mul2(q) for (p, q) in pairs ], repeat)
+        mulq = Benchmarks.bestTime(
+            lambda: [ p.mulq(q) for (p, q) in pairs ], repeat)
+        batched = Benchmarks.bestTime(lambda: qa.mulq(qb), repeat)
+        return (count, mul1, mul2, mulq, batched)
+
+    @staticmethod
+    def suite():
+        """Return the benchmark suite as a list of (name, func) pairs, with
+        the data for each benchmark already built."""
+        rng = random.Random(7)
+        A50 = Benchmarks.randomMatrix(50, 50, 1)
+        B50 = Benchmarks.randomMatrix(50, 50, 2)
+        v50 = B50.getRow(0)
+        rotation = Quaternion(1, 2, 3, 4)
+        rotation.normalize()
+        cs = CoordinateSys('local', None, rotation.toMatrix(),
+                           Vector(1, -2, 3))
+        points = [ Vector(*[ rng.uniform(-1, 1) for j in range(3) ])
+                   for i in range(100) ]
+        # The micro benchmarks each do 1000 operations per call, so that
+        # the call and timing overhead does not swamp the operation.
+        us = [ Vector(*[ rng.uniform(-1, 1) for j in range(3) ])
+               for i in range(1000) ]
+        vs = [ Vector(*[ rng.uniform(-1, 1) for j in range(3) ])
+               for i in range(1000) ]
+        vectors = zip(us, vs)
+        quaternions = []
+        for i in range(1000):
+            (p, q) = (Quaternion(*[ rng.uniform(-1, 1) for j in range(4) ]),
+                      Quaternion(*[ rng.uniform(-1, 1) for j in range(4) ]))
+            p.normalize()
+            quaternions.append((p, q))
+        rotations = [ (p, a) for ((p, q), a) in zip(quaternions, us) ]
+        sphere = TriangleGroup.icosahedron()
+        sphere.sphericalBarycentricSubdivide()
+        sphere.sphericalBarycentricSubdivide()
+        ascii = sphere.toStl('sphere')
+        binary = StringIO()
+        sphere.writeBinaryStl(binary, 'sphere')
+        binary = binary.getvalue()
+
+        def lu():
+            'Factor a copy of A50.'
+            A = A50.clone()
+            A.ludecomp()
+
+        def subdivide():
+            'Subdivide a copy of the subdivided icosahedron.'
+            sphere.clone().sphericalBarycentricSubdivide()
+
+        def writeBinary():
+            'Write the sphere as binary STL.'
+            sphere.writeBinaryStl(StringIO(), 'sphere')
+
+        return [
+            ('vector.add.1000', lambda: [ a + b for (a, b) in vectors ]),
+            ('vector.dot.1000', lambda: [ a.dot(b) for (a, b) in vectors ]),
+            ('vector.cross.1000',
+             lambda: [ a.cross(b) for (a, b) in vectors ]),
+            ('vector.normalize.1000',
+             lambda: [ a.clone().normalize() for a in us ]),
+            ('matrix.multm.50', lambda: A50.multm(B50)),
+            ('matrix.multv.50', lambda: A50.multv(v50)),
+            ('matrix.ludecomp.50', lu),
+            ('quaternion.mulq.1000',
+             lambda: [ p.mulq(q) for (p, q) in quaternions ]),
+            ('quaternion.rotate.1000',
+             lambda: [ p.rotate(a) for (p, a) in rotations ]),
+            ('coordinatesys.toParent.100',
+             lambda: [ cs.transformToParentSystem(p) for p in points ]),
+            ('coordinatesys.fromParent.100',
+             lambda: [ cs.transformFromParentSystem(p) for p in points ]),
+            ('trianglegroup.icosahedron', TriangleGroup.icosahedron),
+            ('trianglegroup.subdivide', subdivide),
+            ('stl.writeAscii', lambda: sphere.toStl('sphere')),
+            ('stl.readAscii',
+             lambda: TriangleGroup.readStl(StringIO(ascii))),
+            ('stl.writeBinary', writeBinary),
+            ('stl.readBinary',
+             lambda: TriangleGroup.readBinaryStl(StringIO(binary))),
+            ]
+
+    @staticmethod
+    def measure(func, repeat=5, warmup=1, minTime=0.1, normalized=False):
+        """Time func with timeit, after warmup untimed calls. The number of
+        calls per timing is doubled until one timing takes minTime
+        seconds, and then repeat timings are taken. Returns a dict of the
+        best, median and mean time per call, in seconds, and the number
+        and repeat used.
+
+        If normalized is True, each timing is followed by a timing of the
+        calibration loop, and the median ratio of the two is added as
+        'normalized'. Pairing the timings cancels most of the drift in
+        the speed of a busy machine."""
+        for i in range(warmup):
+            func()
+        timer = timeit.Timer(func)
+        number = Benchmarks._number(timer, minTime)
+        if normalized:
+            Benchmarks._calibrationLoop()
+            reference = timeit.Timer(Benchmarks._calibrationLoop)
+            calls = Benchmarks._number(reference, minTime)
+            times = []
+            ratios = []
+            for i in range(repeat):
+                times.append(timer.timeit(number) / number)
+                ratios.append(times[-1] / (reference.timeit(calls) / calls))
+        else:
+            times = [ t / number for t in timer.repeat(repeat, number) ]
+        result = { 'best' : min(times),
+                   'median' : Benchmarks._median(times),
+                   'mean' : sum(times) / len(times),
+                   'number' : number,
+                   'repeat' : repeat }
+        if normalized:
+            result['normalized'] = Benchmarks._median(ratios)
+        return result
+
+    @staticmethod
+    def _number(timer, minTime):
+        """Return the number of calls, a power of 2, for which one timing
+        of timer takes at least minTime seconds."""
+        number = 1
+        while timer.timeit(number) < minTime:
+            number *= 2
+        return number
+
+    @staticmethod
+    def _median(values):
+        'Return the median of a non-empty list of numbers.'
+        values = sorted(values)
+        mid = len(values) // 2
+        if len(values) % 2:
+            return values[mid]
+        return 0.5 * (values[mid - 1] + values[mid])
+
+    @staticmethod
+    def run(names=None, repeat=5, warmup=1, minTime=0.1, report=None,
+            normalized=False):
+        """Run the benchmarks in the suite whose names contain one of the
+        strings in names, or all of them, returning a dict from name to
+        the result of measure(). If report is given, it is called with
+        each name and result as the benchmark finishes."""
+        results = {}
+        for (name, func) in Benchmarks.suite():
+            if names and not [ n for n in names if n in name ]:
+                continue
+            results[name] = Benchmarks.measure(func, repeat, warmup, minTime,
+                                               normalized)
+            if report is not None:
+                report(name, results[name])
+        return results
+
+    @staticmethod
+    def _calibrationLoop():
+        """A fixed mix of float arithmetic, calls and allocation, timed by
+        calibrate() and by measure() for normalized times."""
+        total = 0.0
+        items = []
+        for i in xrange(200):
+            x = i * 0.5
+            total += math.sqrt(x * x + 1.0)
+            items.append((x, total))
+        return len(items)
+
+    @staticmethod
+    def calibrate(repeat=5, warmup=1, minTime=0.1):
+        """Return the result of measure() for a fixed pure-Python loop.
+        Benchmark times divided by its time are in calibration units,
+        which carry across machines much better than seconds."""
+        return Benchmarks.measure(Benchmarks._calibrationLoop, repeat,
+                                  warmup, minTime)
+
+    @staticmethod
+    def compare(results, baseline, threshold):
+        """Compare normalized results with those of a baseline run, both
+        dicts from name to result. Returns a list of (name, baseline,
+        current, delta, regressed) tuples sorted by name, where delta is
+        the relative change in normalized time and regressed is True if
+        delta exceeds threshold. Benchmarks missing from the baseline have
+        baseline and delta None, and never count as regressed. Baseline
+        entries missing from the results have current and delta None, and
+        always count as regressed."""
+        rows = []
+        for name in sorted(set(results.keys()) | set(baseline.keys())):
+            if name not in results:
+                rows.append((name, baseline[name]['normalized'], None, None,
+                             True))
+                continue
+            current = results[name]['normalized']
+            if name not in baseline:
+                rows.append((name, None, current, None, False))
+                continue
+            previous = baseline[name]['normalized']
+            delta = current / previous - 1.0
+            rows.append((name, previous, current, delta, delta > threshold))
+        return rows
+
+    @staticmethod
+    def toJson(results, **settings):
+        """Return results from run() as a JSON document, along with the
+        settings used and a description of the platform."""
+        meta = { 'format' : Benchmarks.FORMAT,
+                 'created' : time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                           time.gmtime()),
+                 'python' : platform.python_version(),
+                 'implementation' : platform.python_implementation(),
+                 'platform' : platform.platform(),
+                 'backend' : Backend.current() }
+        meta.update(settings)
+        return json.dumps({ 'meta' : meta, 'benchmarks' : results },
+                          indent=2, sort_keys=True, separators=(',', ': '))
+
+def printComparisons():
+
+    """Print the timings of the optimized kernels against the reference
+    implementations."""
+
+    print "Matrix.multm, square matrices:"
+    print "%6s %12s %12s %8s" % ('size', 'naive (s)', 'multm (s)', 'speedup')
+    for (n, naive, fast) in Benchmarks.compareMultm():
+        print "%6d %12.4f %12.4f %7.1fx" % (n, naive, fast, naive / fast)
+    print
+    print "Matrix.multm, classic against Strassen:"
+    print "%6s %12s %12s %8s" % ('size', 'classic (s)', 'strassen (s)',
+                                 'speedup')
+    for (n, classic, strassen) in Benchmarks.compareStrassen():
+        print "%6d %12.4f %12.4f %7.2fx" % (n, classic, strassen,
+                                            classic / strassen)
+    print
+    (count, mul1, mul2, mulq, batched) = Benchmarks.compareMulq()
+    print "Quaternion products, %d pairs:" % count
+    print "%-22s %12s %12s" % ('method', 'time (s)', 'products/s')
+    for (name, t) in (('Quaternion.mul1', mul1), ('Quaternion.mul2', mul2),
+                      ('Quaternion.mulq', mulq),
+                      ('QuaternionArray.mulq', batched)):
+        print "%-22s %12.4f %12.0f" % (name, t, count / t)
+
+def printResult(name, result):
+
+    """Print one line of benchmark results."""
+
+    print "%-30s %12.3f %12.3f %10d" % (name, result['best'] * 1e6,
+                                        result['median'] * 1e6,
+                                        result['number'])
+
+def main(argv=None):
+
+    """Run the benchmarks from the command line."""
+
+    parser = argparse.ArgumentParser(
+        description='Time the benchmark suite.')
+    parser.add_argument('--json', metavar='FILE',
+                        help="write the results as JSON to FILE, or to "
+                        "standard output if FILE is '-'")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timings of each benchmark')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='number of untimed calls before timing')
+    parser.add_argument('--min-time', type=float, default=0.1,
+                        dest='minTime',
+                        help='minimum duration of one timing, in seconds')
+    parser.add_argument('--filter', action='append', metavar='TEXT',
+                        help='only run benchmarks whose names contain TEXT; '
+                        'may be given more than once')
+    parser.add_argument('--backend', choices=Backend.available(),
+                        help='computational backend to use')
+    parser.add_argument('--list', action='store_true',
+                        help='list the benchmark names and exit')
+    parser.add_argument('--compare', action='store_true',
+                        help='print the kernel comparison tables instead')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for (name, func) in Benchmarks.suite():
+            print name
+        return
+    if args.backend:
+        Backend.select(args.backend)
+    if args.compare:
+        printComparisons()
+        return
+
+    toStdout = args.json == '-'
+    report = None
+    if not toStdout:
+        print "%-30s %12s %12s %10s" % ('benchmark', 'best (us)',
+                                        'median (us)', 'calls')
+        report = printResult
+    results = Benchmarks.run(args.filter, args.repeat, args.warmup,
+                             args.minTime, report)
+    if args.json:
+        document = Benchmarks.toJson(results, repeat=args.repeat,
+                                     warmup=args.warmup, minTime=args.minTime)
+        if toStdout:
+            sys.stdout.write(document + '\n')
+        else:
+            f = open(args.json, 'w')
+            try:
+                f.write(document + '\n')
+            finally:
+                f.close()
+
+########################################################################
+# Benchmarks Unit Tests
+class BenchmarksTest(unittest.TestCase):
+    """Unit tests for Benchmarks class."""
+
+    def testCompareMultm(self):
+        'Test the multm comparison on small sizes.'
+        results = Benchmarks.compareMultm(sizes=(2, 3), repeat=1)
+        assert [ r[0] for r in results ] == [ 2, 3 ]
+        for (n, naive, fast) in results:
+            assert naive >= 0 and fast >= 0
+
+    def testCompareStrassen(self):
+        'Test the Strassen comparison on small sizes.'
+        results = Benchmarks.compareStrassen(sizes=(4, 5), cutoff=2)
+        assert [ r[0] for r in results ] == [ 4, 5 ]
+
+    def testCompareMulq(self):
+        'Test the quaternion product comparison on a small count.'
+        (count, mul1, mul2, mulq, batched) = Benchmarks.compareMulq(10, 1)
+        assert count == 10
+        assert min(mul1, mul2, mulq, batched) >= 0
+
+    def testMeasure(self):
+        'Test the timing of one function.'
+        calls = []
+        result = Benchmarks.measure(lambda: calls.append(1), repeat=3,
+                                    warmup=2, minTime=0.001)
+        assert result['repeat'] == 3
+        assert result['number'] >= 1
+        assert len(calls) >= 2 + 3 * result['number']
+        assert 0 <= result['best'] <= result['median']
+        assert result['best'] <= result['mean']
+        assert 'normalized' not in result
+        result = Benchmarks.measure(lambda: calls.append(1), repeat=4,
+                                    warmup=0, minTime=0.001, normalized=True)
+        assert result['repeat'] == 4
+        assert result['normalized'] > 0
+        assert Benchmarks._median([ 3, 1, 2 ]) == 2
+        assert Benchmarks._median([ 4, 1, 3, 2 ]) == 2.5
+
+    def testSuite(self):
+        'Test that every benchmark in the suite runs.'
+        names = [ name for (name, func) in Benchmarks.suite() ]
+        assert len(names) == len(set(names))
+        for prefix in ('vector.', 'matrix.multm', 'matrix.ludecomp',
+                       'quaternion.mulq', 'coordinatesys.', 'trianglegroup.',
+                       'stl.'):
+            assert [ n for n in names if n.startswith(prefix) ], prefix
+        for (name, func) in Benchmarks.suite():
+            func()
+
+    def testJson(self):
+        'Test running a filtered suite and writing the results as JSON.'
+        results = Benchmarks.run([ 'vector.add', 'quaternion.mulq' ],
+                                 repeat=1, warmup=0, minTime=0.0)
+        assert sorted(results.keys()) == [ 'quaternion.mulq.1000',
+                                           'vector.add.1000' ]
+        document = json.loads(Benchmarks.toJson(results, repeat=1))
+        assert document['meta']['format'] == Benchmarks.FORMAT
+        assert document['meta']['repeat'] == 1
+        assert document['meta']['backend'] == Backend.current()
+        assert document['benchmarks']['vector.add.1000']['number'] == 1
+
+    def testCompare(self):
+        'Test calibration and comparison with a baseline.'
+        calibration = Benchmarks.calibrate(repeat=1, warmup=0, minTime=0.0)
+        assert calibration['median'] > 0
+        results = { 'a' : { 'normalized' : 4.0 },
+                    'b' : { 'normalized' : 6.0 },
+                    'c' : { 'normalized' : 2.0 } }
+        baseline = { 'a' : { 'normalized' : 5.0 },
+                     'b' : { 'normalized' : 4.0 },
+                     'd' : { 'normalized' : 3.0 } }
+        rows = Benchmarks.compare(results, baseline, 0.25)
+        assert [ r[0] for r in rows ] == [ 'a', 'b', 'c', 'd' ]
+        assert rows[0][1:3] == (5.0, 4.0) and not rows[0][4]
+        assert abs(rows[0][3] + 0.2) < 1e-15
+        assert rows[1] == ('b', 4.0, 6.0, 0.5, True)
+        assert rows[2] == ('c', None, 2.0, None, False)
+        assert rows[3] == ('d', 3.0, None, None, True)
+        rows = Benchmarks.compare(results, baseline, 0.6)
+        assert not rows[1][4] and rows[3][4]
+
+########################################################################
+# Main Logic
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/python
+
+# Disable some pylint messages
+# pylint: disable=C0103,R0201,R0904,W0511
+# C0103 : Invalid name "%s" (should match %s)
+# R0201 : Method could be a function
+# R0904 : Too many public methods
+# W0511 : TODO/FIXME/XXX
+# W0212 : Access to a protected member %s of a client class
+
+"""
+A read-only, memory-mapped view of a binary STL file.
+"""
+
+import math
+import mmap
+import os
+import shutil
+import tempfile
+import unittest
+
+from TriangleGroup import TriangleGroup, STL_HEADER_SIZE, STL_COUNT, \
+    STL_RECORD
+
+########################################################################
+class BinaryStlView:
+
+    """BinaryStlView : read-only access to the facets of a binary STL file
+    without loading it.
+
+    The file is memory-mapped and each query unpacks the records it needs
+    straight out of the mapping, so opening the view costs the same no
+    matter how big the file is, and only the pages holding the facets
+    which are actually visited are read from disk.
+
+    Unlike a TriangleGroup, the view does not merge shared vertices or
+    edges, since that would require a pass over the whole file. Each facet
+    contributes three edges of its own: edge i joins vertex (i % 3) and
+    vertex ((i + 1) % 3) of facet (i / 3). Use toTriangleGroup() to get
+    the indexed mesh.
+    """
+
+    def __init__(self, filename):
+        """Open and map the binary STL file filename."""
+        self.mFile = open(filename, 'rb')
+        try:
+            size = os.fstat(self.mFile.fileno()).st_size
+            if size < STL_HEADER_SIZE + STL_COUNT.size:
+                raise ValueError('Truncated binary STL header.')
+            self.mMap = mmap.mmap(self.mFile.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            (self.mNFaces,) = STL_COUNT.unpack_from(self.mMap,
+                                                    STL_HEADER_SIZE)
+            if size < self._offset(self.mNFaces):
+                self.mMap.close()
+                raise ValueError('Truncated binary STL file.')
+        except:
+            self.mFile.close()
+            raise
+
+    def close(self):
+        """Release the mapping and close the file."""
+        self.mMap.close()
+        self.mFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+    @staticmethod
+    def _offset(i):
+        """Return the byte offset of facet record i."""
+        return STL_HEADER_SIZE + STL_COUNT.size + i * STL_RECORD.size
+
+    def nFaces(self):
+        """Return the number of faces."""
+        return self.mNFaces
+
+    def nEdges(self):
+        """Return the number of (per-facet) edges."""
+        return 3 * self.mNFaces
+
+    def facet(self, i):
+        """Return facet i as a (normal, vertex1, vertex2, vertex3) tuple of
+        coordinate tuples."""
+        if i < 0 or i >= self.mNFaces:
+            raise IndexError('Index out of bounds : %s' % i)
+        r = STL_RECORD.unpack_from(self.mMap, self._offset(i))
+        return (r[0:3], r[3:6], r[6:9], r[9:12])
+
+    def iterFacets(self):
+        """Generate every facet, in file order, as returned by facet()."""
+        unpack = STL_RECORD.unpack_from
+        data = self.mMap
+        offset = self._offset(0)
+        step = STL_RECORD.size
+        for _ in xrange(self.mNFaces):
+            r = unpack(data, offset)
+            yield (r[0:3], r[3:6], r[6:9], r[9:12])
+            offset += step
+
+    def edgeLength(self, i):
+        """Return the length of edge i."""
+        if i < 0 or i >= 3 * self.mNFaces:
+            raise IndexError('Index out of bounds : %s' % i)
+        r = STL_RECORD.unpack_from(self.mMap, self._offset(i // 3))
+        m = 3 + 3 * (i % 3)
+        n = 3 + 3 * ((i + 1) % 3)
+        dx = r[n] - r[m]
+        dy = r[n+1] - r[m+1]
+        dz = r[n+2] - r[m+2]
+        return math.sqrt(dx * dx + dy * dy + dz * dz)
+
+    def maxSphericalDeviation(self):
+        """Compute TriangleGroup.maxSphericalDeviation() directly from the
+        mapped records."""
+        maxDifference = 0.0
+        for (_, A, B, C) in self.iterFacets():
+            # Length of A-C
+            (dx, dy, dz) = (A[0] - C[0], A[1] - C[1], A[2] - C[2])
+            LAC = math.sqrt(dx * dx + dy * dy + dz * dz)
+
+            # Angle ABC, opposite A-C
+            (ux, uy, uz) = (A[0] - B[0], A[1] - B[1], A[2] - B[2])
+            (vx, vy, vz) = (C[0] - B[0], C[1] - B[1], C[2] - B[2])
+            cosABC = ((ux * vx + uy * vy + uz * vz) /
+                      math.sqrt((ux * ux + uy * uy + uz * uz) *
+                                (vx * vx + vy * vy + vz * vz)))
+            ABC = math.acos(max(-1.0, min(1.0, cosABC)))
+            diameter = LAC / math.sin(ABC)
+
+            # The coordinates are single precision, so allow for a
+            # circumcircle very slightly larger than the unit sphere.
+            angle = math.asin(min(1.0, diameter * 0.5))
+            deviation = 1.0 - math.cos(angle)
+
+            if (deviation > maxDifference):
+                maxDifference = deviation
+
+        return maxDifference
+
+    def toTriangleGroup(self, tolerance=None, compact=False):
+        """Load the facets into a new, indexed TriangleGroup."""
+        g = TriangleGroup(tolerance, compact)
+        addCoords = g._addCoords
+        for (_, A, B, C) in self.iterFacets():
+            i1 = addCoords(A)
+            i2 = addCoords(B)
+            i3 = addCoords(C)
+            if i1 != i2 and i2 != i3 and i3 != i1:
+                g._addIndexedTriangle(i1, i2, i3)
+        return g
+
+########################################################################
+# BinaryStlView Tests
+class BinaryStlViewTest(unittest.TestCase):
+    """Unit tests for BinaryStlView class."""
+
+    def setUp(self):
+        'Write a binary STL file to view.'
+        self.mDir = tempfile.mkdtemp()
+        self.mFilename = os.path.join(self.mDir, 'sphere.stl')
+        self.mGroup = TriangleGroup.icosahedron()
+        self.mGroup.sphericalBarycentricSubdivide()
+        self.mGroup.writeBinaryStlToFile(self.mFilename)
+
+    def tearDown(self):
+        'Remove the binary STL file.'
+        shutil.rmtree(self.mDir)
+
+    def testFacets(self):
+        """Test facet access."""
+        g = self.mGroup
+        view = BinaryStlView(self.mFilename)
+        try:
+            assert view.nFaces() == 120
+            assert view.nEdges() == 360
+            (normal, A, B, C) = view.facet(5)
+            triangle = g.mTriangles[5]
+            for (p, i) in zip((A, B, C), triangle):
+                assert (g.mVertices[i] - p).norm() < 1e-6
+            assert len(list(view.iterFacets())) == 120
+            assert list(view.iterFacets())[5] == view.facet(5)
+
+            hitError = False
+            try:
+                view.facet(120)
+            except IndexError:
+                hitError = True
+            assert hitError
+        finally:
+            view.close()
+
+    def testMeasurements(self):
+        """Test measurements made through the view."""
+        g = self.mGroup
+        with BinaryStlView(self.mFilename) as view:
+            (a, b, c) = g.mTriangles[7]
+            assert abs(view.edgeLength(21) -
+                       (g.mVertices[b] - g.mVertices[a]).norm()) < 1e-6
+            assert abs(view.edgeLength(22) -
+                       (g.mVertices[c] - g.mVertices[b]).norm()) < 1e-6
+            assert abs(view.edgeLength(23) -
+                       (g.mVertices[a] - g.mVertices[c]).norm()) < 1e-6
+            assert abs(view.maxSphericalDeviation() -
+                       g.maxSphericalDeviation()) < 1e-5
+
+    def testToTriangleGroup(self):
+        """Test loading the view into a TriangleGroup."""
+        with BinaryStlView(self.mFilename) as view:
+            g = view.toTriangleGroup()
+        assert g.nFaces() == self.mGroup.nFaces()
+        assert g.nVertices() == self.mGroup.nVertices()
+        assert g.nEdges() == self.mGroup.nEdges()
+
+        with BinaryStlView(self.mFilename) as view:
+            g = view.toTriangleGroup(compact=True)
+        assert g.mCompact
+        assert g.nVertices() == self.mGroup.nVertices()
+
+    def testTruncated(self):
+        """Test that a truncated file is rejected."""
+        f = open(self.mFilename, 'r+b')
+        f.truncate(STL_HEADER_SIZE + STL_COUNT.size + 10 * STL_RECORD.size)
+        f.close()
+        hitError = False
+        try:
+            BinaryStlView(self.mFilename)
+        except ValueError:
+            hitError = True
+        assert hitError
+
+        f = open(self.mFilename, 'r+b')
+        f.truncate(10)
+        f.close()
+        hitError = False
+        try:
+            BinaryStlView(self.mFilename)
+        except ValueError:
+            hitError = True
+        assert hitError
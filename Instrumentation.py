@@ -0,0 +1,333 @@
+#!/usr/bin/python
+
+# Disable some pylint messages
+# pylint: disable=C0103,R0201,R0904,W0511,W0212
+# C0103 : Invalid name "%s" (should match %s)
+# R0201 : Method could be a function
+# R0904 : Too many public methods
+# W0511 : TODO/FIXME/XXX
+# W0212 : Access to a protected member %s of a client class
+
+"""
+Opt-in instrumentation of the hot paths.
+
+While instrumentation is enabled, object allocations are counted per
+class, and calls to the hot methods are counted and timed. It is off by
+default and costs nothing then: enabling it wraps the constructors and
+hot methods in place, and disabling it puts the original functions back.
+"""
+
+import contextlib
+import sys
+import timeit
+import unittest
+from cStringIO import StringIO
+
+from Vector import Vector
+from Matrix import Matrix
+from Matrix3 import Matrix3
+from Matrix4 import Matrix4
+from Quaternion import Quaternion
+from QuaternionArray import QuaternionArray
+from VectorArray import VectorArray
+from CoordinateSys import CoordinateSys
+from TriangleGroup import TriangleGroup
+from SparseMatrix import SparseMatrix
+from LUFactorization import LUFactorization
+from BatchSolver import BatchSolver
+
+_clock = timeit.default_timer
+
+########################################################################
+class Instrumentation:
+
+    """
+    Instrumentation : allocation counts, call counts and cumulative times
+    for the hot paths, collected only while enabled.
+
+    Allocations of the TRACKED_CLASSES are counted both through their
+    constructors and through the fast internal constructors that use
+    object.__new__ directly, such as Vector._fromList(). Calls of the
+    HOT_METHODS are counted and their wall-clock time accumulated; the
+    time is inclusive, so it covers any other hot methods they call.
+
+    Methods looked up before instrumentation was enabled, e.g. bound
+    methods held in local variables, keep calling the originals and are
+    not counted. The counters are shared by all threads.
+    """
+
+    TRACKED_CLASSES = [ Vector, Matrix, Matrix3, Matrix4, Quaternion,
+                        QuaternionArray, VectorArray, TriangleGroup,
+                        SparseMatrix, LUFactorization ]
+
+    HOT_METHODS = [
+        (Vector, [ '__add__', '__sub__', 'dot', 'cross', 'mults',
+                   'normalize' ]),
+        (Matrix, [ 'multm', 'multv', 'transpose', 'ludecomp', 'lubacksub',
+                   '_contiguous' ]),
+        (Matrix3, [ 'multm', 'multv', 'inverse' ]),
+        (Matrix4, [ 'multm', 'multv', 'inverse' ]),
+        (Quaternion, [ 'mulq', 'rotate', 'rotateMany', 'toMatrix' ]),
+        (QuaternionArray, [ 'mulq', 'slerp', 'nlerp', 'composeChain' ]),
+        (CoordinateSys, [ 'transformToParentSystem',
+                          'transformFromParentSystem' ]),
+        (TriangleGroup, [ '_addVertex', '_addCoords', '_addEdge',
+                          '_addTriangle', 'sphericalBarycentricSubdivide',
+                          'readStl', 'writeStl', 'readBinaryStl',
+                          'writeBinaryStl' ]),
+        (SparseMatrix, [ 'multv', 'conjugateGradient' ]),
+        (LUFactorization, [ 'solve', 'solveMany' ]),
+        (BatchSolver, [ 'solve' ]),
+        ]
+
+    mAllocations = {} # Class name -> number of objects allocated
+    mCalls = {}       # 'Class.method' -> [ number of calls, seconds ]
+    mOriginals = []   # (owner, name, original attribute) to restore
+    mDepth = 0        # Nesting depth of collecting() blocks
+
+    @staticmethod
+    def isEnabled():
+        """Return True if instrumentation is currently enabled."""
+        return len(Instrumentation.mOriginals) > 0
+
+    @staticmethod
+    def reset():
+        """Clear all the counters."""
+        Instrumentation.mAllocations.clear()
+        Instrumentation.mCalls.clear()
+
+    @staticmethod
+    def _patch(owner, name, value):
+        """Replace an attribute of a class or module, remembering the
+        original so that disable() can restore it."""
+        Instrumentation.mOriginals.append((owner, name, owner.__dict__[name]))
+        setattr(owner, name, value)
+
+    @staticmethod
+    def _countingNew(original):
+        """Return a replacement for object.__new__ that counts the
+        allocations."""
+        allocations = Instrumentation.mAllocations
+        def new(cls, *args):
+            'Count and allocate an object of class cls.'
+            name = cls.__name__
+            allocations[name] = allocations.get(name, 0) + 1
+            return original(cls, *args)
+        return new
+
+    @staticmethod
+    def _countingInit(original):
+        """Return a replacement for an __init__ method that counts the
+        allocations."""
+        allocations = Instrumentation.mAllocations
+        def __init__(self, *args, **kwargs):
+            'Count and initialize a new object.'
+            name = self.__class__.__name__
+            allocations[name] = allocations.get(name, 0) + 1
+            original(self, *args, **kwargs)
+        return __init__
+
+    @staticmethod
+    def _timed(key, original):
+        """Return a replacement for a function that counts its calls and
+        accumulates the time spent in them under key."""
+        calls = Instrumentation.mCalls
+        def timed(*args, **kwargs):
+            'Time one call.'
+            start = _clock()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = _clock() - start
+                entry = calls.get(key)
+                if entry is None:
+                    calls[key] = [ 1, elapsed ]
+                else:
+                    entry[0] += 1
+                    entry[1] += elapsed
+        timed.__name__ = original.__name__
+        timed.__doc__ = original.__doc__
+        return timed
+
+    @staticmethod
+    def enable():
+        """Start collecting. The counters are not reset."""
+        if Instrumentation.isEnabled():
+            return
+        patch = Instrumentation._patch
+        for cls in Instrumentation.TRACKED_CLASSES:
+            if '__init__' in cls.__dict__:
+                patch(cls, '__init__',
+                      Instrumentation._countingInit(cls.__dict__['__init__']))
+            module = sys.modules[cls.__module__]
+            if module.__dict__.get('_new') is object.__new__ and \
+                    (module, '_new') not in [ (o, n) for (o, n, f)
+                                              in Instrumentation.mOriginals ]:
+                patch(module, '_new',
+                      Instrumentation._countingNew(object.__new__))
+        for (cls, names) in Instrumentation.HOT_METHODS:
+            for name in names:
+                attribute = cls.__dict__[name]
+                key = '%s.%s' % (cls.__name__, name)
+                if isinstance(attribute, staticmethod):
+                    patch(cls, name, staticmethod(Instrumentation._timed(
+                        key, attribute.__get__(None, cls))))
+                else:
+                    patch(cls, name, Instrumentation._timed(key, attribute))
+
+    @staticmethod
+    def disable():
+        """Stop collecting and restore the original functions, leaving
+        the counters as they are."""
+        originals = Instrumentation.mOriginals
+        while originals:
+            (owner, name, attribute) = originals.pop()
+            setattr(owner, name, attribute)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def collecting(reset=True):
+        """Context manager which enables instrumentation for the duration
+        of a with block, first resetting the counters unless reset is
+        False. Blocks may be nested; instrumentation stays enabled until
+        the outermost one ends, or if it was enabled beforehand."""
+        wasEnabled = Instrumentation.isEnabled() and \
+            Instrumentation.mDepth == 0
+        if reset:
+            Instrumentation.reset()
+        Instrumentation.enable()
+        Instrumentation.mDepth += 1
+        try:
+            yield Instrumentation
+        finally:
+            Instrumentation.mDepth -= 1
+            if Instrumentation.mDepth == 0 and not wasEnabled:
+                Instrumentation.disable()
+
+    @staticmethod
+    def snapshot():
+        """Return a copy of the counters, as a dict with 'allocations'
+        mapping class names to counts, and 'calls' mapping method names
+        to { 'calls' : count, 'seconds' : total time }. The result can be
+        written out with json."""
+        return { 'allocations' : dict(Instrumentation.mAllocations),
+                 'calls' : dict([ (key, { 'calls' : n, 'seconds' : t })
+                                  for (key, (n, t))
+                                  in Instrumentation.mCalls.items() ]) }
+
+    @staticmethod
+    def report(reset=False):
+        """Return the counters as a printable table, with allocations in
+        decreasing order of count and calls in decreasing order of total
+        time. If reset is True, the counters are cleared afterwards, so
+        successive reports from a long-running process cover successive
+        intervals."""
+        out = StringIO()
+        allocations = sorted(Instrumentation.mAllocations.items(),
+                             key=lambda item: (-item[1], item[0]))
+        calls = sorted(Instrumentation.mCalls.items(),
+                       key=lambda item: (-item[1][1], item[0]))
+        out.write('%-44s %12s\n' % ('allocations', 'objects'))
+        for (name, count) in allocations:
+            out.write('%-44s %12d\n' % (name, count))
+        out.write('\n%-44s %12s %12s %12s\n' % ('calls', 'count',
+                                                'total (s)', 'mean (us)'))
+        for (name, (count, seconds)) in calls:
+            out.write('%-44s %12d %12.6f %12.3f\n' % (
+                name, count, seconds, 1e6 * seconds / count))
+        if reset:
+            Instrumentation.reset()
+        return out.getvalue()
+
+########################################################################
+# Instrumentation Unit Tests
+class InstrumentationTest(unittest.TestCase):
+    """Unit tests for Instrumentation class."""
+
+    def setUp(self):
+        'Make sure each test starts disabled and empty.'
+        Instrumentation.disable()
+        Instrumentation.reset()
+
+    def tearDown(self):
+        'Leave instrumentation disabled.'
+        Instrumentation.disable()
+        Instrumentation.reset()
+
+    def testDisabledIsUntouched(self):
+        'Test that disabling restores the original functions.'
+        import Vector as VectorModule
+        before = dict(Vector.__dict__)
+        Instrumentation.enable()
+        assert Instrumentation.isEnabled()
+        assert Vector.__dict__['cross'] is not before['cross']
+        assert VectorModule._new is not object.__new__
+        Instrumentation.disable()
+        assert not Instrumentation.isEnabled()
+        assert dict(Vector.__dict__) == before
+        assert VectorModule._new is object.__new__
+        assert TriangleGroup.__dict__['readStl'].__get__(None, TriangleGroup) \
+            is TriangleGroup.readStl
+
+        Vector(1, 2, 3).cross(Vector(4, 5, 6))
+        assert Instrumentation.snapshot() == { 'allocations' : {},
+                                               'calls' : {} }
+
+    def testCounters(self):
+        'Test allocation and call counts.'
+        with Instrumentation.collecting():
+            u = Vector(1, 2, 3)
+            v = u.cross(Vector(4, 5, 6))
+            w = u + v
+            Matrix.identity(3).multv(w)
+            q = Quaternion(1, 0, 0, 0).mulq(Quaternion(0, 1, 0, 0))
+            g = TriangleGroup.icosahedron()
+        assert not Instrumentation.isEnabled()
+        assert w == [ -2, 8, 0 ] and q.compare([ 0, 1, 0, 0 ])
+
+        snapshot = Instrumentation.snapshot()
+        allocations = snapshot['allocations']
+        calls = snapshot['calls']
+        # Two by the constructor, and two products by Vector._fromList(),
+        # ahead of those made by the rest.
+        assert allocations['Vector'] >= 4
+        assert allocations['Quaternion'] == 3
+        assert allocations['Matrix'] >= 1
+        assert allocations['TriangleGroup'] == 1
+        assert calls['Vector.cross']['calls'] == 1
+        assert calls['Vector.__add__']['calls'] == 1
+        assert calls['Quaternion.mulq']['calls'] == 1
+        assert calls['Matrix.multv']['calls'] == 1
+        assert calls['TriangleGroup._addTriangle']['calls'] == g.nFaces()
+        assert calls['Vector.cross']['seconds'] >= 0
+
+        text = Instrumentation.report(reset=True)
+        assert 'Quaternion.mulq' in text and 'TriangleGroup' in text
+        assert Instrumentation.snapshot()['calls'] == {}
+
+    def testStaticMethods(self):
+        'Test that static hot methods keep working when instrumented.'
+        g = TriangleGroup.tetrahedron()
+        with Instrumentation.collecting():
+            h = TriangleGroup.readStl(StringIO(g.toStl()))
+            x = BatchSolver.solve(2, [ 2, 0, 0, 4 ], [ 1, 1 ])
+        assert h.nFaces() == g.nFaces()
+        assert list(x) == [ 0.5, 0.25 ]
+        calls = Instrumentation.snapshot()['calls']
+        assert calls['TriangleGroup.readStl']['calls'] == 1
+        assert calls['BatchSolver.solve']['calls'] == 1
+
+    def testNesting(self):
+        'Test nested and pre-enabled collection.'
+        with Instrumentation.collecting():
+            with Instrumentation.collecting(reset=False):
+                Vector(1, 2, 3)
+            assert Instrumentation.isEnabled()
+            Vector(1, 2, 3)
+        assert not Instrumentation.isEnabled()
+        assert Instrumentation.mAllocations['Vector'] == 2
+
+        Instrumentation.enable()
+        with Instrumentation.collecting():
+            pass
+        assert Instrumentation.isEnabled()
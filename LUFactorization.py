@@ -0,0 +1,194 @@
+#!/usr/bin/python
+
+# Disable some pylint messages
+# pylint: disable=C0103,R0201,R0904,W0511,W0212
+# C0103 : Invalid name "%s" (should match %s)
+# R0201 : Method could be a function
+# R0904 : Too many public methods
+# W0511 : TODO/FIXME/XXX
+# W0212 : Access to a protected member %s of a client class
+
+"""
+LUFactorization definition.
+"""
+
+import unittest
+import math
+from array import array
+from Vector import Vector
+from Matrix import Matrix
+
+########################################################################
+class LUFactorization:
+
+    """
+    LUFactorization : the LU decomposition of a square matrix, computed
+    once by Matrix.ludecomp() and then reused for any number of solves.
+
+    The factorization works on a copy of the matrix, unless overwrite=True
+    is passed, in which case the matrix itself is replaced by its LU
+    decomposition, as Matrix.ludecomp() does, to save the copy.
+    """
+
+    def __init__(self, matrix, overwrite=False):
+        """Factor a square matrix. Raises ValueError if the matrix has a
+        row of zeros, and TypeError if it is not square."""
+        (nrows, ncols) = matrix.size()
+        if nrows != ncols:
+            raise TypeError('Cannot factor a %sx%s matrix.' % (nrows, ncols))
+        if overwrite:
+            self.mLU = matrix
+        else:
+            self.mLU = matrix.clone()
+        (self.mIndex, self.mSign) = self.mLU.ludecomp()
+        self.mN = nrows
+
+    def size(self):
+        """Return the order of the factored matrix."""
+        return self.mN
+
+    def solve(self, b):
+        """Solve [A] * x = b for x, returning a Vector. b is not
+        modified."""
+        if len(b) != self.mN:
+            raise TypeError(
+                "Incompatible object sizes: %sx%s matrix and %s vector" %
+                (self.mN, self.mN, len(b)))
+        x = [ float(e) for e in b ]
+        return Vector._fromList(self.mLU.lubacksub(self.mIndex, x))
+
+    def solveMany(self, B):
+        """Solve [A] * [X] = [B] for [X], where each column of the matrix
+        [B] is a right hand side, returning [X] as a Matrix.
+
+        The substitutions are run on whole rows of [B] at a time, so each
+        step of the loop over the factors handles every right hand side.
+        """
+        (nrows, ncols) = B.size()
+        n = self.mN
+        if nrows != n:
+            raise TypeError(
+                "Incompatible object sizes: %sx%s matrix and %sx%s matrix" %
+                (n, n, nrows, ncols))
+        a = self.mLU._contiguous()
+        b = B._contiguous()
+        X = [ b[i*ncols:(i+1)*ncols].tolist() for i in range(n) ]
+
+        # Forward substitution with the unit lower triangle, applying the
+        # row interchanges in the same order as Matrix.lubacksub().
+        for i in range(n):
+            ip = self.mIndex[i]
+            (X[i], X[ip]) = (X[ip], X[i])
+            xi = X[i]
+            for j in range(i):
+                lij = a[i*n + j]
+                if lij != 0.0:
+                    xi = [ s - lij * t for (s, t) in zip(xi, X[j]) ]
+            X[i] = xi
+
+        # Back substitution with the upper triangle.
+        for i in range(n-1, -1, -1):
+            xi = X[i]
+            for j in range(i+1, n):
+                uij = a[i*n + j]
+                if uij != 0.0:
+                    xi = [ s - uij * t for (s, t) in zip(xi, X[j]) ]
+            r = 1.0 / a[i*n + i]
+            X[i] = [ s * r for s in xi ]
+
+        c = array('d')
+        for row in X:
+            c.extend(row)
+        return Matrix._fromArray(n, ncols, c)
+
+    def determinant(self):
+        """Return the determinant of the factored matrix."""
+        a = self.mLU._contiguous()
+        d = self.mSign
+        for i in range(self.mN):
+            d *= a[i*self.mN + i]
+        return d
+
+    def logAbsDet(self):
+        """Return the natural log of the absolute value of the
+        determinant. Unlike determinant(), this does not overflow or
+        underflow for large matrices."""
+        a = self.mLU._contiguous()
+        return sum([ math.log(abs(a[i*self.mN + i]))
+                     for i in range(self.mN) ])
+
+    def inverse(self):
+        """Return the inverse of the factored matrix."""
+        return self.solveMany(Matrix.identity(self.mN))
+
+########################################################################
+# LUFactorization tests
+class LUFactorizationTest(unittest.TestCase):
+
+    """Unit tests for LUFactorization."""
+
+    def setUp(self):
+        'Set up a test system.'
+        self.mA = Matrix([2, 1, 1], [4, -6, 0], [-2, 7, 2])
+
+    def testSolve(self):
+        'Test single and multiple right hand sides.'
+        lu = LUFactorization(self.mA)
+        assert self.mA == [[2, 1, 1], [4, -6, 0], [-2, 7, 2]]
+        assert lu.size() == 3
+        b = Vector(5, -2, 9)
+        assert lu.solve(b).round(12) == [ 1, 1, 2 ]
+        assert b == [ 5, -2, 9 ]
+        assert lu.solve([ 0, 0, 1 ]).round(12) == \
+            lu.solve(Vector(0, 0, 1)).round(12)
+
+        B = Matrix([5, 0, 1], [-2, 0, 2], [9, 1, 3])
+        X = lu.solveMany(B)
+        assert X.size() == (3, 3)
+        assert self.mA.multm(X).round(12) == B
+        for j in range(3):
+            assert X.getColumn(j).round(12) == \
+                lu.solve(B.getColumn(j)).round(12)
+
+        for call in (lambda: lu.solve(Vector(1, 2)),
+                     lambda: lu.solveMany(Matrix.identity(2)),
+                     lambda: LUFactorization(Matrix([1, 2, 3]))):
+            hitError = False
+            try:
+                call()
+            except TypeError:
+                hitError = True
+            assert hitError
+
+    def testDeterminantAndInverse(self):
+        'Test the determinant and inverse.'
+        lu = LUFactorization(self.mA)
+        assert round(lu.determinant(), 12) == -16
+        assert round(lu.logAbsDet() - math.log(16), 12) == 0
+        assert self.mA.multm(lu.inverse()).round(12) == Matrix.identity(3)
+
+        A = Matrix([0, 1], [1, 0])
+        assert LUFactorization(A).determinant() == -1
+
+        big = Matrix.identity(60)
+        big.scale(1e6)
+        lu = LUFactorization(big)
+        assert lu.determinant() == float('inf')
+        assert round(lu.logAbsDet() - 60 * math.log(1e6), 9) == 0
+
+    def testOverwrite(self):
+        'Test factoring in place.'
+        A = self.mA.clone()
+        lu = LUFactorization(A)
+        assert A == self.mA
+        lu = LUFactorization(A, overwrite=True)
+        assert lu.mLU is A
+        assert A != self.mA
+        assert lu.solve([ 5, -2, 9 ]).round(12) == [ 1, 1, 2 ]
+
+        hitError = False
+        try:
+            LUFactorization(Matrix([1, 2], [0, 0]))
+        except ValueError:
+            hitError = True
+        assert hitError
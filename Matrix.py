@@ -14,16 +14,92 @@ Matrix definition.
 
 import unittest
 import math
+import operator
+from array import array
 from Vector import Vector
 from MathUtil import MathUtil
+from Backend import Backend
+
+# Matrix products with a longer inner dimension than this are computed in
+# tiles of this many elements.
+MULTM_BLOCK = 256
+
+# Strassen's multiply hands blocks of this many rows or fewer to the classic
+# kernel. Its results agree with the classic multiply of n x n matrices a
+# and b within STRASSEN_TOLERANCE * n * max|a| * max|b| per element.
+STRASSEN_CUTOFF = 64
+STRASSEN_TOLERANCE = 1e-12
+
+########################################################################
+class _MatrixRow:
+
+    """A live view of one row of a Matrix, so that m[i][j] reads and
+    writes the matrix element directly."""
+
+    def __init__(self, matrix, row):
+        self.mMatrix = matrix
+        self.mRow = row
+
+    def __len__(self):
+        return self.mMatrix.mNCols
+
+    def _offset(self, j):
+        """Return the position of element j of this row in the matrix
+        storage."""
+        m = self.mMatrix
+        if j < 0:
+            j += m.mNCols
+        if j < 0 or j >= m.mNCols:
+            raise IndexError('Index out of bounds : %s' % j)
+        return self.mRow * m.mRowStride + j * m.mColStride
+
+    def __getitem__(self, j):
+        if isinstance(j, slice):
+            return [ self[k] for k in range(*j.indices(len(self))) ]
+        return self.mMatrix.mV[self._offset(j)]
+
+    def __setitem__(self, j, value):
+        m = self.mMatrix
+        m._own()
+        m.mV[self._offset(j)] = value
+
+    def __iter__(self):
+        for j in range(len(self)):
+            yield self[j]
+
+    def __eq__(self, row):
+        return list(self) == list(row)
+
+    def __ne__(self, row):
+        return not self.__eq__(row)
+
+    def __str__(self):
+        return str(list(self))
+
+    __repr__ = __str__
 
 ########################################################################
 class Matrix:
 
     """
     Matrix : a two-dimensional array of numbers, or a vector of row vectors.
+
+    The elements are stored in a single flat array('d'), and element
+    (i, j) lives at mV[i * mRowStride + j * mColStride]. A matrix normally
+    has row-major strides (mNCols, 1), but clone() and transpose() return
+    views which share the storage of the original (the transpose with its
+    strides swapped) instead of copying it. Storage is copied, and put
+    back in row-major order, the first time a shared matrix is modified,
+    so these views behave exactly like independent copies.
+
+    m[i] returns a live view of row i, so m[i][j] reads and writes
+    elements as it would for a list of rows.
     """
 
+    # Algorithms for multm()
+    CLASSIC = 'classic'
+    STRASSEN = 'strassen'
+
     def __init__(self, *args, **kwargs):
         """Initialize a matrix with the passed elements. The arguments
         list is assumed to be a number of row objects, which are each
@@ -36,8 +112,8 @@ class Matrix:
         the passed rows must all be the same size."""
         self.mNRows = 0
         self.mNCols = 0
-        self.mV = [] # Matrix row data
         self.mPrintSpec = '%f' # String formatter for elements
+        rows = [] # Matrix row data
 
         # Read the arguments list and add the data
         if (args is not None) and (len(args) > 0) :
@@ -47,7 +123,7 @@ class Matrix:
                 newrow = [ float(f) for f in row ]
                 if len(newrow) < self.mNCols :
                     newrow.extend([0.0]*(self.mNCols - len(newrow)))
-                self.mV.append(newrow)
+                rows.append(newrow)
 
         # Now read the keyword arguments
         kwrows = None
@@ -76,22 +152,78 @@ class Matrix:
         if kwrows is not None:
             rownum = self.mNRows
             while rownum < kwrows:
-                self.mV.append([0.0]*self.mNCols)
+                rows.append([0.0]*self.mNCols)
                 rownum += 1
             self.mNRows = kwrows
 
         # Pad out the columns
         if kwcols is not None:
             nextra = kwcols - self.mNCols
-            for row in self.mV:
+            for row in rows:
                 row.extend([0.0]*nextra)
             self.mNCols = kwcols
 
+        self.mV = array('d') # Matrix element data
+        for row in rows:
+            self.mV.extend(row)
+        self.mRowStride = self.mNCols
+        self.mColStride = 1
+        self.mShared = False # True if mV may be shared with another matrix
+
+    @staticmethod
+    def _fromArray(nrows, ncols, data):
+        """Wrap a row-major array('d') of nrows * ncols elements in a new
+        Matrix, without copying it."""
+        m = Matrix()
+        m.mNRows = nrows
+        m.mNCols = ncols
+        m.mV = data
+        m.mRowStride = ncols
+        return m
+
+    @staticmethod
+    def _zeros(nrows, ncols):
+        """Return a new nrows x ncols matrix of zeros."""
+        return Matrix._fromArray(nrows, ncols,
+                                 array('d', [ 0.0 ]) * (nrows * ncols))
+
+    def _contiguous(self):
+        """Return the element storage in row-major order, first copying
+        the elements out of a strided view if necessary."""
+        nrows = self.mNRows
+        ncols = self.mNCols
+        rs = self.mRowStride
+        cs = self.mColStride
+        if (rs == ncols or nrows <= 1) and (cs == 1 or ncols <= 1):
+            self.mRowStride = ncols
+            self.mColStride = 1
+            return self.mV
+        d = self.mV
+        out = array('d', [ 0.0 ]) * (nrows * ncols)
+        for i in range(nrows):
+            out[i*ncols:(i+1)*ncols] = d[i*rs:i*rs + ncols*cs:cs]
+        self.mV = out
+        self.mRowStride = ncols
+        self.mColStride = 1
+        self.mShared = False
+        return out
+
+    def _own(self):
+        """Make sure that this matrix has row-major storage which is not
+        shared with any other matrix, before modifying it. Returns the
+        storage."""
+        d = self._contiguous()
+        if self.mShared:
+            d = array('d', d)
+            self.mV = d
+            self.mShared = False
+        return d
+
     def __str__(self):
         """Return the string representation of this matrix."""
         rv = '[ '
         first = True
-        for row in self.mV:
+        for row in self:
             if not first:
                 rv += '\n  '
             else:
@@ -103,30 +235,47 @@ class Matrix:
 
     @staticmethod
     def identity(size):
-        """Return an square identity matrix of the indicated size, 
+        """Return an square identity matrix of the indicated size,
         e.g. a 3x3 identity matrix is returned by a call to
         identity(3)."""
-        m = Matrix(rows=size, cols=size)
-        for i in range(0, size):
-            m[i][i] = 1.0
+        m = Matrix._zeros(size, size)
+        m.mV[::size+1] = array('d', [ 1.0 ]) * size
         return m
 
-    def clone(self): 
-        """Return a copy of this matrix."""
-        v = [ r[:] for r in self.mV ]
-        return Matrix(*v)
+    def clone(self):
+        """Return a copy of this matrix. The copy shares storage with this
+        matrix until either one is modified."""
+        m = Matrix._fromArray(self.mNRows, self.mNCols, self.mV)
+        m.mRowStride = self.mRowStride
+        m.mColStride = self.mColStride
+        m.mPrintSpec = self.mPrintSpec
+        m.mShared = self.mShared = True
+        return m
 
     def size(self):
         """Return a tuple indicating size in (rows,cols)."""
         return (self.mNRows, self.mNCols)
 
     def __getitem__(self, index):
-        """Get the item at index."""
-        return self.mV.__getitem__(index)
+        """Get the item at index. This is a live view of the row."""
+        if isinstance(index, slice):
+            return [ self[i] for i in range(*index.indices(self.mNRows)) ]
+        if index < 0:
+            index += self.mNRows
+        if index < 0 or index >= self.mNRows:
+            raise IndexError('Index out of bounds : %s' % index)
+        return _MatrixRow(self, index)
 
     def __setitem__(self, key, value):
         """Set the item at index to value."""
-        self.mV.__setitem__(key, value)
+        if key < 0:
+            key += self.mNRows
+        if key < 0 or key >= self.mNRows:
+            raise IndexError('Index out of bounds : %s' % key)
+        if len(value) != self.mNCols:
+            raise IndexError('Row must have %s elements.' % self.mNCols)
+        n = self.mNCols
+        self._own()[key*n:(key+1)*n] = array('d', [ float(e) for e in value ])
 
     def __eq__(self, m):
         """Equality operator"""
@@ -134,14 +283,15 @@ class Matrix:
         # the right size, we'll error out on the loop.
         if not(isinstance(m, list)) and (self.size() != m.size()):
             return False
-        i = 0
-        for row in self.mV:
-            j = 0
-            for element in row:
-                if element != m[i][j]:
+        d = self._contiguous()
+        if isinstance(m, Matrix):
+            return d == m._contiguous()
+        n = self.mNCols
+        for i in range(self.mNRows):
+            row = m[i]
+            for j in range(n):
+                if d[i*n + j] != row[j]:
                     return False
-                j += 1
-            i += 1
         return True
 
     def __ne__(self, m):
@@ -155,40 +305,37 @@ class Matrix:
         if (self.size() != m.size()):
             raise TypeError('Cannot add dissimilar matrices.')
         nrows, ncols = self.size()
-        rv = Matrix(rows=nrows, cols=ncols)
-        v = []
-        for i in range(0, nrows):
-            r = []
-            for j in range(0, ncols):
-                r.append(self.mV[i][j] + m.mV[i][j])
-            v.append(r)
-        rv.mV = v
-        return rv
+        return Matrix._fromArray(nrows, ncols, array('d', map(
+            operator.add, self._contiguous(), m._contiguous())))
 
     def scale(self, scalar):
         """Multiply a matrix by a scale factor."""
-        self.mV = [ [ e * float(scalar) for e in row ] for row in self.mV ]
+        s = float(scalar)
+        self.mV = array('d', [ e * s for e in self._contiguous() ])
+        self.mShared = False
 
     def mults(self, scalar):
         'Multiply vector by a scalar, return a new vector'
-        r = Matrix(rows = self.mNRows, cols = self.mNCols)
-        r.mV = [ [ e * float(scalar) for e in row ] for row in self.mV ]
-        return r
+        s = float(scalar)
+        return Matrix._fromArray(self.mNRows, self.mNCols, array(
+            'd', [ e * s for e in self._contiguous() ]))
 
     def getRow(self, index):
         """Get a copy of a row of the matrix, as a Vector."""
         if (index < 0) or (index >= self.mNRows):
             raise IndexError('Index out of bounds : %s' % index)
 
-        return Vector.fromSequence(self.mV[index])
+        n = self.mNCols
+        return Vector._fromList(
+            self._contiguous()[index*n:(index+1)*n].tolist())
 
     def getColumn(self, index):
         """Get a copy of a column of the matrix, as a Vector."""
         if (index < 0) or (index >= self.mNCols):
             raise IndexError('Index out of bounds : %s' % index)
 
-        return Vector.fromSequence([self.mV[i][index] 
-                                    for i in range(0, self.mNRows)])
+        return Vector._fromList(
+            self._contiguous()[index::self.mNCols].tolist())
 
     def multv(self, v):
         """Multiply a matrix by a vector, returning a Vector:
@@ -197,59 +344,215 @@ class Matrix:
         """
         if self.mNCols != len(v):
             raise TypeError(
-                "Incompatible object sizes: %sx%s matrix and %s vector" % 
+                "Incompatible object sizes: %sx%s matrix and %s vector" %
                 (self.mNRows, self.mNCols, len(v)))
-        V = Vector(size=self.mNRows)
-        for i in range(0, self.mNRows):
-            V[i] = sum([ self[i][j] * v[j] for j in range(0, self.mNCols) ])
-        return V
-
-    def multm(self, m):
+        d = self._contiguous()
+        n = self.mNCols
+        k = Backend.mKernels
+        if k is not None:
+            return Vector._fromList(k.multv(d, self.mNRows, n, v))
+        x = v[:]
+        mul = operator.mul
+        return Vector._fromList([ sum(map(mul, d[i*n:(i+1)*n], x))
+                                  for i in range(self.mNRows) ])
+
+    def multm(self, m, algorithm=CLASSIC, cutoff=None):
         """Multiply a matrix by a matrix, returning a matrix:
 
         M = self * m
+
+        The result is the same as the textbook triple loop
+        (Matrix._multmNaive) up to rounding, since the products are summed
+        in a different order.
+
+        algorithm=Matrix.STRASSEN selects Strassen's recursive multiply for
+        square matrices, which does 7 half-size products per level instead
+        of 8. Blocks of cutoff rows or fewer (STRASSEN_CUTOFF by default)
+        are multiplied with the classic kernel, and sizes which do not
+        halve evenly down to the cutoff are padded with zeros. The Strassen
+        product differs from the classic one by rounding error only: each
+        element agrees within STRASSEN_TOLERANCE * n * max|a| * max|b|.
+        Other shapes, and any selected Backend, always use the classic
+        algorithm. Raises ValueError if cutoff is less than 1.
         """
+        if not isinstance(m, Matrix):
+            # A fixed-size type, such as Matrix3
+            m = m.toMatrix()
         if self.mNCols != m.mNRows:
             raise TypeError(
                 "Incompatible object sizes: %sx%s matrix and %sx%s matrix" %
                 (self.mNRows,self.mNCols,m.mNRows,m.mNCols))
-        M = Matrix(rows=self.mNRows, cols=m.mNCols)
+        if algorithm not in (Matrix.CLASSIC, Matrix.STRASSEN):
+            raise ValueError("algorithm '%s' not recognized" % algorithm)
+        if cutoff is None:
+            cutoff = STRASSEN_CUTOFF
+        elif cutoff < 1:
+            raise ValueError('cutoff must be >= 1, not %s' % cutoff)
+        a = self._contiguous()
+        b = m._contiguous()
+        (nrows, ninner, ncols) = (self.mNRows, self.mNCols, m.mNCols)
+        k = Backend.mKernels
+        if k is not None:
+            return Matrix._fromArray(nrows, ncols,
+                                     k.multm(a, b, nrows, ninner, ncols))
+
+        if algorithm == Matrix.STRASSEN and nrows == ninner == ncols:
+            return Matrix._fromArray(nrows, ncols, Matrix._multmStrassen(
+                a, b, nrows, cutoff))
+
+        if ninner > MULTM_BLOCK:
+            c = Matrix._multmBlocked(a, b, nrows, ninner, ncols)
+        else:
+            c = Matrix._multmTransposed(a, b, nrows, ninner, ncols)
+        return Matrix._fromArray(nrows, ncols, c)
 
-        # TODO: This could be optimized.
-        for i in range(0, self.mNRows):
-            for j in range(0, m.mNCols):
+    @staticmethod
+    def _multmNaive(a, b, nrows, ninner, ncols):
+        """Reference kernel for multm(): the textbook i-j-k loop over the
+        flat row-major arrays a and b. Returns the row-major product."""
+        c = array('d', [ 0.0 ]) * (nrows * ncols)
+        for i in range(0, nrows):
+            for j in range(0, ncols):
                 d = 0.0
-                for k in range(0, self.mNCols):
-                    d += self.mV[i][k] * m.mV[k][j]
-                M.mV[i][j] = d
-        
-        return M
+                for k in range(0, ninner):
+                    d += a[i*ninner + k] * b[k*ncols + j]
+                c[i*ncols + j] = d
+        return c
+
+    @staticmethod
+    def _multmTransposed(a, b, nrows, ninner, ncols):
+        """Kernel for multm(): the columns of b are gathered once into
+        lists, so that each element of the product is a single dot
+        product run by map() and sum() instead of an interpreted loop."""
+        mul = operator.mul
+        cols = [ b[j::ncols].tolist() for j in range(ncols) ]
+        c = array('d')
+        for i in range(nrows):
+            row = a[i*ninner:(i+1)*ninner].tolist()
+            c.extend([ sum(map(mul, row, col)) for col in cols ])
+        return c
+
+    @staticmethod
+    def _multmBlocked(a, b, nrows, ninner, ncols, block=None):
+        """Kernel for multm() on large matrices: as _multmTransposed(), but
+        the inner dimension is cut into tiles of MULTM_BLOCK elements, so
+        that one tile of the columns of b is reused by every row of a while
+        it is still in cache. Each element of the product is the sum of
+        the partial dot products of the tiles."""
+        if block is None:
+            block = MULTM_BLOCK
+        mul = operator.mul
+        add = operator.add
+        acc = [ [ 0.0 ] * ncols for i in range(nrows) ]
+        for k0 in range(0, ninner, block):
+            k1 = min(k0 + block, ninner)
+            cols = [ b[k0*ncols + j:k1*ncols:ncols].tolist()
+                     for j in range(ncols) ]
+            for i in range(nrows):
+                row = a[i*ninner + k0:i*ninner + k1].tolist()
+                acc[i] = map(add, acc[i],
+                             [ sum(map(mul, row, col)) for col in cols ])
+        c = array('d')
+        for row in acc:
+            c.extend(row)
+        return c
+
+    @staticmethod
+    def _multmStrassen(a, b, n, cutoff):
+        """Kernel for multm(algorithm=STRASSEN) on the flat row-major n x n
+        arrays a and b. The matrices are padded to the smallest size which
+        halves evenly down to a block of cutoff rows or fewer, multiplied
+        recursively as lists of rows, and the product cut back to n x n."""
+        size = n
+        levels = 0
+        while size > cutoff:
+            size = (size + 1) // 2
+            levels += 1
+        size <<= levels
+        pad = [ 0.0 ] * (size - n)
+        A = [ a[i*n:(i+1)*n].tolist() + pad for i in range(n) ]
+        B = [ b[i*n:(i+1)*n].tolist() + pad for i in range(n) ]
+        A.extend([ [ 0.0 ] * size for i in range(size - n) ])
+        B.extend([ [ 0.0 ] * size for i in range(size - n) ])
+        c = array('d')
+        for row in Matrix._strassen(A, B, size, cutoff)[:n]:
+            c.extend(row[:n])
+        return c
+
+    @staticmethod
+    def _strassen(A, B, n, cutoff):
+        """Multiply the n x n matrices A and B, given as lists of rows, by
+        Strassen's recursion. n must halve evenly down to cutoff or
+        below."""
+        mul = operator.mul
+        if n <= cutoff:
+            cols = zip(*B)
+            return [ [ sum(map(mul, row, col)) for col in cols ]
+                     for row in A ]
+
+        add = operator.add
+        sub = operator.sub
+        def plus(X, Y):
+            'Return the sum of two blocks.'
+            return [ map(add, x, y) for (x, y) in zip(X, Y) ]
+        def minus(X, Y):
+            'Return the difference of two blocks.'
+            return [ map(sub, x, y) for (x, y) in zip(X, Y) ]
+
+        h = n // 2
+        A11 = [ row[:h] for row in A[:h] ]
+        A12 = [ row[h:] for row in A[:h] ]
+        A21 = [ row[:h] for row in A[h:] ]
+        A22 = [ row[h:] for row in A[h:] ]
+        B11 = [ row[:h] for row in B[:h] ]
+        B12 = [ row[h:] for row in B[:h] ]
+        B21 = [ row[:h] for row in B[h:] ]
+        B22 = [ row[h:] for row in B[h:] ]
+
+        strassen = Matrix._strassen
+        M1 = strassen(plus(A11, A22), plus(B11, B22), h, cutoff)
+        M2 = strassen(plus(A21, A22), B11, h, cutoff)
+        M3 = strassen(A11, minus(B12, B22), h, cutoff)
+        M4 = strassen(A22, minus(B21, B11), h, cutoff)
+        M5 = strassen(plus(A11, A12), B22, h, cutoff)
+        M6 = strassen(minus(A21, A11), plus(B11, B12), h, cutoff)
+        M7 = strassen(minus(A12, A22), plus(B21, B22), h, cutoff)
+
+        C11 = plus(minus(plus(M1, M4), M5), M7)
+        C12 = plus(M3, M5)
+        C21 = plus(M2, M4)
+        C22 = plus(plus(minus(M1, M2), M3), M6)
+        return ([ x + y for (x, y) in zip(C11, C12) ] +
+                [ x + y for (x, y) in zip(C21, C22) ])
 
     @staticmethod
     def vectorOuterProduct(v1, v2):
         'Compute the vector outer product (or tensor product) of two vectors.'
         rows = len(v1)
         cols = len(v2)
-        m = Matrix(rows=rows, cols=cols)
+        data = array('d')
+        x = [ float(e) for e in v2 ]
         for i in range(rows):
-            for j in range(cols):
-                m[i][j] = v1[i] * v2[j]
-        return m
+            a = v1[i]
+            data.extend([ a * e for e in x ])
+        return Matrix._fromArray(rows, cols, data)
 
     def transpose(self):
-        """Return a new matrix which is the transpose of this matrix."""
-        r = Matrix(rows=self.mNCols, cols=self.mNRows)
-        for i in range(self.mNRows):
-            for j in range(self.mNCols):
-                r.mV[j][i] = self.mV[i][j]
+        """Return a new matrix which is the transpose of this matrix. This
+        is a view with the row and column strides swapped, so it takes
+        constant time; the elements are only rearranged if the transpose
+        is used in a computation or modified."""
+        r = Matrix._fromArray(self.mNCols, self.mNRows, self.mV)
+        r.mRowStride = self.mColStride
+        r.mColStride = self.mRowStride
+        r.mShared = self.mShared = True
         return r
 
     def round(self, places): # Returns reference to self
         """Round all the elements of this matrix to the specified number
         of decimal places."""
-        for row in self.mV:
-            for i in range(self.mNCols):
-                row[i] = round(row[i], places)
+        self.mV = array('d', [ round(e, places) for e in self._contiguous() ])
+        self.mShared = False
         return self
 
     @staticmethod
@@ -257,21 +560,27 @@ class Matrix:
         """Given an angle in degrees, compute the rotation matrix
         about the Z axis."""
         (s, c) = MathUtil.getSinCos(angle_in_degrees)
-        return Matrix([c, -s, 0], [s, c, 0], [0, 0, 1])
+        return Matrix._fromArray(3, 3, array('d', [ c,   -s,  0.0,
+                                                   s,   c,   0.0,
+                                                   0.0, 0.0, 1.0 ]))
 
     @staticmethod
     def rotationMatrixForX(angle_in_degrees):
         """Given an angle in degrees, compute the rotation matrix
         about the X axis."""
         (s, c) = MathUtil.getSinCos(angle_in_degrees)
-        return Matrix([1, 0, 0], [0, c, -s], [0, s, c])
+        return Matrix._fromArray(3, 3, array('d', [ 1.0, 0.0, 0.0,
+                                                   0.0, c,   -s,
+                                                   0.0, s,   c ]))
 
     @staticmethod
     def rotationMatrixForY(angle_in_degrees):
         """Given an angle in degrees, compute the rotation matrix
         about the Y axis."""
         (s, c) = MathUtil.getSinCos(angle_in_degrees)
-        return Matrix([c, 0, s], [0, 1, 0], [-s, 0, c])
+        return Matrix._fromArray(3, 3, array('d', [ c,   0.0, s,
+                                                   0.0, 1.0, 0.0,
+                                                   -s,  0.0, c ]))
 
     @staticmethod
     def azimuthAltitude(azimuth_degrees, altitude_degrees):
@@ -282,9 +591,12 @@ class Matrix:
         if altitude_degrees < -90.0 or altitude_degrees > 90.0:
             raise ValueError(
                 'altitude_degrees must be in the range [-90,+90].')
-        A = Matrix.rotationMatrixForY(-altitude_degrees)
-        B = Matrix.rotationMatrixForZ(azimuth_degrees)
-        return B.multm(A)
+        # The product RotZ(azimuth) * RotY(-altitude), written out.
+        (sa, ca) = MathUtil.getSinCos(azimuth_degrees)
+        (sl, cl) = MathUtil.getSinCos(altitude_degrees)
+        return Matrix._fromArray(3, 3, array('d', [ ca * cl, -sa, -ca * sl,
+                                                    sa * cl, ca, -sa * sl,
+                                                    sl, 0.0, cl ]))
 
     def ludecomp(self): # Returns (index[], d)
         """
@@ -314,8 +626,16 @@ class Matrix:
         _Numerical Recipes in C, 2nd ed._
         """
 
-        d = 1.0
+        a = self._own()
         n = self.mNRows
+
+        k = Backend.mKernels
+        if k is not None:
+            (lu, index, d) = k.ludecomp(a, n)
+            a[:] = lu
+            return (index, d)
+
+        d = 1.0
         vv = [ 0 ] * n
         index = [ 0 ] * n
         imax = -1
@@ -324,43 +644,43 @@ class Matrix:
         for i in range(n):
             big = 0.0
             for j in range(n):
-                temp = abs(self.mV[i][j])
+                temp = abs(a[i*n + j])
                 if temp > big:
                     big = temp
             if big == 0.0:
                 raise ValueError('Singular matrix error')
-            vv[i] = big
+            vv[i] = 1.0 / big
 
         for j in range(n):
             for i in range(j):
-                csum = self.mV[i][j]
+                csum = a[i*n + j]
                 for k in range(i):
-                    csum -= self.mV[i][k] * self.mV[k][j]
-                self.mV[i][j] = csum
+                    csum -= a[i*n + k] * a[k*n + j]
+                a[i*n + j] = csum
             big = 0.0
             for i in range(j, n):
-                csum = self.mV[i][j]
+                csum = a[i*n + j]
                 for k in range(j):
-                    csum -= self.mV[i][k] * self.mV[k][j]
-                self.mV[i][j] = csum
+                    csum -= a[i*n + k] * a[k*n + j]
+                a[i*n + j] = csum
                 dum = vv[i] * abs(csum)
                 if dum >= big:
                     big = dum
                     imax = i
             if j != imax:
                 for k in range(n):
-                    dum = self.mV[imax][k]
-                    self.mV[imax][k] = self.mV[j][k]
-                    self.mV[j][k] = dum
+                    dum = a[imax*n + k]
+                    a[imax*n + k] = a[j*n + k]
+                    a[j*n + k] = dum
                 d = -d
                 vv[imax] = vv[j]
             index[j] = imax
-            if self.mV[j][j] == 0:
-                self.mV[j][j] = TINY
+            if a[j*n + j] == 0:
+                a[j*n + j] = TINY
             if j != n:
-                dum = 1.0 / (self.mV[j][j])
+                dum = 1.0 / (a[j*n + j])
                 for i in range(j+1, n):
-                    self.mV[i][j] *= dum
+                    a[i*n + j] *= dum
 
         return (index, d)
 
@@ -380,25 +700,26 @@ class Matrix:
         This function will return the vector x.
         """
 
-        ii = 0
+        ii = -1 # First nonzero element of b, once found
         n = self.mNRows
+        a = self._contiguous()
 
         for i in range(n):
             ip = index[i]
             sum = b[ip]
             b[ip] = b[i]
-            if ii != 0:
+            if ii != -1:
                 for j in range(ii, i):
-                    sum -= self.mV[i][j] * b[j]
+                    sum -= a[i*n + j] * b[j]
             elif sum != 0:
                 ii = i
             b[i] = sum
-            
+
         for i in range(n-1, -1, -1):
             sum = b[i]
             for j in range(i+1, n):
-                sum -= self.mV[i][j] * b[j]
-            b[i] = sum / self.mV[i][i]
+                sum -= a[i*n + j] * b[j]
+            b[i] = sum / a[i*n + i]
 
         return b
 
@@ -617,6 +938,58 @@ class MatrixTest(unittest.TestCase):
 
         assert hitError
 
+    def testMultmKernels(self):
+        'Test the optimized multiply kernels against the reference.'
+        import random
+        rng = random.Random(5)
+        (n, m, p) = (7, 11, 5)
+        a = array('d', [ rng.uniform(-1, 1) for i in range(n * m) ])
+        b = array('d', [ rng.uniform(-1, 1) for i in range(m * p) ])
+        c0 = Matrix._multmNaive(a, b, n, m, p)
+        for c in (Matrix._multmTransposed(a, b, n, m, p),
+                  Matrix._multmBlocked(a, b, n, m, p, 4),
+                  Matrix._multmBlocked(a, b, n, m, p, 11),
+                  Matrix._multmBlocked(a, b, n, m, p)):
+            assert len(c) == n * p
+            assert max([ abs(x - y) for (x, y) in zip(c, c0) ]) < 1e-12
+
+        A = Matrix._fromArray(n, m, a)
+        B = Matrix._fromArray(m, p, b)
+        assert A.multm(B).round(9) == \
+            Matrix._fromArray(n, p, c0).round(9)
+        assert Matrix(rows=3, cols=0).multm(Matrix(rows=0, cols=2)) == \
+            Matrix(rows=3, cols=2)
+
+    def testStrassen(self):
+        'Test the Strassen multiply against the classic multiply.'
+        import random
+        rng = random.Random(8)
+        for (n, cutoff) in ((1, 1), (6, 2), (13, 4), (40, 64)):
+            A = Matrix._fromArray(n, n, array(
+                'd', [ rng.uniform(-2, 2) for i in range(n * n) ]))
+            B = Matrix._fromArray(n, n, array(
+                'd', [ rng.uniform(-3, 3) for i in range(n * n) ]))
+            C = A.multm(B)
+            S = A.multm(B, Matrix.STRASSEN, cutoff)
+            assert S.size() == (n, n)
+            bound = STRASSEN_TOLERANCE * n * 2 * 3
+            assert max([ abs(x - y) for (x, y) in zip(C.mV, S.mV) ]) < bound
+
+        m1 = Matrix([1, 2, 3], [4, 5, 6])
+        m2 = Matrix([1, 2], [3, 4], [5, 6])
+        assert m1.multm(m2, Matrix.STRASSEN) == m1.multm(m2)
+
+        A = Matrix.identity(4)
+        for call in (lambda: m1.multm(m2, 'winograd'),
+                     lambda: A.multm(A, Matrix.STRASSEN, 0),
+                     lambda: A.multm(A, Matrix.STRASSEN, -1)):
+            hitError = False
+            try:
+                call()
+            except ValueError:
+                hitError = True
+            assert hitError
+
     def testTranspose(self):
         'Test transpose function.'
         m1 = Matrix([1, 2, 3, 4], [5, 6, 7, 8])
@@ -728,17 +1101,96 @@ class MatrixTest(unittest.TestCase):
         m2[1][0] = -4
         assert m1 != m2
 
+    def testFlatStorage(self):
+        'Test the flat row-major element storage.'
+        m = Matrix([1, 2, 3], [4, 5, 6])
+        assert m.mV.typecode == 'd'
+        assert list(m.mV) == [ 1, 2, 3, 4, 5, 6 ]
+        assert (m.mRowStride, m.mColStride) == (3, 1)
+        m[1] = [ 7, 8, 9 ]
+        assert list(m.mV) == [ 1, 2, 3, 7, 8, 9 ]
+        assert m[-1] == [ 7, 8, 9 ]
+        assert [ list(row) for row in m ] == [[1, 2, 3], [7, 8, 9]]
+
+        hitError = False
+        try:
+            m[0] = [ 1, 2 ]
+        except IndexError:
+            hitError = True
+        assert hitError
+
+    def testRowViews(self):
+        'Test that rows are live views of the matrix.'
+        m = Matrix([1, 2, 3], [4, 5, 6])
+        row = m[0]
+        row[2] = 10
+        assert m.mV[2] == 10
+        m.mV[0] = -1
+        assert row[0] == -1
+        assert len(row) == 3
+        assert row[-1] == 10
+        assert row[1:] == [ 2, 10 ]
+
+        hitError = False
+        try:
+            row[3]
+        except IndexError:
+            hitError = True
+        assert hitError
+
+    def testCopyOnWrite(self):
+        'Test that clones and transposes share storage until modified.'
+        m1 = Matrix([1, 2, 3], [4, 5, 6])
+        m2 = m1.clone()
+        t = m1.transpose()
+        assert m2.mV is m1.mV
+        assert t.mV is m1.mV
+        assert t.size() == (3, 2)
+        assert t[2][1] == 6
+        assert t.getColumn(1) == [ 4, 5, 6 ]
+
+        m1[0][0] = 100
+        assert m2.mV is not m1.mV
+        assert m2[0][0] == 1
+        assert t[0][0] == 1
+
+        t[2][1] = -6
+        assert m2[1][2] == 6
+        assert t == [[1, 4], [2, 5], [3, -6]]
+        assert (t.mRowStride, t.mColStride) == (2, 1)
+        assert t.transpose().transpose() == t
+        assert t.multm(m2) == t.clone().multm(m2.clone())
+
     def testludecomp(self):
-        # TODO: Fix this test and the function under test!
-        return
-        A = Matrix([1, 2, 3], [4, 5, 6], [7, 8, 9])
+        'Test LU decomposition and back-substitution.'
+        A = Matrix([2, 1, 1], [4, -6, 0], [-2, 7, 2])
         m2 = A.clone()
         (index, d) = m2.ludecomp()
-        b = Vector(6, -1, 3)
+        assert A == [[2, 1, 1], [4, -6, 0], [-2, 7, 2]]
+        b = Vector(5, -2, 9)
         x = m2.lubacksub(index, b.clone())
+        assert x.round(12) == [ 1, 1, 2 ]
+        assert A.multv(x).round(12) == b
+
+        # The determinant is the product of the diagonal of U.
+        for i in range(3):
+            d *= m2[i][i]
+        assert round(d, 12) == -16
+
+        # A leading zero in the permuted right hand side.
+        x = m2.lubacksub(index, Vector(0, 0, 1))
+        assert A.multv(x).round(12) == [ 0, 0, 1 ]
+
+        # Implicit pivoting scales each row by its largest element, so
+        # this picks the second row as the first pivot, not the first.
+        A = Matrix([10, 1000], [1, 1])
+        (index, d) = A.clone().ludecomp()
+        assert (index, d) == ([ 1, 1 ], -1.0)
 
-        assert(False)
-        #print "b = %s" % b
-        #print "x = %s" % x
-        #print "A * x = %s" % A.multv(x)
+        hitError = False
+        try:
+            Matrix([1, 2], [0, 0]).ludecomp()
+        except ValueError:
+            hitError = True
+        assert hitError
 
@@ -0,0 +1,399 @@
+#!/usr/bin/python
+
+# Disable some pylint messages
+# pylint: disable=C0103,R0201,R0902,R0904,R0913,W0511,W0212
+# C0103 : Invalid name "%s" (should match %s)
+# R0201 : Method could be a function
+# R0902 : Too many instance attributes
+# R0904 : Too many public methods
+# R0913 : Too many arguments
+# W0511 : TODO/FIXME/XXX
+# W0212 : Access to a protected member %s of a client class
+
+"""
+Matrix3 definition.
+"""
+
+import unittest
+from array import array
+from Vector import Vector
+from Matrix import Matrix
+from MathUtil import MathUtil
+
+_new = object.__new__
+
+########################################################################
+class Matrix3(object):
+
+    """
+    Matrix3 : a 3x3 matrix.
+
+    The nine elements are held in scalar fields, m00 to m22 (row, column),
+    and every operation is written out in full, without loops or index
+    arithmetic. Use it in place of a 3x3 Matrix, e.g. for rotations, where
+    the generic code would spend most of its time on bookkeeping.
+
+    m[i][j] reads an element, as for a Matrix, and toMatrix() and
+    fromMatrix() convert to and from the general type.
+    """
+
+    __slots__ = ('m00', 'm01', 'm02',
+                 'm10', 'm11', 'm12',
+                 'm20', 'm21', 'm22')
+
+    mPrintSpec = '%f' # String formatter for elements
+
+    def __init__(self, m00, m01, m02, m10, m11, m12, m20, m21, m22):
+        """Initialize a matrix from its nine elements, in row order."""
+        self.m00 = float(m00)
+        self.m01 = float(m01)
+        self.m02 = float(m02)
+        self.m10 = float(m10)
+        self.m11 = float(m11)
+        self.m12 = float(m12)
+        self.m20 = float(m20)
+        self.m21 = float(m21)
+        self.m22 = float(m22)
+
+    @staticmethod
+    def _fromFloats(m00, m01, m02, m10, m11, m12, m20, m21, m22):
+        """Build a Matrix3 from nine values which are already floats,
+        skipping the conversions done by __init__."""
+        m = _new(Matrix3)
+        m.m00 = m00
+        m.m01 = m01
+        m.m02 = m02
+        m.m10 = m10
+        m.m11 = m11
+        m.m12 = m12
+        m.m20 = m20
+        m.m21 = m21
+        m.m22 = m22
+        return m
+
+    @staticmethod
+    def identity():
+        """Return the 3x3 identity matrix."""
+        return Matrix3._fromFloats(1.0, 0.0, 0.0,
+                                   0.0, 1.0, 0.0,
+                                   0.0, 0.0, 1.0)
+
+    @staticmethod
+    def fromMatrix(m):
+        """Initialize from a 3x3 Matrix, or any 3x3 sequence of rows."""
+        if isinstance(m, Matrix):
+            rows = m.size()[0]
+        else:
+            rows = len(m)
+        if rows != 3 or [ len(m[i]) for i in range(3) ] != [ 3, 3, 3 ]:
+            raise IndexError('Matrix must be 3x3.')
+        (r0, r1, r2) = (m[0], m[1], m[2])
+        return Matrix3(r0[0], r0[1], r0[2],
+                       r1[0], r1[1], r1[2],
+                       r2[0], r2[1], r2[2])
+
+    def toMatrix(self):
+        """Return a copy of this matrix as a general Matrix."""
+        return Matrix._fromArray(3, 3, array('d', self.toList()))
+
+    def toList(self):
+        """Return the elements as a flat list, in row order."""
+        return [ self.m00, self.m01, self.m02,
+                 self.m10, self.m11, self.m12,
+                 self.m20, self.m21, self.m22 ]
+
+    def clone(self):
+        """Return a copy of this matrix."""
+        return Matrix3._fromFloats(self.m00, self.m01, self.m02,
+                                   self.m10, self.m11, self.m12,
+                                   self.m20, self.m21, self.m22)
+
+    def size(self):
+        """Return a tuple indicating size in (rows,cols)."""
+        return (3, 3)
+
+    def __len__(self):
+        """Return the number of rows."""
+        return 3
+
+    def __getitem__(self, index):
+        """Return a copy of row index, as a tuple."""
+        if index < 0:
+            index += 3
+        if index == 0:
+            return (self.m00, self.m01, self.m02)
+        elif index == 1:
+            return (self.m10, self.m11, self.m12)
+        elif index == 2:
+            return (self.m20, self.m21, self.m22)
+        raise IndexError('Index out of bounds : %s' % index)
+
+    def __eq__(self, m):
+        """Equality with a Matrix3, a Matrix or a sequence of rows."""
+        if isinstance(m, Matrix3):
+            return self.toList() == m.toList()
+        if isinstance(m, Matrix):
+            if m.size() != (3, 3):
+                return False
+        elif len(m) != 3:
+            return False
+        for i in range(3):
+            if list(self[i]) != list(m[i]):
+                return False
+        return True
+
+    def __ne__(self, m):
+        return not self.__eq__(m)
+
+    def __str__(self):
+        """Return the string representation of this matrix."""
+        return '[ ' + '\n  '.join([
+            '[' + ','.join([ (' ' + self.mPrintSpec) % e for e in row ]) +
+            ' ]' for row in self ]) + ' ]'
+
+    def getRow(self, index):
+        """Get a copy of a row of the matrix, as a Vector."""
+        return Vector._fromList(list(self[index]))
+
+    def getColumn(self, index):
+        """Get a copy of a column of the matrix, as a Vector."""
+        if index == 0:
+            return Vector._fromList([ self.m00, self.m10, self.m20 ])
+        elif index == 1:
+            return Vector._fromList([ self.m01, self.m11, self.m21 ])
+        elif index == 2:
+            return Vector._fromList([ self.m02, self.m12, self.m22 ])
+        raise IndexError('Index out of bounds : %s' % index)
+
+    def __add__(self, m):
+        """Add matrix m to self, returning a new matrix."""
+        return Matrix3._fromFloats(
+            self.m00 + m.m00, self.m01 + m.m01, self.m02 + m.m02,
+            self.m10 + m.m10, self.m11 + m.m11, self.m12 + m.m12,
+            self.m20 + m.m20, self.m21 + m.m21, self.m22 + m.m22)
+
+    def mults(self, scalar):
+        """Multiply by a scalar, returning a new matrix."""
+        s = float(scalar)
+        return Matrix3._fromFloats(
+            self.m00 * s, self.m01 * s, self.m02 * s,
+            self.m10 * s, self.m11 * s, self.m12 * s,
+            self.m20 * s, self.m21 * s, self.m22 * s)
+
+    def multv(self, v):
+        """Multiply by a 3-vector, returning a Vector:
+
+        V = self * v
+        """
+        if len(v) != 3:
+            raise TypeError(
+                "Incompatible object sizes: 3x3 matrix and %s vector" %
+                len(v))
+        (x, y, z) = (v[0], v[1], v[2])
+        return Vector._fromList([
+            self.m00 * x + self.m01 * y + self.m02 * z,
+            self.m10 * x + self.m11 * y + self.m12 * z,
+            self.m20 * x + self.m21 * y + self.m22 * z ])
+
+    def multm(self, m):
+        """Multiply by a matrix, returning a matrix:
+
+        M = self * m
+
+        The product of two Matrix3 objects is a Matrix3; any other matrix
+        is multiplied as a general Matrix, and a Matrix is returned.
+        """
+        if not isinstance(m, Matrix3):
+            return self.toMatrix().multm(m)
+        (a00, a01, a02) = (self.m00, self.m01, self.m02)
+        (a10, a11, a12) = (self.m10, self.m11, self.m12)
+        (a20, a21, a22) = (self.m20, self.m21, self.m22)
+        (b00, b01, b02) = (m.m00, m.m01, m.m02)
+        (b10, b11, b12) = (m.m10, m.m11, m.m12)
+        (b20, b21, b22) = (m.m20, m.m21, m.m22)
+        return Matrix3._fromFloats(
+            a00 * b00 + a01 * b10 + a02 * b20,
+            a00 * b01 + a01 * b11 + a02 * b21,
+            a00 * b02 + a01 * b12 + a02 * b22,
+            a10 * b00 + a11 * b10 + a12 * b20,
+            a10 * b01 + a11 * b11 + a12 * b21,
+            a10 * b02 + a11 * b12 + a12 * b22,
+            a20 * b00 + a21 * b10 + a22 * b20,
+            a20 * b01 + a21 * b11 + a22 * b21,
+            a20 * b02 + a21 * b12 + a22 * b22)
+
+    def transpose(self):
+        """Return a new matrix which is the transpose of this matrix."""
+        return Matrix3._fromFloats(self.m00, self.m10, self.m20,
+                                   self.m01, self.m11, self.m21,
+                                   self.m02, self.m12, self.m22)
+
+    def determinant(self):
+        """Return the determinant of this matrix."""
+        return (self.m00 * (self.m11 * self.m22 - self.m12 * self.m21) -
+                self.m01 * (self.m10 * self.m22 - self.m12 * self.m20) +
+                self.m02 * (self.m10 * self.m21 - self.m11 * self.m20))
+
+    def inverse(self):
+        """Return the inverse of this matrix, computed from its adjugate.
+        Raises ValueError if the matrix is singular."""
+        (a00, a01, a02) = (self.m00, self.m01, self.m02)
+        (a10, a11, a12) = (self.m10, self.m11, self.m12)
+        (a20, a21, a22) = (self.m20, self.m21, self.m22)
+        c00 = a11 * a22 - a12 * a21
+        c01 = a12 * a20 - a10 * a22
+        c02 = a10 * a21 - a11 * a20
+        det = a00 * c00 + a01 * c01 + a02 * c02
+        if det == 0.0:
+            raise ValueError('Singular matrix error')
+        r = 1.0 / det
+        return Matrix3._fromFloats(
+            c00 * r, (a02 * a21 - a01 * a22) * r, (a01 * a12 - a02 * a11) * r,
+            c01 * r, (a00 * a22 - a02 * a20) * r, (a02 * a10 - a00 * a12) * r,
+            c02 * r, (a01 * a20 - a00 * a21) * r, (a00 * a11 - a01 * a10) * r)
+
+    def round(self, places): # Returns reference to self
+        """Round all the elements of this matrix to the specified number
+        of decimal places."""
+        for name in Matrix3.__slots__:
+            setattr(self, name, round(getattr(self, name), places))
+        return self
+
+    @staticmethod
+    def rotationMatrixForZ(angle_in_degrees):
+        """Given an angle in degrees, compute the rotation matrix
+        about the Z axis."""
+        (s, c) = MathUtil.getSinCos(angle_in_degrees)
+        return Matrix3._fromFloats(c, -s, 0.0, s, c, 0.0, 0.0, 0.0, 1.0)
+
+    @staticmethod
+    def rotationMatrixForX(angle_in_degrees):
+        """Given an angle in degrees, compute the rotation matrix
+        about the X axis."""
+        (s, c) = MathUtil.getSinCos(angle_in_degrees)
+        return Matrix3._fromFloats(1.0, 0.0, 0.0, 0.0, c, -s, 0.0, s, c)
+
+    @staticmethod
+    def rotationMatrixForY(angle_in_degrees):
+        """Given an angle in degrees, compute the rotation matrix
+        about the Y axis."""
+        (s, c) = MathUtil.getSinCos(angle_in_degrees)
+        return Matrix3._fromFloats(c, 0.0, s, 0.0, 1.0, 0.0, -s, 0.0, c)
+
+    @staticmethod
+    def azimuthAltitude(azimuth_degrees, altitude_degrees):
+        """Given an azimuth and an altitude in degrees, compute the
+        corresponding rotation matrix, as Matrix.azimuthAltitude() does.
+        altitude must be in the range -90 to +90.
+        """
+        if altitude_degrees < -90.0 or altitude_degrees > 90.0:
+            raise ValueError(
+                'altitude_degrees must be in the range [-90,+90].')
+        (sa, ca) = MathUtil.getSinCos(azimuth_degrees)
+        (sl, cl) = MathUtil.getSinCos(altitude_degrees)
+        return Matrix3._fromFloats(ca * cl, -sa, -ca * sl,
+                                   sa * cl, ca, -sa * sl,
+                                   sl, 0.0, cl)
+
+########################################################################
+# Matrix3 tests
+class Matrix3Test(unittest.TestCase):
+
+    """Unit tests for Matrix3."""
+
+    def setUp(self):
+        'Set up a general test matrix.'
+        self.mRows = [ [ 2, -1, 3 ], [ 0.5, 4, 1 ], [ -2, 1, 5 ] ]
+        self.mM = Matrix3.fromMatrix(self.mRows)
+
+    def testConversions(self):
+        'Test conversions to and from Matrix.'
+        m = self.mM
+        assert m == self.mRows
+        assert m.toMatrix() == Matrix(*self.mRows)
+        assert Matrix(*self.mRows) == m
+        assert Matrix3.fromMatrix(Matrix(*self.mRows)) == m
+        assert m[1] == (0.5, 4, 1)
+        assert m[-1][2] == 5
+        assert m.getRow(0) == [ 2, -1, 3 ]
+        assert m.getColumn(1) == [ -1, 4, 1 ]
+        assert Matrix3.identity() == Matrix.identity(3)
+        assert m.clone() == m and m.clone() is not m
+        assert str(m) == str(Matrix(*self.mRows))
+
+        for call in (lambda: m[3], lambda: m.getColumn(3),
+                     lambda: Matrix3.fromMatrix(Matrix.identity(4))):
+            hitError = False
+            try:
+                call()
+            except IndexError:
+                hitError = True
+            assert hitError
+
+        hitError = False
+        try:
+            m.x = 1
+        except AttributeError:
+            hitError = True
+        assert hitError
+
+    def testArithmetic(self):
+        'Test the unrolled kernels against the general Matrix.'
+        m = self.mM
+        g = Matrix(*self.mRows)
+        o = Matrix3(1, 2, 3, -4, 5, 6, 7, -8, 9)
+        v = Vector(3, -2, 0.5)
+        assert m.multv(v) == g.multv(v)
+        assert m.multm(o) == g.multm(o.toMatrix())
+        assert isinstance(m.multm(o), Matrix3)
+        assert m.multm(g) == g.multm(g)
+        assert g.multm(o.toMatrix()) == m.multm(o)
+        assert m.transpose() == g.transpose()
+        assert m + o == g + o.toMatrix()
+        assert m.mults(3) == g.mults(3)
+
+        hitError = False
+        try:
+            m.multv(Vector(1, 2))
+        except TypeError:
+            hitError = True
+        assert hitError
+
+    def testDeterminantAndInverse(self):
+        'Test the determinant and inverse.'
+        m = self.mM
+        assert m.determinant() == 2 * 19 + 1 * 4.5 + 3 * 8.5
+        assert m.multm(m.inverse()).round(12) == Matrix3.identity()
+        assert m.inverse().multm(m).round(12) == Matrix3.identity()
+
+        hitError = False
+        try:
+            Matrix3(1, 2, 3, 2, 4, 6, 0, 1, 0).inverse()
+        except ValueError:
+            hitError = True
+        assert hitError
+
+    def testRotations(self):
+        'Test the rotation matrices against Matrix.'
+        for angle in (0, 30, -45, 120):
+            for (fast, general) in (
+                    (Matrix3.rotationMatrixForX, Matrix.rotationMatrixForX),
+                    (Matrix3.rotationMatrixForY, Matrix.rotationMatrixForY),
+                    (Matrix3.rotationMatrixForZ, Matrix.rotationMatrixForZ)):
+                assert fast(angle) == general(angle)
+                assert fast(angle).inverse().round(12) == \
+                    fast(angle).transpose().round(12)
+            for altitude in (-90, -20, 0, 60, 90):
+                m = Matrix3.azimuthAltitude(angle, altitude)
+                assert m == Matrix.azimuthAltitude(angle, altitude)
+                assert abs(m.determinant() - 1.0) < 1e-12
+                A = Matrix.rotationMatrixForY(-altitude)
+                B = Matrix.rotationMatrixForZ(angle)
+                assert m.round(12) == B.multm(A).round(12)
+
+        hitError = False
+        try:
+            Matrix3.azimuthAltitude(0, 91)
+        except ValueError:
+            hitError = True
+        assert hitError
@@ -0,0 +1,394 @@
+#!/usr/bin/python
+
+# Disable some pylint messages
+# pylint: disable=C0103,R0201,R0902,R0904,R0913,R0914,W0511,W0212
+# C0103 : Invalid name "%s" (should match %s)
+# R0201 : Method could be a function
+# R0902 : Too many instance attributes
+# R0904 : Too many public methods
+# R0913 : Too many arguments
+# R0914 : Too many local variables
+# W0511 : TODO/FIXME/XXX
+# W0212 : Access to a protected member %s of a client class
+
+"""
+Matrix4 definition.
+"""
+
+import unittest
+from array import array
+from Vector import Vector
+from Matrix import Matrix
+from Matrix3 import Matrix3
+
+_new = object.__new__
+
+########################################################################
+class Matrix4(object):
+
+    """
+    Matrix4 : a 4x4 matrix.
+
+    The sixteen elements are held in scalar fields, m00 to m33 (row,
+    column), and every operation is written out in full, as for Matrix3.
+    m[i][j] reads an element, as for a Matrix, and toMatrix() and
+    fromMatrix() convert to and from the general type.
+    """
+
+    __slots__ = ('m00', 'm01', 'm02', 'm03',
+                 'm10', 'm11', 'm12', 'm13',
+                 'm20', 'm21', 'm22', 'm23',
+                 'm30', 'm31', 'm32', 'm33')
+
+    mPrintSpec = '%f' # String formatter for elements
+
+    def __init__(self, m00, m01, m02, m03, m10, m11, m12, m13,
+                 m20, m21, m22, m23, m30, m31, m32, m33):
+        """Initialize a matrix from its sixteen elements, in row order."""
+        self.m00 = float(m00)
+        self.m01 = float(m01)
+        self.m02 = float(m02)
+        self.m03 = float(m03)
+        self.m10 = float(m10)
+        self.m11 = float(m11)
+        self.m12 = float(m12)
+        self.m13 = float(m13)
+        self.m20 = float(m20)
+        self.m21 = float(m21)
+        self.m22 = float(m22)
+        self.m23 = float(m23)
+        self.m30 = float(m30)
+        self.m31 = float(m31)
+        self.m32 = float(m32)
+        self.m33 = float(m33)
+
+    @staticmethod
+    def _fromFloats(m00, m01, m02, m03, m10, m11, m12, m13,
+                    m20, m21, m22, m23, m30, m31, m32, m33):
+        """Build a Matrix4 from sixteen values which are already floats,
+        skipping the conversions done by __init__."""
+        m = _new(Matrix4)
+        m.m00 = m00
+        m.m01 = m01
+        m.m02 = m02
+        m.m03 = m03
+        m.m10 = m10
+        m.m11 = m11
+        m.m12 = m12
+        m.m13 = m13
+        m.m20 = m20
+        m.m21 = m21
+        m.m22 = m22
+        m.m23 = m23
+        m.m30 = m30
+        m.m31 = m31
+        m.m32 = m32
+        m.m33 = m33
+        return m
+
+    @staticmethod
+    def identity():
+        """Return the 4x4 identity matrix."""
+        return Matrix4._fromFloats(1.0, 0.0, 0.0, 0.0,
+                                   0.0, 1.0, 0.0, 0.0,
+                                   0.0, 0.0, 1.0, 0.0,
+                                   0.0, 0.0, 0.0, 1.0)
+
+    @staticmethod
+    def fromMatrix(m):
+        """Initialize from a 4x4 Matrix, or any 4x4 sequence of rows."""
+        if isinstance(m, Matrix):
+            rows = m.size()[0]
+        else:
+            rows = len(m)
+        if rows != 4 or [ len(m[i]) for i in range(4) ] != [ 4, 4, 4, 4 ]:
+            raise IndexError('Matrix must be 4x4.')
+        (r0, r1, r2, r3) = (m[0], m[1], m[2], m[3])
+        return Matrix4(r0[0], r0[1], r0[2], r0[3],
+                       r1[0], r1[1], r1[2], r1[3],
+                       r2[0], r2[1], r2[2], r2[3],
+                       r3[0], r3[1], r3[2], r3[3])
+
+    @staticmethod
+    def fromRotationTranslation(r, t):
+        """Build the homogeneous transform which applies the 3x3 rotation
+        r (a Matrix3) and then the translation 3-vector t."""
+        return Matrix4._fromFloats(r.m00, r.m01, r.m02, float(t[0]),
+                                   r.m10, r.m11, r.m12, float(t[1]),
+                                   r.m20, r.m21, r.m22, float(t[2]),
+                                   0.0, 0.0, 0.0, 1.0)
+
+    def toMatrix(self):
+        """Return a copy of this matrix as a general Matrix."""
+        return Matrix._fromArray(4, 4, array('d', self.toList()))
+
+    def toMatrix3(self):
+        """Return the upper left 3x3 block, as a Matrix3."""
+        return Matrix3._fromFloats(self.m00, self.m01, self.m02,
+                                   self.m10, self.m11, self.m12,
+                                   self.m20, self.m21, self.m22)
+
+    def toList(self):
+        """Return the elements as a flat list, in row order."""
+        return [ self.m00, self.m01, self.m02, self.m03,
+                 self.m10, self.m11, self.m12, self.m13,
+                 self.m20, self.m21, self.m22, self.m23,
+                 self.m30, self.m31, self.m32, self.m33 ]
+
+    def clone(self):
+        """Return a copy of this matrix."""
+        return Matrix4._fromFloats(*self.toList())
+
+    def size(self):
+        """Return a tuple indicating size in (rows,cols)."""
+        return (4, 4)
+
+    def __len__(self):
+        """Return the number of rows."""
+        return 4
+
+    def __getitem__(self, index):
+        """Return a copy of row index, as a tuple."""
+        if index < 0:
+            index += 4
+        if index == 0:
+            return (self.m00, self.m01, self.m02, self.m03)
+        elif index == 1:
+            return (self.m10, self.m11, self.m12, self.m13)
+        elif index == 2:
+            return (self.m20, self.m21, self.m22, self.m23)
+        elif index == 3:
+            return (self.m30, self.m31, self.m32, self.m33)
+        raise IndexError('Index out of bounds : %s' % index)
+
+    def __eq__(self, m):
+        """Equality with a Matrix4, a Matrix or a sequence of rows."""
+        if isinstance(m, Matrix4):
+            return self.toList() == m.toList()
+        if isinstance(m, Matrix):
+            if m.size() != (4, 4):
+                return False
+        elif len(m) != 4:
+            return False
+        for i in range(4):
+            if list(self[i]) != list(m[i]):
+                return False
+        return True
+
+    def __ne__(self, m):
+        return not self.__eq__(m)
+
+    def __str__(self):
+        """Return the string representation of this matrix."""
+        return '[ ' + '\n  '.join([
+            '[' + ','.join([ (' ' + self.mPrintSpec) % e for e in row ]) +
+            ' ]' for row in self ]) + ' ]'
+
+    def getRow(self, index):
+        """Get a copy of a row of the matrix, as a Vector."""
+        return Vector._fromList(list(self[index]))
+
+    def getColumn(self, index):
+        """Get a copy of a column of the matrix, as a Vector."""
+        if index < 0 or index >= 4:
+            raise IndexError('Index out of bounds : %s' % index)
+        return Vector._fromList(self.toList()[index::4])
+
+    def multv(self, v):
+        """Multiply by a 4-vector, returning a Vector:
+
+        V = self * v
+        """
+        if len(v) != 4:
+            raise TypeError(
+                "Incompatible object sizes: 4x4 matrix and %s vector" %
+                len(v))
+        (x, y, z, w) = (v[0], v[1], v[2], v[3])
+        return Vector._fromList([
+            self.m00 * x + self.m01 * y + self.m02 * z + self.m03 * w,
+            self.m10 * x + self.m11 * y + self.m12 * z + self.m13 * w,
+            self.m20 * x + self.m21 * y + self.m22 * z + self.m23 * w,
+            self.m30 * x + self.m31 * y + self.m32 * z + self.m33 * w ])
+
+    def multm(self, m):
+        """Multiply by a matrix, returning a matrix:
+
+        M = self * m
+
+        The product of two Matrix4 objects is a Matrix4; any other matrix
+        is multiplied as a general Matrix, and a Matrix is returned.
+        """
+        if not isinstance(m, Matrix4):
+            return self.toMatrix().multm(m)
+        (a00, a01, a02, a03) = (self.m00, self.m01, self.m02, self.m03)
+        (a10, a11, a12, a13) = (self.m10, self.m11, self.m12, self.m13)
+        (a20, a21, a22, a23) = (self.m20, self.m21, self.m22, self.m23)
+        (a30, a31, a32, a33) = (self.m30, self.m31, self.m32, self.m33)
+        (b00, b01, b02, b03) = (m.m00, m.m01, m.m02, m.m03)
+        (b10, b11, b12, b13) = (m.m10, m.m11, m.m12, m.m13)
+        (b20, b21, b22, b23) = (m.m20, m.m21, m.m22, m.m23)
+        (b30, b31, b32, b33) = (m.m30, m.m31, m.m32, m.m33)
+        return Matrix4._fromFloats(
+            a00 * b00 + a01 * b10 + a02 * b20 + a03 * b30,
+            a00 * b01 + a01 * b11 + a02 * b21 + a03 * b31,
+            a00 * b02 + a01 * b12 + a02 * b22 + a03 * b32,
+            a00 * b03 + a01 * b13 + a02 * b23 + a03 * b33,
+            a10 * b00 + a11 * b10 + a12 * b20 + a13 * b30,
+            a10 * b01 + a11 * b11 + a12 * b21 + a13 * b31,
+            a10 * b02 + a11 * b12 + a12 * b22 + a13 * b32,
+            a10 * b03 + a11 * b13 + a12 * b23 + a13 * b33,
+            a20 * b00 + a21 * b10 + a22 * b20 + a23 * b30,
+            a20 * b01 + a21 * b11 + a22 * b21 + a23 * b31,
+            a20 * b02 + a21 * b12 + a22 * b22 + a23 * b32,
+            a20 * b03 + a21 * b13 + a22 * b23 + a23 * b33,
+            a30 * b00 + a31 * b10 + a32 * b20 + a33 * b30,
+            a30 * b01 + a31 * b11 + a32 * b21 + a33 * b31,
+            a30 * b02 + a31 * b12 + a32 * b22 + a33 * b32,
+            a30 * b03 + a31 * b13 + a32 * b23 + a33 * b33)
+
+    def transpose(self):
+        """Return a new matrix which is the transpose of this matrix."""
+        return Matrix4._fromFloats(self.m00, self.m10, self.m20, self.m30,
+                                   self.m01, self.m11, self.m21, self.m31,
+                                   self.m02, self.m12, self.m22, self.m32,
+                                   self.m03, self.m13, self.m23, self.m33)
+
+    def _minors(self):
+        """Return the 2x2 minors of the top two rows (s0 to s5) and of
+        the bottom two rows (c0 to c5), from which the determinant and
+        the inverse are built by Laplace expansion."""
+        (a00, a01, a02, a03) = (self.m00, self.m01, self.m02, self.m03)
+        (a10, a11, a12, a13) = (self.m10, self.m11, self.m12, self.m13)
+        (a20, a21, a22, a23) = (self.m20, self.m21, self.m22, self.m23)
+        (a30, a31, a32, a33) = (self.m30, self.m31, self.m32, self.m33)
+        return (a00 * a11 - a10 * a01, a00 * a12 - a10 * a02,
+                a00 * a13 - a10 * a03, a01 * a12 - a11 * a02,
+                a01 * a13 - a11 * a03, a02 * a13 - a12 * a03,
+                a20 * a31 - a30 * a21, a20 * a32 - a30 * a22,
+                a20 * a33 - a30 * a23, a21 * a32 - a31 * a22,
+                a21 * a33 - a31 * a23, a22 * a33 - a32 * a23)
+
+    def determinant(self):
+        """Return the determinant of this matrix."""
+        (s0, s1, s2, s3, s4, s5, c0, c1, c2, c3, c4, c5) = self._minors()
+        return s0 * c5 - s1 * c4 + s2 * c3 + s3 * c2 - s4 * c1 + s5 * c0
+
+    def inverse(self):
+        """Return the inverse of this matrix, computed from its adjugate.
+        Raises ValueError if the matrix is singular."""
+        (s0, s1, s2, s3, s4, s5, c0, c1, c2, c3, c4, c5) = self._minors()
+        det = s0 * c5 - s1 * c4 + s2 * c3 + s3 * c2 - s4 * c1 + s5 * c0
+        if det == 0.0:
+            raise ValueError('Singular matrix error')
+        r = 1.0 / det
+        (a00, a01, a02, a03) = (self.m00, self.m01, self.m02, self.m03)
+        (a10, a11, a12, a13) = (self.m10, self.m11, self.m12, self.m13)
+        (a20, a21, a22, a23) = (self.m20, self.m21, self.m22, self.m23)
+        (a30, a31, a32, a33) = (self.m30, self.m31, self.m32, self.m33)
+        return Matrix4._fromFloats(
+            (a11 * c5 - a12 * c4 + a13 * c3) * r,
+            (a02 * c4 - a01 * c5 - a03 * c3) * r,
+            (a31 * s5 - a32 * s4 + a33 * s3) * r,
+            (a22 * s4 - a21 * s5 - a23 * s3) * r,
+            (a12 * c2 - a10 * c5 - a13 * c1) * r,
+            (a00 * c5 - a02 * c2 + a03 * c1) * r,
+            (a32 * s2 - a30 * s5 - a33 * s1) * r,
+            (a20 * s5 - a22 * s2 + a23 * s1) * r,
+            (a10 * c4 - a11 * c2 + a13 * c0) * r,
+            (a01 * c2 - a00 * c4 - a03 * c0) * r,
+            (a30 * s4 - a31 * s2 + a33 * s0) * r,
+            (a21 * s2 - a20 * s4 - a23 * s0) * r,
+            (a11 * c1 - a10 * c3 - a12 * c0) * r,
+            (a00 * c3 - a01 * c1 + a02 * c0) * r,
+            (a31 * s1 - a30 * s3 - a32 * s0) * r,
+            (a20 * s3 - a21 * s1 + a22 * s0) * r)
+
+    def round(self, places): # Returns reference to self
+        """Round all the elements of this matrix to the specified number
+        of decimal places."""
+        for name in Matrix4.__slots__:
+            setattr(self, name, round(getattr(self, name), places))
+        return self
+
+########################################################################
+# Matrix4 tests
+class Matrix4Test(unittest.TestCase):
+
+    """Unit tests for Matrix4."""
+
+    def setUp(self):
+        'Set up a general test matrix.'
+        self.mRows = [ [ 2, -1, 3, 0.5 ], [ 0.5, 4, 1, -2 ],
+                       [ -2, 1, 5, 1 ], [ 1, 0, -1, 3 ] ]
+        self.mM = Matrix4.fromMatrix(self.mRows)
+
+    def testConversions(self):
+        'Test conversions to and from Matrix.'
+        m = self.mM
+        assert m == self.mRows
+        assert m.toMatrix() == Matrix(*self.mRows)
+        assert Matrix(*self.mRows) == m
+        assert Matrix4.fromMatrix(Matrix(*self.mRows)) == m
+        assert m[3] == (1, 0, -1, 3)
+        assert m.getColumn(3) == [ 0.5, -2, 1, 3 ]
+        assert m.toMatrix3() == [ row[:3] for row in self.mRows[:3] ]
+        assert Matrix4.identity() == Matrix.identity(4)
+        assert str(m) == str(Matrix(*self.mRows))
+
+        for call in (lambda: m[4], lambda: m.getColumn(-1),
+                     lambda: Matrix4.fromMatrix(Matrix.identity(3))):
+            hitError = False
+            try:
+                call()
+            except IndexError:
+                hitError = True
+            assert hitError
+
+    def testArithmetic(self):
+        'Test the unrolled kernels against the general Matrix.'
+        m = self.mM
+        g = Matrix(*self.mRows)
+        o = Matrix4(1, 2, 3, 4, -5, 6, 7, 8, 9, -10, 11, 12, 13, 14, -15, 16)
+        v = Vector(3, -2, 0.5, 1)
+        assert m.multv(v) == g.multv(v)
+        assert m.multm(o) == g.multm(o.toMatrix())
+        assert isinstance(m.multm(o), Matrix4)
+        assert m.multm(g) == g.multm(g)
+        assert m.transpose() == g.transpose()
+
+        hitError = False
+        try:
+            m.multv(Vector(1, 2, 3))
+        except TypeError:
+            hitError = True
+        assert hitError
+
+    def testDeterminantAndInverse(self):
+        'Test the determinant and inverse.'
+        m = self.mM
+        LU = Matrix(*self.mRows)
+        (index, d) = LU.ludecomp()
+        for i in range(4):
+            d *= LU[i][i]
+        assert round(m.determinant() - d, 12) == 0
+        assert m.multm(m.inverse()).round(12) == Matrix4.identity()
+        assert m.inverse().multm(m).round(12) == Matrix4.identity()
+
+        hitError = False
+        try:
+            Matrix4(1, 2, 3, 4, 2, 4, 6, 8, 0, 1, 0, 1, 1, 0, 0, 1).inverse()
+        except ValueError:
+            hitError = True
+        assert hitError
+
+    def testRigidTransform(self):
+        'Test a homogeneous rotation and translation.'
+        r = Matrix3.azimuthAltitude(30, 45)
+        t = Vector(1, -2, 3)
+        m = Matrix4.fromRotationTranslation(r, t)
+        p = Vector(0.5, 0.25, -1)
+        q = m.multv(Vector(p[0], p[1], p[2], 1))
+        assert Vector(q[0], q[1], q[2]) == r.multv(p) + t
+        assert q[3] == 1.0
+        assert round(m.determinant(), 12) == 1.0
+        assert m.inverse().multv(q).round(12) == [ 0.5, 0.25, -1, 1 ]
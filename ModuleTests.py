@@ -18,49 +18,257 @@ Matrix (variable-dimension)
 Quaternion
 """
 
+import os
+import sys
+import json
+import tempfile
 import unittest
+from cStringIO import StringIO
 
 from Vector import Vector, VectorTest
 from Matrix import Matrix, MatrixTest
+from Matrix3 import Matrix3, Matrix3Test
+from Matrix4 import Matrix4, Matrix4Test
+from LUFactorization import LUFactorization, LUFactorizationTest
+from BatchSolver import BatchSolver, BatchSolverTest
+from SparseMatrix import SparseMatrix, SparseMatrixTest
 from MathUtil import MathUtil, MathUtilTest
 from Quaternion import Quaternion, QuaternionTest
+from QuaternionArray import QuaternionArray, QuaternionArrayTest
 from CoordinateSys import CoordinateSys, CoordinateSysTest
 from TriangleGroup import TriangleGroup, TriangleGroupTest
+from BinaryStlView import BinaryStlView, BinaryStlViewTest
+from VectorArray import VectorArray, VectorArrayTest
+from Backend import Backend, BackendTest
+from Benchmarks import Benchmarks, BenchmarksTest
+from Instrumentation import Instrumentation, InstrumentationTest
+
+########################################################################
+
+# Benchmarks checked by the performance regression gate: micro benchmarks
+# of the core types, and macro benchmarks of whole mesh operations.
+GATE_BENCHMARKS = [ 'vector.add.1000',
+                    'vector.cross.1000',
+                    'quaternion.mulq.1000',
+                    'quaternion.rotate.1000',
+                    'matrix.multm.50',
+                    'matrix.ludecomp.50',
+                    'coordinatesys.toParent.100',
+                    'trianglegroup.subdivide',
+                    'stl.writeAscii',
+                    'stl.readBinary' ]
+
+# The checked-in baseline, and the largest slowdown, relative to it, that
+# the gate accepts.
+GATE_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'BenchmarkBaseline.json')
+GATE_THRESHOLD = 0.25
+
+# The number of timings whose median is compared, and the number of times
+# a benchmark that looks regressed is run again before the gate fails.
+GATE_REPEAT = 9
+GATE_RETRIES = 2
 
 ########################################################################
 
 def main():
 
     """Main routine for Quaternions, intended to be run if the 
-    module is executed on its own."""
+    module is executed on its own.
 
-    runAllUnitTests()
+    --conformance runs the unit tests with every backend. --benchmarks
+    runs the performance regression gate, exiting with status 1 on a
+    regression; it takes --baseline FILE, --threshold FRACTION and
+    --update-baseline."""
+
+    args = sys.argv[1:]
+    if '--conformance' in args:
+        runConformanceTests()
+    elif '--benchmarks' in args:
+        ok = runRegressionGate(
+            optionValue(args, '--baseline', GATE_BASELINE),
+            float(optionValue(args, '--threshold', GATE_THRESHOLD)),
+            '--update-baseline' in args)
+        sys.exit(0 if ok else 1)
+    else:
+        runAllUnitTests()
     #runUnitTestsFromCase(ModelTest)
 
 ########################################################################
 # Unit Test Executive Logic
-def runAllUnitTests():
+def allUnitTests():
 
-    'Run all unit tests.'
+    'Return a suite of all unit tests.'
 
-    print "Running all unit tests:"
-    #unittest.main()
-    testRunner = unittest.TextTestRunner()
     testCases = [VectorTest, 
                  MatrixTest, 
+                 Matrix3Test,
+                 Matrix4Test,
+                 LUFactorizationTest,
+                 BatchSolverTest,
+                 SparseMatrixTest,
                  QuaternionTest, 
+                 QuaternionArrayTest,
                  CoordinateSysTest,
                  MathUtilTest,
-                 TriangleGroupTest]
+                 TriangleGroupTest,
+                 BinaryStlViewTest,
+                 VectorArrayTest,
+                 BackendTest,
+                 BenchmarksTest,
+                 InstrumentationTest,
+                 ModuleTestsTest]
     suites = [
         unittest.TestLoader().loadTestsFromTestCase(tc)
         for tc in testCases ]
     suite = suites[0]
     if suite is not None:
         suite.addTests(suites[1:])
-        testRunner.run(suite)
+    return suite
+
+def runAllUnitTests():
+
+    'Run all unit tests.'
+
+    print "Running all unit tests:"
+    #unittest.main()
+    testRunner = unittest.TextTestRunner()
+    return testRunner.run(allUnitTests())
+
+def runConformanceTests():
+
+    """Run all unit tests once with each backend, to check that every
+    backend conforms to the reference implementation. Backends which are
+    not available are reported and skipped."""
+
+    previous = Backend.current()
+    failed = [ ]
+    try:
+        for name in [ Backend.PYTHON, Backend.NUMPY ]:
+            if name not in Backend.available():
+                print "Skipping the '%s' backend: not available." % name
+                continue
+            Backend.select(name)
+            print "Running all unit tests with the '%s' backend:" % name
+            testRunner = unittest.TextTestRunner()
+            result = testRunner.run(allUnitTests())
+            if not result.wasSuccessful():
+                failed.append(name)
+    finally:
+        Backend.select(previous)
+    if failed:
+        print "Backends failing conformance: %s" % ', '.join(failed)
+    else:
+        print "All available backends conform."
+    return not failed
     
 
+def optionValue(args, name, default):
+
+    """Return the argument following name in args, or default if name is
+    not there."""
+
+    if name in args[:-1]:
+        return args[args.index(name) + 1]
+    return default
+
+def runRegressionGate(baselineFile=GATE_BASELINE, threshold=GATE_THRESHOLD,
+                      update=False, repeat=GATE_REPEAT, retries=GATE_RETRIES,
+                      minTime=0.1, names=None, out=None):
+
+    """Run the GATE_BENCHMARKS, or the benchmarks named in names, and
+    compare their median times, in calibration units, with the baseline
+    stored in baselineFile. Prints the change of each benchmark to out, or
+    to standard output, and returns False if any one is slower than the
+    baseline by more than threshold (a fraction, e.g. 0.5 for 50%), or if
+    any benchmark in the baseline was not run. A benchmark which is too
+    slow is run again up to retries times, keeping its fastest result,
+    before it counts as a regression.
+
+    The benchmarks are run with the backend the baseline was recorded
+    with. If update is True, the benchmarks are run retries + 1 times
+    with the current backend instead, and the middle result of each is
+    written to baselineFile."""
+
+    if names is None:
+        names = GATE_BENCHMARKS
+    baseline = None
+    previous = Backend.current()
+    if not update:
+        f = open(baselineFile, 'r')
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        Backend.select(baseline['meta']['backend'])
+    try:
+        print >> out, "Running %d benchmarks with the '%s' backend..." % (
+            len(names), Backend.current())
+        results = Benchmarks.run(names, repeat, minTime=minTime,
+                                 normalized=True)
+        if update:
+            runs = [ results ] + [
+                Benchmarks.run(names, repeat, minTime=minTime,
+                               normalized=True)
+                for i in range(retries) ]
+            for name in results:
+                middle = sorted([ run[name] for run in runs ],
+                                key=lambda result: result['normalized'])
+                results[name] = middle[len(middle) // 2]
+            calibration = Benchmarks.calibrate(repeat, minTime=minTime)
+            document = Benchmarks.toJson(results, repeat=repeat,
+                                         minTime=minTime,
+                                         calibration=calibration['median'])
+            f = open(baselineFile, 'w')
+            try:
+                f.write(document + '\n')
+            finally:
+                f.close()
+            print >> out, "Wrote the baseline to %s" % baselineFile
+            return True
+
+        rows = Benchmarks.compare(results, baseline['benchmarks'], threshold)
+        for attempt in range(retries):
+            slow = [ row[0] for row in rows
+                     if row[4] and row[2] is not None ]
+            if not slow:
+                break
+            print >> out, "Running again: %s" % ', '.join(slow)
+            rerun = Benchmarks.run(slow, repeat, minTime=minTime,
+                                   normalized=True)
+            for name in slow:
+                if rerun[name]['normalized'] < results[name]['normalized']:
+                    results[name] = rerun[name]
+            rows = Benchmarks.compare(results, baseline['benchmarks'],
+                                      threshold)
+    finally:
+        Backend.select(previous)
+
+    print >> out, "%-30s %12s %12s %9s" % ('benchmark', 'baseline',
+                                           'current', 'delta')
+    for (name, before, after, delta, regressed) in rows:
+        if before is None:
+            print >> out, "%-30s %12s %12.4g %9s" % (name, '-', after, 'new')
+        elif after is None:
+            print >> out, "%-30s %12.4g %12s %9s" % (name, before, '-',
+                                                     'missing')
+        else:
+            print >> out, "%-30s %12.4g %12.4g %+8.1f%%%s" % (
+                name, before, after, 100 * delta,
+                '  REGRESSED' if regressed else '')
+    missing = [ row[0] for row in rows if row[2] is None ]
+    regressions = [ row[0] for row in rows
+                    if row[4] and row[2] is not None ]
+    if missing:
+        print >> out, "Missing from the run: %s" % ', '.join(missing)
+    if regressions:
+        print >> out, "Regressions beyond %.0f%%: %s" % (
+            100 * threshold, ', '.join(regressions))
+    if missing or regressions:
+        return False
+    print >> out, "No regressions beyond %.0f%%." % (100 * threshold)
+    return True
+
 def runUnitTestsFromCase(caseClass): # pragma: no cover
     
     """Run only the unit tests from the specified class, e.g.
@@ -84,6 +292,59 @@ def runQuaternionTests(): # pragma: no cover
     'run quaternion tests only.'
     runUnitTestsFromCase(QuaternionTest)
 
+########################################################################
+# ModuleTests Unit Tests
+class ModuleTestsTest(unittest.TestCase):
+    """Unit tests for the regression gate."""
+
+    def testOptionValue(self):
+        'Test reading the value of a command line option.'
+        args = [ '--benchmarks', '--threshold', '0.3', '--baseline' ]
+        assert optionValue(args, '--threshold', 0.25) == '0.3'
+        assert optionValue(args, '--baseline', 'b.json') == 'b.json'
+        assert optionValue(args, '--update-baseline', None) is None
+        assert optionValue([ ], '--threshold', 0.25) == 0.25
+
+    def testRegressionGate(self):
+        'Test the regression gate against a temporary baseline.'
+        names = [ 'quaternion.mulq.1000', 'vector.add.1000' ]
+        settings = { 'repeat' : 1, 'minTime' : 0.001, 'names' : names }
+        (fd, baselineFile) = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            out = StringIO()
+            assert runRegressionGate(baselineFile, update=True, retries=1,
+                                     out=out, **settings)
+            f = open(baselineFile, 'r')
+            try:
+                baseline = json.load(f)
+            finally:
+                f.close()
+            assert sorted(baseline['benchmarks'].keys()) == names
+            assert baseline['meta']['backend'] == Backend.current()
+
+            out = StringIO()
+            assert runRegressionGate(baselineFile, 10.0, retries=0, out=out,
+                                     **settings)
+            assert 'No regressions beyond 1000%.' in out.getvalue()
+
+            # Every benchmark is slower than 1% of its baseline time.
+            out = StringIO()
+            assert not runRegressionGate(baselineFile, -0.99, retries=1,
+                                         out=out, **settings)
+            assert 'Running again: ' + ', '.join(names) in out.getvalue()
+            assert out.getvalue().count('REGRESSED') == 2
+
+            # A baseline entry which is not run fails the gate.
+            out = StringIO()
+            settings['names'] = names[:1]
+            assert not runRegressionGate(baselineFile, 10.0, retries=1,
+                                         out=out, **settings)
+            assert 'Missing from the run: vector.add.1000' in out.getvalue()
+            assert 'Running again' not in out.getvalue()
+        finally:
+            os.remove(baselineFile)
+
 ########################################################################
 # Main Logic
 if __name__ == '__main__':
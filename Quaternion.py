@@ -14,13 +14,106 @@ Quaternion definitions and useful utilities.
 
 import math
 import unittest
+from array import array
+from itertools import izip
 
 from Vector import Vector
-#from Matrix import Matrix
+from VectorArray import VectorArray
+from Backend import Backend
+from Matrix import Matrix
+from Matrix3 import Matrix3
+
+_new = object.__new__
+
+########################################################################
+class _QuaternionVectorList(list):
+
+    """The list returned by _QuaternionVector.mV. Element writes go
+    through to the quaternion, so that Vector methods called on other
+    vectors can take the view as their out parameter."""
+
+    __slots__ = ('mQuaternion',)
+
+    def __setitem__(self, key, value):
+        list.__setitem__(self, key, value)
+        self.mQuaternion._setVector(self)
+
+class _QuaternionVector(Vector):
+
+    """The vector part of a Quaternion, as a live Vector view, so that
+    q.mVector[i] and the in-place Vector operations read and write the
+    quaternion's fields directly."""
+
+    __slots__ = ('mQuaternion',)
+
+    def __init__(self, quaternion):
+        # Vector.__init__ is not called; the elements live in the
+        # quaternion.
+        self.mQuaternion = quaternion
+
+    def _getV(self):
+        q = self.mQuaternion
+        v = _QuaternionVectorList([ q.mX, q.mY, q.mZ ])
+        v.mQuaternion = q
+        return v
+
+    def _setV(self, values):
+        self.mQuaternion._setVector(values)
+
+    # Reads of mV always see the current quaternion, and the Vector
+    # methods which replace mV write back through here.
+    mV = property(_getV, _setV)
+
+    def _update(self, method, *args):
+        """Apply an in-place Vector method to a copy of this vector, and
+        write the result back to the quaternion."""
+        q = self.mQuaternion
+        v = Vector._fromList([ q.mX, q.mY, q.mZ ])
+        method(v, *args)
+        self.mV = v.mV
+        return self
+
+    def __setitem__(self, key, value):
+        return self._update(Vector.__setitem__, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError('Cannot change the length of a quaternion vector.')
+
+    def __iadd__(self, v):
+        return self._update(Vector.__iadd__, v)
+
+    def __isub__(self, v):
+        return self._update(Vector.__isub__, v)
+
+    def axpy(self, a, x):
+        return self._update(Vector.axpy, a, x)
+
+    def scale(self, s):
+        return self._update(Vector.scale, s)
+
+    def mults(self, s, out=None):
+        if out is not self:
+            return Vector.mults(self, s, out)
+        self.mV = Vector.mults(self, s).mV
+        return self
+
+    def cross(self, v, out=None):
+        if out is not self:
+            return Vector.cross(self, v, out)
+        self.mV = Vector.cross(self, v).mV
+        return self
+
+    def normalize(self, out=None):
+        if out is not None and out is not self:
+            return Vector.normalize(self, out)
+        return self._update(Vector.normalize)
+
+    def round(self, places):
+        return self._update(Vector.round, places)
 
 ########################################################################
 # Quaternion
-class Quaternion:
+class Quaternion(object):
     """Representation of a quaternion, defined as:
 
     s + ai + bj + ck
@@ -33,30 +126,69 @@ class Quaternion:
     i^2 = j^2 = k^2 = ijk = -1
     ij = k, jk = i, ki = j
     ji = -k, kj = -i, ik = -j
+
+    s is held in mScalar and a, b, c in mX, mY, mZ. mVector gives the
+    vector part as a Vector which reads and writes those fields.
+
+    The rotation matrix of the quaternion is computed on first use and
+    cached in mRotation; scale(), normalize(), invert() and writes through
+    mVector discard it. Code that assigns to mScalar, mX, mY or mZ
+    directly must reset mRotation to None itself.
     """
 
+    # Quaternions are created by every product, so they carry no
+    # per-instance __dict__.
+    __slots__ = ('mScalar', 'mX', 'mY', 'mZ', 'mRotation')
+
+    mPrintSpec = '%f' # String formatter for elements
+
     def __init__(self, s, a, b, c):
-        self.mPrintSpec = '%f'
         self.mScalar = s
-        self.mVector = Vector(a, b, c)
+        self.mX = float(a)
+        self.mY = float(b)
+        self.mZ = float(c)
+        self.mRotation = None
+
+    @staticmethod
+    def _fromFloats(s, a, b, c):
+        """Fast constructor from four floats, without conversion."""
+        q = _new(Quaternion)
+        q.mScalar = s
+        q.mX = a
+        q.mY = b
+        q.mZ = c
+        q.mRotation = None
+        return q
 
     @staticmethod
     def fromScalarVector(scalar, vector):
         """Define a quaternion from a scalar and a vector."""
-        # TODO: Refactor for performance.
         return Quaternion(scalar, vector[0], vector[1], vector[2])
 
+    def _getVector(self):
+        return _QuaternionVector(self)
+
+    def _setVector(self, v):
+        if len(v) != 3:
+            raise IndexError('The vector part must be a 3-vector.')
+        (self.mX, self.mY, self.mZ) = (float(v[0]), float(v[1]), float(v[2]))
+        self.mRotation = None
+
+    mVector = property(_getVector, _setVector,
+                       doc='The vector part, as a live Vector view.')
+
     def clone(self):
-        v = self.mVector[:]
-        return Quaternion(self.mScalar, v[0], v[1], v[2])
+        return Quaternion._fromFloats(self.mScalar, self.mX, self.mY, self.mZ)
 
     def __str__(self):
-        return '[ %s, %s ]' % (self.mPrintSpec % self.mScalar, self.mVector)
+        return '[ %s, %s ]' % (self.mPrintSpec % self.mScalar,
+                               Vector._fromList([ self.mX, self.mY, self.mZ ]))
 
     def str2(self):
         """Alternate way to represent a Quaternion as a string."""
-        signs = [ ('+' if f >= 0 else '-') for f in self.mVector ]
-        vals = [ abs(f) for f in self.mVector ]
+        v = (self.mX, self.mY, self.mZ)
+        signs = [ ('+' if f >= 0 else '-') for f in v ]
+        vals = [ abs(f) for f in v ]
 
         return '%s %s %si %s %sj %s %sk' % (self.mScalar, 
                                             signs[0],
@@ -68,7 +200,8 @@ class Quaternion:
 
     def __eq__(self, q):
         'Equality operator.'
-        return self.mScalar == q.mScalar and self.mVector == q.mVector
+        return (self.mScalar == q.mScalar and self.mX == q.mX and
+                self.mY == q.mY and self.mZ == q.mZ)
 
     def __ne__(self, q):
         'Not equals'
@@ -78,33 +211,33 @@ class Quaternion:
         """Compare the quaternion to a sequence assumed to be in
         the form [ s, a, b, c ]."""
         return (len(seq) == 4 and 
-                self.mScalar == seq[0] and self.mVector[0] == seq[1] and
-                self.mVector[1] == seq[2] and self.mVector[2] == seq[3])
+                self.mScalar == seq[0] and self.mX == seq[1] and
+                self.mY == seq[2] and self.mZ == seq[3])
 
     def __add__(self, q):
         'Return self + q'
-        return Quaternion(self.mScalar + q.mScalar, 
-                          self.mVector[0] + q.mVector[0],
-                          self.mVector[1] + q.mVector[1], 
-                          self.mVector[2] + q.mVector[2])
+        return Quaternion._fromFloats(self.mScalar + q.mScalar, 
+                                      self.mX + q.mX, self.mY + q.mY,
+                                      self.mZ + q.mZ)
 
     def __sub__(self, q):
         'Return self - q'
-        return Quaternion(self.mScalar - q.mScalar, 
-                          self.mVector[0] - q.mVector[0],
-                          self.mVector[1] - q.mVector[1], 
-                          self.mVector[2] - q.mVector[2])
+        return Quaternion._fromFloats(self.mScalar - q.mScalar, 
+                                      self.mX - q.mX, self.mY - q.mY,
+                                      self.mZ - q.mZ)
 
     def scale(self, s):
         'Scale this quaternion by scalar s in-place.'
         self.mScalar = self.mScalar * float(s)
-        self.mVector.scale(s)
+        self.mX *= s
+        self.mY *= s
+        self.mZ *= s
+        self.mRotation = None
 
     def mults(self, s):
         'Return self * scalar as a new Quaternion.'
-        r = Quaternion.fromScalarVector(self.mScalar, self.mVector)
-        r.scale(s)
-        return r
+        return Quaternion._fromFloats(self.mScalar * float(s), self.mX * s,
+                                      self.mY * s, self.mZ * s)
 
     def mul1(self, q):
         """Multiplication Algorithm 1:
@@ -120,61 +253,172 @@ class Quaternion:
         """Multiplication Algorithm 2: This is a much more efficient
         implementation of quaternion multiplication. It isover 3x faster than
         mul1."""
-        s = (self.mScalar * q.mScalar - self.mVector[0] * q.mVector[0] - 
-             self.mVector[1] * q.mVector[1] - self.mVector[2] * q.mVector[2])
-        a = (self.mScalar * q.mVector[0] + self.mVector[0] * q.mScalar + 
-             self.mVector[1] * q.mVector[2] - self.mVector[2] * q.mVector[1])
-        b = (self.mScalar * q.mVector[1] - self.mVector[0] * q.mVector[2] + 
-             self.mVector[1] * q.mScalar + self.mVector[2] * q.mVector[0])
-        c = (self.mScalar * q.mVector[2] + self.mVector[0] * q.mVector[1] - 
-             self.mVector[1] * q.mVector[0] + self.mVector[2] * q.mScalar)
+        s = (self.mScalar * q.mScalar - self.mX * q.mX -
+             self.mY * q.mY - self.mZ * q.mZ)
+        a = (self.mScalar * q.mX + self.mX * q.mScalar +
+             self.mY * q.mZ - self.mZ * q.mY)
+        b = (self.mScalar * q.mY - self.mX * q.mZ +
+             self.mY * q.mScalar + self.mZ * q.mX)
+        c = (self.mScalar * q.mZ + self.mX * q.mY -
+             self.mY * q.mX + self.mZ * q.mScalar)
         return Quaternion(s, a, b, c)
 
     def mulq(self, q):
         "Multiply two quaternions and return a new quaternion product."
-        s = (self.mScalar * q.mScalar - self.mVector[0] * q.mVector[0] - 
-             self.mVector[1] * q.mVector[1] - self.mVector[2] * q.mVector[2])
-        a = (self.mScalar * q.mVector[0] + self.mVector[0] * q.mScalar + 
-             self.mVector[1] * q.mVector[2] - self.mVector[2] * q.mVector[1])
-        b = (self.mScalar * q.mVector[1] - self.mVector[0] * q.mVector[2] + 
-             self.mVector[1] * q.mScalar + self.mVector[2] * q.mVector[0])
-        c = (self.mScalar * q.mVector[2] + self.mVector[0] * q.mVector[1] - 
-             self.mVector[1] * q.mVector[0] + self.mVector[2] * q.mScalar)
-        return Quaternion(s, a, b, c)
+        (s1, a1, b1, c1) = (self.mScalar, self.mX, self.mY, self.mZ)
+        (s2, a2, b2, c2) = (q.mScalar, q.mX, q.mY, q.mZ)
+        return Quaternion._fromFloats(s1 * s2 - a1 * a2 - b1 * b2 - c1 * c2,
+                                      s1 * a2 + a1 * s2 + b1 * c2 - c1 * b2,
+                                      s1 * b2 - a1 * c2 + b1 * s2 + c1 * a2,
+                                      s1 * c2 + a1 * b2 - b1 * a2 + c1 * s2)
 
     def conj(self):
         'return the conjugate of a quaternion.'
-        return Quaternion(self.mScalar, -self.mVector[0], 
-                          -self.mVector[1], -self.mVector[2])
+        return Quaternion._fromFloats(self.mScalar, -self.mX, -self.mY,
+                                      -self.mZ)
 
     def norm(self):
         'return the norm of a quaternion.'
-        return math.sqrt(sum([x*x for x in self.mVector]) 
-                         + self.mScalar * self.mScalar)
+        (a, b, c) = (self.mX, self.mY, self.mZ)
+        return math.sqrt(a * a + b * b + c * c + self.mScalar * self.mScalar)
 
     def normalize(self):
         'reset the quaternion so that it has norm = 1'
         n_reciprocal = 1.0 / self.norm()
         self.mScalar = self.mScalar * n_reciprocal
-        self.mVector.scale(n_reciprocal)
+        self.mX *= n_reciprocal
+        self.mY *= n_reciprocal
+        self.mZ *= n_reciprocal
+        self.mRotation = None
 
     def inverse(self):
         """Invert the quaternion and return the inverse.
         inverse = conjugate / (norm^2)
         """
         n = self.norm()
-        c = self.conj()
         d = 1.0 / (n * n)
-        c.scale(d)
-        return c
+        return Quaternion._fromFloats(self.mScalar * d, -self.mX * d,
+                                      -self.mY * d, -self.mZ * d)
 
     def invert(self):
         'Invert in place.'
         n = self.norm()
         d = 1.0 / (n * n)
-        for i in range(0, 3) : 
-            self.mVector[i] *= -d
+        self.mX *= -d
+        self.mY *= -d
+        self.mZ *= -d
         self.mScalar *= d
+        self.mRotation = None
+
+    def rotate(self, v):
+        """Rotate the 3-vector v by this quaternion, returning a new Vector
+        equal to the vector part of q * v * q^-1.
+
+        Rather than forming the quaternion products, this uses
+
+        v' = v + w * t + u x t,  where t = (2 / |q|^2) * (u x v)
+
+        for q = [w, u], which needs no intermediate objects. q need not be
+        a unit quaternion.
+        """
+        if len(v) != 3:
+            raise IndexError('Only 3-vectors can be rotated.')
+        (w, a, b, c) = (self.mScalar, self.mX, self.mY, self.mZ)
+        (x, y, z) = (v[0], v[1], v[2])
+        k = 2.0 / (w * w + a * a + b * b + c * c)
+        tx = k * (b * z - c * y)
+        ty = k * (c * x - a * z)
+        tz = k * (a * y - b * x)
+        return Vector._fromList([ x + w * tx + b * tz - c * ty,
+                                  y + w * ty + c * tx - a * tz,
+                                  z + w * tz + a * ty - b * tx ])
+
+    def _rotationCoefficients(self):
+        """Return the nine elements of the rotation matrix of this
+        quaternion, in row order, from the cache if possible."""
+        if self.mRotation is None:
+            self.mRotation = self._computeRotation()
+        return self.mRotation
+
+    def _computeRotation(self):
+        """Compute the nine elements of the rotation matrix of this
+        quaternion, in row order."""
+        (w, a, b, c) = (self.mScalar, self.mX, self.mY, self.mZ)
+        k = 2.0 / (w * w + a * a + b * b + c * c)
+        (ka, kb, kc) = (k * a, k * b, k * c)
+        (aa, bb, cc) = (ka * a, kb * b, kc * c)
+        (ab, ac, bc) = (ka * b, ka * c, kb * c)
+        (wa, wb, wc) = (ka * w, kb * w, kc * w)
+        return (1.0 - bb - cc, ab - wc, ac + wb,
+                ab + wc, 1.0 - aa - cc, bc - wa,
+                ac - wb, bc + wa, 1.0 - aa - bb)
+
+    def rotateMany(self, points):
+        """Rotate many points at once by this quaternion. points is either
+        a VectorArray, and a new VectorArray is returned, or a flat
+        sequence of interleaved x, y, z values, and a new array('d') is
+        returned.
+
+        The quaternion is converted to a rotation matrix once, and the
+        coordinates are then transformed a column at a time."""
+        if isinstance(points, VectorArray):
+            rv = VectorArray()
+            rv.mV = self.rotateMany(points.mV)
+            return rv
+        if len(points) % 3 != 0:
+            raise IndexError('Length must be a multiple of 3.')
+        coefficients = self._rotationCoefficients()
+        k = Backend.mKernels
+        if k is not None:
+            return k.transform3(points, coefficients)
+        (r00, r01, r02, r10, r11, r12, r20, r21, r22) = coefficients
+        (xs, ys, zs) = (points[0::3], points[1::3], points[2::3])
+        rv = array('d', [ 0.0 ]) * len(points)
+        rv[0::3] = array('d', [ r00 * x + r01 * y + r02 * z
+                                for (x, y, z) in izip(xs, ys, zs) ])
+        rv[1::3] = array('d', [ r10 * x + r11 * y + r12 * z
+                                for (x, y, z) in izip(xs, ys, zs) ])
+        rv[2::3] = array('d', [ r20 * x + r21 * y + r22 * z
+                                for (x, y, z) in izip(xs, ys, zs) ])
+        return rv
+
+    def toMatrix(self):
+        """Return the 3x3 rotation Matrix equivalent to this quaternion,
+        so that toMatrix().multv(v) == rotate(v)."""
+        return Matrix._fromArray(3, 3,
+                                 array('d', self._rotationCoefficients()))
+
+    @staticmethod
+    def fromMatrix(m):
+        """Return the unit quaternion for the 3x3 rotation matrix m, which
+        may be a Matrix, a Matrix3 or any 3x3 sequence of rows. Of the two
+        quaternions q and -q for each rotation, the one with a
+        non-negative scalar part is returned.
+
+        The largest of the four components is recovered first, from the
+        diagonal, and the others from it, to avoid dividing by a small
+        number."""
+        r = Matrix3.fromMatrix(m)
+        trace = r.m00 + r.m11 + r.m22
+        if trace > 0.0:
+            k = 0.5 / math.sqrt(trace + 1.0)
+            q = Quaternion(0.25 / k, (r.m21 - r.m12) * k,
+                           (r.m02 - r.m20) * k, (r.m10 - r.m01) * k)
+        elif r.m00 > r.m11 and r.m00 > r.m22:
+            k = 0.5 / math.sqrt(1.0 + r.m00 - r.m11 - r.m22)
+            q = Quaternion((r.m21 - r.m12) * k, 0.25 / k,
+                           (r.m01 + r.m10) * k, (r.m02 + r.m20) * k)
+        elif r.m11 > r.m22:
+            k = 0.5 / math.sqrt(1.0 + r.m11 - r.m00 - r.m22)
+            q = Quaternion((r.m02 - r.m20) * k, (r.m01 + r.m10) * k,
+                           0.25 / k, (r.m12 + r.m21) * k)
+        else:
+            k = 0.5 / math.sqrt(1.0 + r.m22 - r.m00 - r.m11)
+            q = Quaternion((r.m10 - r.m01) * k, (r.m02 + r.m20) * k,
+                           (r.m12 + r.m21) * k, 0.25 / k)
+        if q.mScalar < 0.0:
+            q.scale(-1.0)
+        return q
 
     @staticmethod
     def forRotation(axis, angle):
@@ -298,6 +542,16 @@ class QuaternionTest(unittest.TestCase):
         assert(k.mul1(j) == negi)          # kj == -i
         assert(i.mul1(k) == negj)          # ik == -j
 
+    def testProductsAgree(self):
+        'Cross-check the three multiplication algorithms.'
+        import random
+        rng = random.Random(4)
+        for n in range(20):
+            p = Quaternion(*[ rng.uniform(-2, 2) for j in range(4) ])
+            q = Quaternion(*[ rng.uniform(-2, 2) for j in range(4) ])
+            assert p.mul2(q) == p.mulq(q)
+            assert (p.mul1(q) - p.mulq(q)).norm() < 1e-14
+
     def testMul3(self):
         'Verify that Quaternion obeys the basic laws of quaternions.'
         neg1 = Quaternion(-1, 0, 0, 0)
@@ -424,3 +678,171 @@ class QuaternionTest(unittest.TestCase):
         assert q1 == q2
         q2.mVector[1] = -3
         assert q1 != q2
+
+    def testSlots(self):
+        'Test the flat storage.'
+        q = Quaternion(1, 2, 3, 4)
+        assert (q.mScalar, q.mX, q.mY, q.mZ) == (1, 2.0, 3.0, 4.0)
+        assert not hasattr(q, '__dict__')
+        hitError = False
+        try:
+            q.mW = 1
+        except AttributeError:
+            hitError = True
+        assert hitError
+        assert Quaternion._fromFloats(1.0, 2.0, 3.0, 4.0) == q
+        assert q.mulq(Quaternion(5, 6, 7, 8)).compare([ -60, 12, 30, 24 ])
+
+    def testVectorView(self):
+        'Test that mVector reads and writes the quaternion.'
+        q = Quaternion(1, 2, 3, 4)
+        v = q.mVector
+        assert isinstance(v, Vector)
+        assert v == [ 2, 3, 4 ]
+        assert v.norm() == Vector(2, 3, 4).norm()
+        q.mX = 5
+        assert v == [ 5, 3, 4 ]
+
+        q.toMatrix()
+        v[2] = -1
+        assert q.compare([ 1, 5, 3, -1 ])
+        assert q.mRotation is None
+        v += Vector(1, 1, 1)
+        assert q.compare([ 1, 6, 4, 0 ])
+        v *= 0.5
+        assert q.compare([ 1, 3, 2, 0 ])
+        q.mVector.axpy(2, Vector(0, 0, 1))
+        assert q.compare([ 1, 3, 2, 2 ])
+        q.mVector.normalize()
+        assert abs(Vector(q.mX, q.mY, q.mZ).norm() - 1) < 1e-15
+        q.mVector = Vector(7, 8, 9)
+        assert q.compare([ 1, 7, 8, 9 ])
+        q.mVector -= [ 7, 8, 9 ]
+        assert q.compare([ 1, 0, 0, 0 ])
+
+        for call in (lambda: q.mVector.__delitem__(0),
+                     lambda: setattr(q, 'mVector', Vector(1, 2))):
+            hitError = False
+            try:
+                call()
+            except (TypeError, IndexError):
+                hitError = True
+            assert hitError
+        assert q.compare([ 1, 0, 0, 0 ])
+
+        # The view may be the out parameter of the Vector methods.
+        q = Quaternion(1, 2, 3, 4)
+        r = Vector(1, 0, 0).cross(Vector(0, 1, 0), out=q.mVector)
+        assert r == [ 0, 0, 1 ]
+        assert q.compare([ 1, 0, 0, 1 ])
+        q.toMatrix()
+        Vector(1, -2, 0.5).mults(2, out=q.mVector)
+        assert q.compare([ 1, 2, -4, 1 ])
+        assert q.mRotation is None
+        Vector(3, 0, 4).normalize(out=q.mVector)
+        assert (q - Quaternion(1, 0.6, 0, 0.8)).norm() < 1e-15
+        q.mVector.cross(Vector(0, 0, 1), out=q.mVector)
+        assert (q - Quaternion(1, 0, -0.6, 0)).norm() < 1e-15
+
+    def testRotate(self):
+        'Test rotation of vectors against the quaternion product.'
+        axis = Vector(1, -2, 0.5).normalize()
+        q = Quaternion.forRotation(axis, 1.3)
+        for v in (Vector(1, 0, 0), Vector(0.3, -4, 2), axis):
+            p = Quaternion.fromScalarVector(0.0, v)
+            expected = q.mulq(p).mulq(q.conj()).mVector
+            assert (q.rotate(v) - expected).norm() < 1e-14
+        assert (q.rotate(axis) - axis).norm() < 1e-14
+
+        # A quaternion of any norm gives the same rotation.
+        v = Vector(0.3, -4, 2)
+        assert (q.mults(-3.5).rotate(v) - q.rotate(v)).norm() < 1e-14
+
+        q = Quaternion.forRotation(Vector(0, 0, 1), math.pi / 2)
+        assert q.rotate([ 1, 0, 0 ]).round(15) == [ 0, 1, 0 ]
+
+        hitError = False
+        try:
+            q.rotate(Vector(1, 0))
+        except IndexError:
+            hitError = True
+        assert hitError
+
+    def testRotateMany(self):
+        'Test batch rotation of points.'
+        q = Quaternion(0.5, -1, 2, 0.25)
+        points = [ Vector(1, 2, 3), Vector(-4, 0.5, 2), Vector(0, 0, 0) ]
+        flat = [ x for v in points for x in v ]
+        rotated = q.rotateMany(flat)
+        assert len(rotated) == 9
+        for (i, v) in enumerate(points):
+            r = q.rotate(v)
+            for j in range(3):
+                assert abs(rotated[3*i + j] - r[j]) < 1e-14
+
+        va = q.rotateMany(VectorArray.fromVectors(points))
+        assert isinstance(va, VectorArray)
+        assert list(va.mV) == list(rotated)
+        assert len(q.rotateMany([])) == 0
+
+        hitError = False
+        try:
+            q.rotateMany([ 1, 2, 3, 4 ])
+        except IndexError:
+            hitError = True
+        assert hitError
+
+    def testMatrixConversion(self):
+        'Test conversion to and from rotation matrices.'
+        q = Quaternion.forRotation(Vector(0, 0, 1), math.pi / 2)
+        m = q.toMatrix()
+        assert isinstance(m, Matrix)
+        assert m.round(15) == [[0, -1, 0], [1, 0, 0], [0, 0, 1]]
+
+        v = Vector(0.3, -4, 2)
+        for q in (Quaternion(0.5, -1, 2, 0.25), Quaternion(-0.1, 0, 0, 3),
+                  Quaternion(0.01, 2, 0.2, -1), Quaternion(0, 0, 1, 0.5),
+                  Quaternion(1, 0, 0, 0)):
+            m = q.toMatrix()
+            assert (m.multv(v) - q.rotate(v)).norm() < 1e-14
+            r = Quaternion.fromMatrix(m)
+            assert r.mScalar >= 0
+            assert abs(r.norm() - 1) < 1e-14
+            q.normalize()
+            if q.mScalar < 0:
+                q.scale(-1)
+            assert (r - q).norm() < 1e-14
+            rows = [ [ m[i][j] for j in range(3) ] for i in range(3) ]
+            assert (Quaternion.fromMatrix(rows) - q).norm() < 1e-14
+            assert (Quaternion.fromMatrix(Matrix3.fromMatrix(m)) - q).norm() \
+                < 1e-14
+
+        hitError = False
+        try:
+            Quaternion.fromMatrix(Matrix.identity(4))
+        except IndexError:
+            hitError = True
+        assert hitError
+
+    def testRotationCache(self):
+        'Test that mutating operations discard the cached matrix.'
+        q = Quaternion(0.5, -1, 2, 0.25)
+        m = q.toMatrix()
+        assert q.mRotation is not None
+        assert q._rotationCoefficients() is q.mRotation
+        m[0][0] = 100
+        assert q.toMatrix() != m
+
+        q.toMatrix()
+        q.scale(2)
+        assert q.mRotation is None
+
+        r = q.clone()
+        r.invert()
+        assert r.mRotation is None
+        assert q.toMatrix().multm(r.toMatrix()).round(14) == \
+            Matrix.identity(3)
+
+        q.toMatrix()
+        q.normalize()
+        assert q.mRotation is None
@@ -0,0 +1,470 @@
+#!/usr/bin/python
+
+# Disable some pylint messages
+# pylint: disable=C0103,R0201,R0904,R0914,W0511,W0212
+# C0103 : Invalid name "%s" (should match %s)
+# R0201 : Method could be a function
+# R0904 : Too many public methods
+# R0914 : Too many local variables
+# W0511 : TODO/FIXME/XXX
+# W0212 : Access to a protected member %s of a client class
+
+"""
+QuaternionArray definition.
+"""
+
+import math
+import unittest
+from array import array
+from itertools import izip
+
+from Vector import Vector
+from Quaternion import Quaternion
+from Backend import Backend
+
+# Above this cosine of the angle between two quaternions, slerp() falls
+# back to normalized linear interpolation, which is indistinguishable
+# there and does not divide by a vanishing sine.
+SLERP_THRESHOLD = 0.9995
+
+########################################################################
+class QuaternionArray:
+
+    """QuaternionArray : a packed sequence of quaternions.
+
+    The quaternions are stored as interleaved w, x, y, z values in a
+    single array('d'), where w is the scalar part, and the batched
+    operations below work on whole columns at a time instead of going
+    through one Quaternion per element. Each batched operation matches the
+    Quaternion method of the same name applied to every element. Where an
+    operation takes another operand, that may be a QuaternionArray of the
+    same length, or a single Quaternion which is then used with every
+    element.
+    """
+
+    def __init__(self, n=0):
+        """Initialize an array of n zero quaternions."""
+        self.mQ = array('d', [ 0.0 ]) * (4 * n)
+
+    @staticmethod
+    def fromArray(data):
+        """Initialize from a flat sequence of interleaved w, x, y, z
+        values. The values are copied."""
+        if len(data) % 4 != 0:
+            raise IndexError('Length must be a multiple of 4.')
+        rv = QuaternionArray()
+        rv.mQ = array('d', data)
+        return rv
+
+    @staticmethod
+    def fromQuaternions(quaternions):
+        """Initialize from a sequence of Quaternions."""
+        rv = QuaternionArray()
+        data = rv.mQ
+        for q in quaternions:
+            data.extend((q.mScalar, q.mX, q.mY, q.mZ))
+        return rv
+
+    @staticmethod
+    def identity(n):
+        """Return an array of n identity quaternions."""
+        return QuaternionArray.fromArray(array('d', [ 1, 0, 0, 0 ]) * n)
+
+    def toQuaternions(self):
+        """Return the contents as a list of Quaternions."""
+        d = self.mQ
+        return [ Quaternion._fromFloats(d[i], d[i+1], d[i+2], d[i+3])
+                 for i in xrange(0, len(d), 4) ]
+
+    def clone(self):
+        """Return a copy of this array."""
+        return QuaternionArray.fromArray(self.mQ)
+
+    def __len__(self):
+        "Return the number of quaternions."
+        return len(self.mQ) // 4
+
+    def _index(self, i):
+        """Return the position in mQ of the first element of quaternion
+        i."""
+        n = len(self)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError('Index out of bounds : %s' % i)
+        return 4 * i
+
+    def __getitem__(self, i):
+        "Return a copy of quaternion i, as a Quaternion."
+        j = self._index(i)
+        d = self.mQ
+        return Quaternion._fromFloats(d[j], d[j+1], d[j+2], d[j+3])
+
+    def __setitem__(self, i, q):
+        "Set quaternion i from a Quaternion."
+        j = self._index(i)
+        self.mQ[j:j+4] = array('d', (q.mScalar, q.mX, q.mY, q.mZ))
+
+    def __iter__(self):
+        d = self.mQ
+        for i in xrange(0, len(d), 4):
+            yield Quaternion._fromFloats(d[i], d[i+1], d[i+2], d[i+3])
+
+    def __eq__(self, other):
+        """Equality with another sequence of Quaternions."""
+        if len(self) != len(other):
+            return False
+        for (q1, q2) in zip(self, other):
+            if q1 != q2:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        return '[ %s ]' % ', '.join([ str(q) for q in self ])
+
+    def _operand(self, other):
+        """Return other as a flat array of the same length as mQ, repeating
+        it if it is a single Quaternion."""
+        if isinstance(other, QuaternionArray):
+            if len(other) != len(self):
+                raise IndexError('Arrays must be the same size.')
+            return other.mQ
+        return array('d', (other.mScalar, other.mX, other.mY, other.mZ)) * \
+            len(self)
+
+    def _parameters(self, t):
+        """Return the interpolation parameter t as a list with one value
+        per quaternion, repeating it if it is a single number."""
+        if isinstance(t, (int, long, float)):
+            return [ float(t) ] * len(self)
+        if len(t) != len(self):
+            raise IndexError('Need one parameter per quaternion.')
+        return [ float(s) for s in t ]
+
+    @staticmethod
+    def _columns(d):
+        """Return the w, x, y and z columns of the flat array d."""
+        return (d[0::4], d[1::4], d[2::4], d[3::4])
+
+    @staticmethod
+    def _fromColumns(ws, xs, ys, zs):
+        """Interleave four columns into a new QuaternionArray."""
+        rv = QuaternionArray(len(ws))
+        rv.mQ[0::4] = array('d', ws)
+        rv.mQ[1::4] = array('d', xs)
+        rv.mQ[2::4] = array('d', ys)
+        rv.mQ[3::4] = array('d', zs)
+        return rv
+
+    @staticmethod
+    def _mulColumns(c1, c2):
+        """Return the products of the quaternions held in the columns c1
+        and c2, as four lists."""
+        rows = zip(*(c1 + c2))
+        return ([ s1 * s2 - a1 * a2 - b1 * b2 - e1 * e2
+                  for (s1, a1, b1, e1, s2, a2, b2, e2) in rows ],
+                [ s1 * a2 + a1 * s2 + b1 * e2 - e1 * b2
+                  for (s1, a1, b1, e1, s2, a2, b2, e2) in rows ],
+                [ s1 * b2 - a1 * e2 + b1 * s2 + e1 * a2
+                  for (s1, a1, b1, e1, s2, a2, b2, e2) in rows ],
+                [ s1 * e2 + a1 * b2 - b1 * a2 + e1 * s2
+                  for (s1, a1, b1, e1, s2, a2, b2, e2) in rows ])
+
+    def mulq(self, other):
+        """Return the products self[i] * other[i], as a new
+        QuaternionArray."""
+        b = self._operand(other)
+        k = Backend.mKernels
+        if k is not None:
+            rv = QuaternionArray()
+            rv.mQ = k.quaternionMulq(self.mQ, b)
+            return rv
+        return QuaternionArray._fromColumns(*QuaternionArray._mulColumns(
+            QuaternionArray._columns(self.mQ), QuaternionArray._columns(b)))
+
+    def conj(self):
+        """Return the conjugates, as a new QuaternionArray."""
+        rv = self.clone()
+        d = rv.mQ
+        for i in (1, 2, 3):
+            d[i::4] = array('d', [ -x for x in d[i::4] ])
+        return rv
+
+    def norm(self):
+        """Return the norms of the quaternions, as an array('d')."""
+        (ws, xs, ys, zs) = QuaternionArray._columns(self.mQ)
+        return array('d', [ math.sqrt(x * x + y * y + z * z + w * w)
+                            for (w, x, y, z) in izip(ws, xs, ys, zs) ])
+
+    def normalize(self):
+        """Turn every quaternion into a unit quaternion in place."""
+        k = Backend.mKernels
+        if k is not None:
+            k.quaternionNormalize(self.mQ)
+            return self
+        (ws, xs, ys, zs) = QuaternionArray._columns(self.mQ)
+        r = [ 1.0 / math.sqrt(x * x + y * y + z * z + w * w)
+              for (w, x, y, z) in izip(ws, xs, ys, zs) ]
+        d = self.mQ
+        d[0::4] = array('d', [ w * s for (w, s) in izip(ws, r) ])
+        d[1::4] = array('d', [ x * s for (x, s) in izip(xs, r) ])
+        d[2::4] = array('d', [ y * s for (y, s) in izip(ys, r) ])
+        d[3::4] = array('d', [ z * s for (z, s) in izip(zs, r) ])
+        return self
+
+    def inverse(self):
+        """Return the inverses, conjugate / (norm^2), as a new
+        QuaternionArray."""
+        (ws, xs, ys, zs) = QuaternionArray._columns(self.mQ)
+        r = [ 1.0 / (x * x + y * y + z * z + w * w)
+              for (w, x, y, z) in izip(ws, xs, ys, zs) ]
+        return QuaternionArray._fromColumns(
+            [ w * s for (w, s) in izip(ws, r) ],
+            [ -x * s for (x, s) in izip(xs, r) ],
+            [ -y * s for (y, s) in izip(ys, r) ],
+            [ -z * s for (z, s) in izip(zs, r) ])
+
+    def nlerp(self, other, t):
+        """Return the normalized linear interpolation from each unit
+        quaternion in self, at t = 0, to the one in other, at t = 1, as a
+        new QuaternionArray. t is either one number for every element or a
+        sequence with one per element. Each pair is interpolated along the
+        shorter arc."""
+        b = self._operand(other)
+        ts = self._parameters(t)
+        k = Backend.mKernels
+        if k is not None:
+            rv = QuaternionArray()
+            rv.mQ = k.quaternionInterpolate(self.mQ, b, ts, None)
+            return rv
+        c1 = QuaternionArray._columns(self.mQ)
+        c2 = QuaternionArray._columns(b)
+        (s0, s1) = ([], [])
+        for (u, w1, x1, y1, z1, w2, x2, y2, z2) in izip(ts, *(c1 + c2)):
+            cosine = w1 * w2 + x1 * x2 + y1 * y2 + z1 * z2
+            s0.append(1.0 - u)
+            s1.append(u if cosine >= 0.0 else -u)
+        return QuaternionArray._blend(c1, c2, s0, s1).normalize()
+
+    def slerp(self, other, t):
+        """Return the spherical linear interpolation from each unit
+        quaternion in self, at t = 0, to the one in other, at t = 1, as a
+        new QuaternionArray. t is either one number for every element or a
+        sequence with one per element. Each pair is interpolated along the
+        shorter arc, at constant angular velocity."""
+        b = self._operand(other)
+        ts = self._parameters(t)
+        k = Backend.mKernels
+        if k is not None:
+            rv = QuaternionArray()
+            rv.mQ = k.quaternionInterpolate(self.mQ, b, ts, SLERP_THRESHOLD)
+            return rv
+        c1 = QuaternionArray._columns(self.mQ)
+        c2 = QuaternionArray._columns(b)
+        (s0, s1) = ([], [])
+        nearlyParallel = False
+        for (u, w1, x1, y1, z1, w2, x2, y2, z2) in izip(ts, *(c1 + c2)):
+            cosine = w1 * w2 + x1 * x2 + y1 * y2 + z1 * z2
+            sign = 1.0
+            if cosine < 0.0:
+                (cosine, sign) = (-cosine, -1.0)
+            if cosine > SLERP_THRESHOLD:
+                s0.append(1.0 - u)
+                s1.append(sign * u)
+                nearlyParallel = True
+            else:
+                angle = math.acos(cosine)
+                r = 1.0 / math.sin(angle)
+                s0.append(math.sin((1.0 - u) * angle) * r)
+                s1.append(sign * math.sin(u * angle) * r)
+        rv = QuaternionArray._blend(c1, c2, s0, s1)
+        if nearlyParallel:
+            # Only the linearly interpolated elements are off the unit
+            # sphere, but renormalizing the rest is harmless.
+            rv.normalize()
+        return rv
+
+    @staticmethod
+    def _blend(c1, c2, s0, s1):
+        """Return s0[i] * q1[i] + s1[i] * q2[i] for the quaternions held in
+        the columns c1 and c2."""
+        return QuaternionArray._fromColumns(
+            *[ [ a * u + b * v for (a, b, u, v) in izip(x1, x2, s0, s1) ]
+               for (x1, x2) in zip(c1, c2) ])
+
+    def composeChain(self):
+        """Return the product self[0] * self[1] * ... * self[n-1] as a
+        Quaternion, or the identity for an empty array.
+
+        Neighbouring pairs are multiplied together in one batched step,
+        halving the chain each time, so the product takes log2(n) batched
+        steps instead of n - 1 scalar ones. The order of the factors is
+        kept, so this is exact up to rounding."""
+        if len(self) == 0:
+            return Quaternion(1.0, 0.0, 0.0, 0.0)
+        k = Backend.mKernels
+        if k is not None:
+            return Quaternion(*k.quaternionChain(self.mQ))
+        columns = QuaternionArray._columns(self.mQ)
+        while len(columns[0]) > 1:
+            odd = len(columns[0]) % 2
+            product = QuaternionArray._mulColumns(
+                tuple([ c[0:len(c)-odd:2] for c in columns ]),
+                tuple([ c[1::2] for c in columns ]))
+            if odd:
+                for (p, c) in zip(product, columns):
+                    p.append(c[-1])
+            columns = product
+        return Quaternion(*[ c[0] for c in columns ])
+
+########################################################################
+# QuaternionArray Unit Tests
+class QuaternionArrayTest(unittest.TestCase):
+    """Unit tests for QuaternionArray class."""
+
+    def setUp(self):
+        'Set up some test quaternions.'
+        self.mQuaternions = [ Quaternion(1, 2, 3, 4),
+                              Quaternion(-0.5, 1, 0, 2),
+                              Quaternion(0, 0, 1, 0),
+                              Quaternion(3, -7, 0.25, 1) ]
+        self.mOthers = [ Quaternion(2, 0, -1, 1),
+                         Quaternion(1, 1, 1, 1),
+                         Quaternion(0, 5, 0, 0.5),
+                         Quaternion(-2, 3, 4, -1) ]
+
+    @staticmethod
+    def _close(qs1, qs2):
+        """Return True if two sequences of quaternions agree to
+        1e-12."""
+        return len(qs1) == len(qs2) and \
+            max([ (q1 - q2).norm() for (q1, q2) in zip(qs1, qs2) ]) < 1e-12
+
+    @staticmethod
+    def _randomUnit(rng, n):
+        """Return a list of n random unit quaternions."""
+        qs = []
+        for i in range(n):
+            q = Quaternion(*[ rng.uniform(-1, 1) for j in range(4) ])
+            q.normalize()
+            qs.append(q)
+        return qs
+
+    def testConversions(self):
+        'Test conversions to and from Quaternions.'
+        qa = QuaternionArray.fromQuaternions(self.mQuaternions)
+        assert len(qa) == 4
+        assert qa == self.mQuaternions
+        assert qa.toQuaternions() == self.mQuaternions
+        assert qa[1] == Quaternion(-0.5, 1, 0, 2)
+        assert qa[-1] == Quaternion(3, -7, 0.25, 1)
+        qa[1] = Quaternion(9, 8, 7, 6)
+        assert qa[1].compare([ 9, 8, 7, 6 ])
+        assert list(qa.mQ[:4]) == [ 1, 2, 3, 4 ]
+
+        qa2 = qa.clone()
+        qa2[0] = Quaternion(0, 0, 0, 0)
+        assert qa[0] == Quaternion(1, 2, 3, 4)
+
+        assert len(QuaternionArray(5)) == 5
+        assert QuaternionArray.identity(2) == [ Quaternion(1, 0, 0, 0) ] * 2
+        assert QuaternionArray.fromArray(range(8))[1].compare([ 4, 5, 6, 7 ])
+
+        for call in (lambda: qa[4],
+                     lambda: QuaternionArray.fromArray([ 1, 2 ])):
+            hitError = False
+            try:
+                call()
+            except IndexError:
+                hitError = True
+            assert hitError
+
+    def testArithmetic(self):
+        'Test batched operations against the Quaternion methods.'
+        qa = QuaternionArray.fromQuaternions(self.mQuaternions)
+        qb = QuaternionArray.fromQuaternions(self.mOthers)
+        pairs = zip(self.mQuaternions, self.mOthers)
+        assert self._close(qa.mulq(qb), [ q1.mulq(q2) for (q1, q2) in pairs ])
+        assert qa.conj() == [ q.conj() for q in self.mQuaternions ]
+        assert self._close(qa.inverse(),
+                           [ q.inverse() for q in self.mQuaternions ])
+        assert max([ abs(n - q.norm()) for (n, q)
+                     in zip(qa.norm(), self.mQuaternions) ]) < 1e-12
+
+        r = Quaternion(0.5, -1, 2, 0.25)
+        assert self._close(qa.mulq(r),
+                           [ q.mulq(r) for q in self.mQuaternions ])
+
+        assert qa.normalize() is qa
+        expected = [ q.clone() for q in self.mQuaternions ]
+        for q in expected:
+            q.normalize()
+        assert self._close(qa, expected)
+
+        hitError = False
+        try:
+            qa.mulq(QuaternionArray(3))
+        except IndexError:
+            hitError = True
+        assert hitError
+
+    def testInterpolation(self):
+        'Test slerp and nlerp.'
+        import random
+        rng = random.Random(5)
+        qa = QuaternionArray.fromQuaternions(self._randomUnit(rng, 20))
+        qb = QuaternionArray.fromQuaternions(self._randomUnit(rng, 20))
+        # Make one pair nearly parallel, and one of opposite sign.
+        qb[3] = qa[3].mults(-1)
+        qb[4] = qa[4] + Quaternion(1e-4, 0, 0, 0)
+
+        for method in (qa.slerp, qa.nlerp):
+            assert self._close(method(qb, 0), qa)
+            result = method(qb, 1)
+            for i in range(20):
+                # q and -q are the same rotation.
+                error = min((result[i] - qb[i]).norm(),
+                            (result[i] + qb[i]).norm())
+                assert error < (1e-3 if i == 4 else 1e-12), i
+            assert max([ abs(n - 1) for n in method(qb, 0.3).norm() ]) < 1e-12
+
+        # Rotation about a fixed axis at constant angular velocity.
+        axis = Vector(1, 2, -2).normalize()
+        start = QuaternionArray.fromQuaternions(
+            [ Quaternion(1, 0, 0, 0) ] * 5)
+        end = Quaternion.forRotation(axis, 2.0)
+        ts = [ 0, 0.1, 0.5, 0.75, 1 ]
+        result = start.slerp(end, ts)
+        assert self._close(result,
+                           [ Quaternion.forRotation(axis, 2.0 * t)
+                             for t in ts ])
+        nlerped = start.nlerp(end, ts)
+        assert self._close([ nlerped[0], nlerped[2], nlerped[4] ],
+                           [ result[0], result[2], result[4] ])
+        assert (nlerped[1] - result[1]).norm() > 1e-3
+
+        hitError = False
+        try:
+            start.slerp(end, [ 0, 1 ])
+        except IndexError:
+            hitError = True
+        assert hitError
+
+    def testComposeChain(self):
+        'Test products of long chains against sequential products.'
+        import random
+        rng = random.Random(9)
+        for n in (1, 2, 3, 7, 8, 100):
+            qs = self._randomUnit(rng, n)
+            expected = reduce(lambda q1, q2: q1.mulq(q2), qs)
+            product = QuaternionArray.fromQuaternions(qs).composeChain()
+            assert (product - expected).norm() < 1e-12, n
+
+        assert QuaternionArray().composeChain() == Quaternion(1, 0, 0, 0)
+        qa = QuaternionArray.fromQuaternions(self.mQuaternions)
+        expected = self.mQuaternions[0].mulq(self.mQuaternions[1]).mulq(
+            self.mQuaternions[2]).mulq(self.mQuaternions[3])
+        assert (qa.composeChain() - expected).norm() < 1e-12
@@ -0,0 +1,417 @@
+#!/usr/bin/python
+
+# Disable some pylint messages
+# pylint: disable=C0103,R0201,R0904,R0913,R0914,W0511,W0212
+# C0103 : Invalid name "%s" (should match %s)
+# R0201 : Method could be a function
+# R0904 : Too many public methods
+# R0913 : Too many arguments
+# R0914 : Too many local variables
+# W0511 : TODO/FIXME/XXX
+# W0212 : Access to a protected member %s of a client class
+
+"""
+SparseMatrix definition.
+"""
+
+import unittest
+import math
+import operator
+from array import array
+from itertools import izip
+from Vector import Vector
+from Matrix import Matrix
+from Backend import Backend
+
+########################################################################
+class SparseMatrix:
+
+    """
+    SparseMatrix : a matrix which stores only its nonzero elements.
+
+    The storage is compressed sparse row (CSR): the nonzero elements of
+    row i are mData[mIndptr[i]:mIndptr[i+1]], and their column indices
+    are the same slice of mIndices. Within each row the columns are in
+    increasing order, with no repeats. mData is an array('d'), and
+    mIndptr and mIndices are array('i'), so a matrix with nnz nonzero
+    elements takes about 12 * nnz bytes.
+
+    Matrices are built from coordinate (COO) triplets with fromCoo(), from
+    a dense Matrix, or as the graph Laplacian of a TriangleGroup. There is
+    no sparse LU factorization; symmetric positive definite systems, such
+    as a shifted Laplacian, are solved with conjugateGradient().
+    """
+
+    def __init__(self, nrows, ncols):
+        """Initialize an nrows x ncols matrix of zeros."""
+        self.mNRows = nrows
+        self.mNCols = ncols
+        self.mIndptr = array('i', [ 0 ]) * (nrows + 1)
+        self.mIndices = array('i')
+        self.mData = array('d')
+
+    @staticmethod
+    def fromCoo(nrows, ncols, rows, cols, values):
+        """Build a matrix from coordinate triplets: element
+        (rows[k], cols[k]) has the value values[k]. Repeated coordinates
+        are summed, as is usual for COO input."""
+        if not len(rows) == len(cols) == len(values):
+            raise IndexError('rows, cols and values must be the same length.')
+        for (indices, n) in ((rows, nrows), (cols, ncols)):
+            if len(indices) and (min(indices) < 0 or max(indices) >= n):
+                raise IndexError('Index out of bounds.')
+        m = SparseMatrix(nrows, ncols)
+        counts = m.mIndptr
+        last = None
+        for (key, value) in sorted(izip(izip(rows, cols), values)):
+            if key == last:
+                m.mData[-1] += value
+                continue
+            last = key
+            counts[key[0] + 1] += 1
+            m.mIndices.append(key[1])
+            m.mData.append(value)
+        for i in range(nrows):
+            counts[i + 1] += counts[i]
+        return m
+
+    @staticmethod
+    def fromDense(matrix):
+        """Build a matrix from the nonzero elements of a dense Matrix."""
+        (nrows, ncols) = matrix.size()
+        d = matrix._contiguous()
+        m = SparseMatrix(nrows, ncols)
+        for i in range(nrows):
+            for j in range(ncols):
+                value = d[i*ncols + j]
+                if value != 0.0:
+                    m.mIndices.append(j)
+                    m.mData.append(value)
+            m.mIndptr[i + 1] = len(m.mData)
+        return m
+
+    @staticmethod
+    def identity(size):
+        """Return a square sparse identity matrix of the indicated size."""
+        m = SparseMatrix(size, size)
+        m.mIndptr = array('i', range(size + 1))
+        m.mIndices = array('i', range(size))
+        m.mData = array('d', [ 1.0 ]) * size
+        return m
+
+    @staticmethod
+    def laplacian(group, shift=0.0):
+        """Return the graph Laplacian of the vertices and edges of a
+        TriangleGroup, plus shift times the identity: element (i, i) is
+        the number of edges at vertex i plus shift, and element (i, j) is
+        -1 if there is an edge between vertices i and j.
+
+        The Laplacian itself is singular, since the sum of every row is 0;
+        with shift > 0 the matrix is positive definite, and
+        conjugateGradient() can solve it, e.g. for implicit smoothing."""
+        n = group.nVertices()
+        edges = getattr(group.mEdges, 'mData', None)
+        if edges is None:
+            edges = array('i')
+            for edge in group.mEdges:
+                edges.extend(edge)
+        neighbors = [ [ i ] for i in xrange(n) ]
+        for k in xrange(0, len(edges), 2):
+            (i, j) = (edges[k], edges[k + 1])
+            neighbors[i].append(j)
+            neighbors[j].append(i)
+
+        m = SparseMatrix(n, n)
+        indptr = m.mIndptr
+        indices = m.mIndices
+        data = m.mData
+        for i in xrange(n):
+            columns = neighbors[i]
+            degree = len(columns) - 1
+            columns.sort()
+            indices.extend(columns)
+            row = [ -1.0 ] * len(columns)
+            row[columns.index(i)] = degree + shift
+            data.extend(row)
+            indptr[i + 1] = len(indices)
+        return m
+
+    def toDense(self):
+        """Return a copy of this matrix as a dense Matrix."""
+        ncols = self.mNCols
+        d = array('d', [ 0.0 ]) * (self.mNRows * ncols)
+        indptr = self.mIndptr
+        for i in range(self.mNRows):
+            for k in range(indptr[i], indptr[i + 1]):
+                d[i*ncols + self.mIndices[k]] = self.mData[k]
+        return Matrix._fromArray(self.mNRows, ncols, d)
+
+    def size(self):
+        """Return a tuple indicating size in (rows,cols)."""
+        return (self.mNRows, self.mNCols)
+
+    def nnz(self):
+        """Return the number of stored elements."""
+        return len(self.mData)
+
+    def element(self, i, j):
+        """Return element (i, j), which is 0 if it is not stored."""
+        if i < 0 or i >= self.mNRows or j < 0 or j >= self.mNCols:
+            raise IndexError('Index out of bounds : (%s, %s)' % (i, j))
+        for k in range(self.mIndptr[i], self.mIndptr[i + 1]):
+            if self.mIndices[k] == j:
+                return self.mData[k]
+        return 0.0
+
+    def diagonal(self):
+        """Return the diagonal elements, as an array('d')."""
+        diag = array('d', [ 0.0 ]) * min(self.mNRows, self.mNCols)
+        indptr = self.mIndptr
+        indices = self.mIndices
+        for i in range(len(diag)):
+            for k in range(indptr[i], indptr[i + 1]):
+                if indices[k] == i:
+                    diag[i] = self.mData[k]
+        return diag
+
+    def transpose(self):
+        """Return a new matrix which is the transpose of this matrix."""
+        rows = array('i')
+        for i in range(self.mNRows):
+            rows.extend(array('i', [ i ]) *
+                        (self.mIndptr[i + 1] - self.mIndptr[i]))
+        return SparseMatrix.fromCoo(self.mNCols, self.mNRows,
+                                    self.mIndices, rows, self.mData)
+
+    def _multv(self, x):
+        """Return self * x for a sequence x of the right length, as a
+        list."""
+        k = Backend.mKernels
+        if k is not None:
+            return k.csrMultv(self.mIndptr, self.mIndices, self.mData,
+                              self.mNRows, x).tolist()
+        # Gather and multiply all of the products at once, then sum them
+        # a row at a time.
+        products = map(operator.mul, self.mData,
+                       map(x.__getitem__, self.mIndices))
+        indptr = self.mIndptr
+        return [ sum(products[indptr[i]:indptr[i + 1]])
+                 for i in xrange(self.mNRows) ]
+
+    def multv(self, v):
+        """Multiply by a vector, returning a Vector:
+
+        V = self * v
+        """
+        if self.mNCols != len(v):
+            raise TypeError(
+                "Incompatible object sizes: %sx%s matrix and %s vector" %
+                (self.mNRows, self.mNCols, len(v)))
+        return Vector._fromList(self._multv(v[:]))
+
+    def transposeMultv(self, v):
+        """Multiply the transpose of this matrix by a vector, without
+        forming the transpose, returning a Vector:
+
+        V = transpose(self) * v
+        """
+        if self.mNRows != len(v):
+            raise TypeError(
+                "Incompatible object sizes: %sx%s transpose and %s vector" %
+                (self.mNCols, self.mNRows, len(v)))
+        k = Backend.mKernels
+        if k is not None:
+            return Vector._fromList(k.csrTransposeMultv(
+                self.mIndptr, self.mIndices, self.mData, self.mNCols,
+                v[:]).tolist())
+        y = [ 0.0 ] * self.mNCols
+        indptr = self.mIndptr
+        indices = self.mIndices
+        data = self.mData
+        for i in xrange(self.mNRows):
+            vi = v[i]
+            if vi != 0.0:
+                for k in xrange(indptr[i], indptr[i + 1]):
+                    y[indices[k]] += data[k] * vi
+        return Vector._fromList(y)
+
+    def conjugateGradient(self, b, x0=None, tolerance=1e-10,
+                          maxIterations=None):
+        """Solve [A] * x = b for a symmetric positive definite matrix by
+        the conjugate gradient method, with Jacobi (diagonal)
+        preconditioning. Returns (x, iterations), where x is a Vector.
+
+        The iteration stops when the norm of the residual falls to
+        tolerance times the norm of b. Raises ValueError if that takes
+        more than maxIterations (by default the order of the matrix) or if
+        the diagonal has a zero, which no positive definite matrix has.
+        """
+        n = self.mNRows
+        if n != self.mNCols or len(b) != n:
+            raise TypeError(
+                "Incompatible object sizes: %sx%s matrix and %s vector" %
+                (n, self.mNCols, len(b)))
+        if maxIterations is None:
+            maxIterations = max(n, 1)
+        diag = self.diagonal()
+        if 0.0 in diag:
+            raise ValueError('Zero on the diagonal.')
+        b = [ float(e) for e in b ]
+        if x0 is None:
+            x = [ 0.0 ] * n
+        else:
+            x = [ float(e) for e in x0 ]
+
+        k = Backend.mKernels
+        if k is not None:
+            (x, iterations, converged) = k.csrConjugateGradient(
+                self.mIndptr, self.mIndices, self.mData, diag, b, x,
+                tolerance, maxIterations)
+            x = x.tolist()
+        else:
+            (x, iterations, converged) = self._conjugateGradient(
+                diag, b, x, tolerance, maxIterations)
+        if not converged:
+            raise ValueError('Conjugate gradient did not converge in %s '
+                             'iterations.' % maxIterations)
+        return (Vector._fromList(x), iterations)
+
+    def _conjugateGradient(self, diag, b, x, tolerance, maxIterations):
+        """The preconditioned conjugate gradient iteration on lists.
+        Returns (x, iterations, converged)."""
+        mul = operator.mul
+        def dot(u, v):
+            'Return the dot product of two lists.'
+            return sum(map(mul, u, v))
+
+        inverse = [ 1.0 / e for e in diag ]
+        Ax = self._multv(x)
+        r = [ bi - ai for (bi, ai) in izip(b, Ax) ]
+        limit = (tolerance * math.sqrt(dot(b, b))) ** 2
+        z = map(mul, inverse, r)
+        p = z
+        rz = dot(r, z)
+        iterations = 0
+        while dot(r, r) > limit:
+            if iterations >= maxIterations:
+                return (x, iterations, False)
+            Ap = self._multv(p)
+            alpha = rz / dot(p, Ap)
+            x = [ xi + alpha * pi for (xi, pi) in izip(x, p) ]
+            r = [ ri - alpha * api for (ri, api) in izip(r, Ap) ]
+            z = map(mul, inverse, r)
+            (rz, rzOld) = (dot(r, z), rz)
+            beta = rz / rzOld
+            p = [ zi + beta * pi for (zi, pi) in izip(z, p) ]
+            iterations += 1
+        return (x, iterations, True)
+
+########################################################################
+# SparseMatrix tests
+class SparseMatrixTest(unittest.TestCase):
+
+    """Unit tests for SparseMatrix."""
+
+    def setUp(self):
+        'Set up a test matrix.'
+        self.mDense = Matrix([4, 0, 0, -1], [0, 0, 0, 0], [2, 0, 3, 0])
+        self.mSparse = SparseMatrix.fromCoo(
+            3, 4, [ 2, 0, 0, 2, 2 ], [ 0, 3, 0, 2, 0 ], [ 1, -1, 4, 3, 1 ])
+
+    def testStorage(self):
+        'Test construction and CSR layout.'
+        m = self.mSparse
+        assert m.size() == (3, 4)
+        assert m.nnz() == 4
+        assert list(m.mIndptr) == [ 0, 2, 2, 4 ]
+        assert list(m.mIndices) == [ 0, 3, 0, 2 ]
+        assert list(m.mData) == [ 4, -1, 2, 3 ]
+        assert m.toDense() == self.mDense
+        assert SparseMatrix.fromDense(self.mDense).toDense() == self.mDense
+        assert m.element(2, 0) == 2 and m.element(1, 1) == 0
+        assert list(m.diagonal()) == [ 4, 0, 3 ]
+        assert m.transpose().toDense() == self.mDense.transpose()
+        assert SparseMatrix.identity(3).toDense() == Matrix.identity(3)
+        assert SparseMatrix(2, 2).toDense() == Matrix(rows=2, cols=2)
+
+        for call in (lambda: m.element(3, 0),
+                     lambda: SparseMatrix.fromCoo(2, 2, [ 0 ], [ 2 ], [ 1 ]),
+                     lambda: SparseMatrix.fromCoo(2, 2, [ 0 ], [ 0 ], [])):
+            hitError = False
+            try:
+                call()
+            except IndexError:
+                hitError = True
+            assert hitError
+
+    def testMultiply(self):
+        'Test the products against the dense Matrix.'
+        m = self.mSparse
+        v = Vector(1, -2, 0.5, 3)
+        assert m.multv(v) == self.mDense.multv(v)
+        w = Vector(2, 7, -1)
+        assert m.transposeMultv(w) == self.mDense.transpose().multv(w)
+        assert m.transposeMultv(w) == m.transpose().multv(w)
+
+        for call in (lambda: m.multv(w), lambda: m.transposeMultv(v)):
+            hitError = False
+            try:
+                call()
+            except TypeError:
+                hitError = True
+            assert hitError
+
+    def testLaplacian(self):
+        'Test the Laplacian of a TriangleGroup.'
+        from TriangleGroup import TriangleGroup
+        g = TriangleGroup.icosahedron()
+        L = SparseMatrix.laplacian(g)
+        n = g.nVertices()
+        assert L.size() == (n, n)
+        assert L.nnz() == n + 2 * g.nEdges()
+        assert list(L.diagonal()) == [ 5.0 ] * n
+        assert L.multv(Vector.ones(n)) == Vector.zeros(n)
+        for (i, j) in g.mEdges:
+            assert L.element(i, j) == L.element(j, i) == -1
+        assert L.transpose().toDense() == L.toDense()
+
+        g2 = TriangleGroup(compact=True)
+        for triangle in g.mTriangles:
+            g2.addTriangle(*[ g.mVertices[i] for i in triangle ])
+        assert SparseMatrix.laplacian(g2, 0.5).toDense() == \
+            SparseMatrix.laplacian(g, 0.5).toDense()
+
+    def testConjugateGradient(self):
+        'Test the conjugate gradient solver.'
+        from TriangleGroup import TriangleGroup
+        g = TriangleGroup.icosahedron()
+        g.sphericalBarycentricSubdivide()
+        L = SparseMatrix.laplacian(g, 0.1)
+        n = g.nVertices()
+        b = Vector(*[ math.sin(i) for i in range(n) ])
+        (x, iterations) = L.conjugateGradient(b, tolerance=1e-12)
+        assert 0 < iterations <= n
+        assert (L.multv(x) - b).norm() < 1e-10 * b.norm()
+
+        (x2, iterations) = L.conjugateGradient(b, x0=x, tolerance=1e-6)
+        assert iterations == 0 and x2 == x
+
+        dense = L.toDense()
+        lu = dense.clone()
+        (index, d) = lu.ludecomp()
+        xd = lu.lubacksub(index, b.clone())
+        assert (x - xd).norm() < 1e-8
+
+        hitError = False
+        try:
+            L.conjugateGradient(b, maxIterations=2)
+        except ValueError:
+            hitError = True
+        assert hitError
+
+        hitError = False
+        try:
+            self.mSparse.conjugateGradient(Vector(1, 2, 3))
+        except TypeError:
+            hitError = True
+        assert hitError
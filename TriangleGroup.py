@@ -13,9 +13,121 @@ A simple representation of a set of triangles.
 """
 
 import math
+import os
+import shutil
+import struct
+import tempfile
 import unittest
+from array import array
+from cStringIO import StringIO
 from Vector import Vector
 
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+# Binary STL layout: an 80 byte header, a little-endian uint32 facet count,
+# then one 50 byte record per facet: normal, three vertices (12 float32s)
+# and a uint16 attribute byte count.
+STL_HEADER_SIZE = 80
+STL_COUNT = struct.Struct('<I')
+STL_RECORD = struct.Struct('<12fH')
+STL_CHUNK = 1024 # facets packed or unpacked per struct call
+
+# ASCII STL is read in blocks of this many bytes.
+STL_BLOCK_SIZE = 1 << 20
+
+########################################################################
+class _PackedVectorList:
+
+    """A list-like sequence of 3-vectors, stored as interleaved x, y, z
+    values in a flat array('d'). Items are returned as new Vectors, so
+    modifying a returned Vector does not modify the list."""
+
+    def __init__(self, data=None):
+        if data is None:
+            data = array('d')
+        self.mData = data
+
+    def __len__(self):
+        return len(self.mData) // 3
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            (start, stop, step) = i.indices(len(self))
+            if step != 1:
+                raise ValueError('Only contiguous slices are supported.')
+            return _PackedVectorList(self.mData[3*start:3*stop])
+        if i < 0:
+            i += len(self)
+        if i < 0 or 3 * i >= len(self.mData):
+            raise IndexError('Index out of bounds : %s' % i)
+        d = self.mData
+        return Vector(d[3*i], d[3*i+1], d[3*i+2])
+
+    def __setitem__(self, i, vertex):
+        if i < 0:
+            i += len(self)
+        if i < 0 or 3 * i >= len(self.mData):
+            raise IndexError('Index out of bounds : %s' % i)
+        (self.mData[3*i], self.mData[3*i+1], self.mData[3*i+2]) = vertex[:]
+
+    def __iter__(self):
+        d = self.mData
+        for i in xrange(0, len(d), 3):
+            yield Vector(d[i], d[i+1], d[i+2])
+
+    def append(self, vertex):
+        """Append a 3-vector, given as a Vector or any sequence."""
+        coords = vertex[:]
+        if len(coords) != 3:
+            raise IndexError('Only 3-vectors can be stored.')
+        self.mData.extend(coords)
+
+########################################################################
+class _PackedTupleList:
+
+    """A list-like sequence of fixed-width tuples of vertex indices, stored
+    in a flat array('i')."""
+
+    def __init__(self, width, data=None):
+        if data is None:
+            data = array('i')
+        self.mWidth = width
+        self.mData = data
+
+    def __len__(self):
+        return len(self.mData) // self.mWidth
+
+    def __getitem__(self, i):
+        w = self.mWidth
+        if isinstance(i, slice):
+            (start, stop, step) = i.indices(len(self))
+            if step != 1:
+                raise ValueError('Only contiguous slices are supported.')
+            return _PackedTupleList(w, self.mData[w*start:w*stop])
+        if i < 0:
+            i += len(self)
+        if i < 0 or w * i >= len(self.mData):
+            raise IndexError('Index out of bounds : %s' % i)
+        return tuple(self.mData[w*i:w*i+w])
+
+    def __iter__(self):
+        d = self.mData
+        w = self.mWidth
+        for i in xrange(0, len(d), w):
+            yield tuple(d[i:i+w])
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def append(self, item):
+        """Append a tuple of vertex indices."""
+        if len(item) != self.mWidth:
+            raise IndexError('Expected %s indices.' % self.mWidth)
+        self.mData.extend(item)
+
 ########################################################################
 class TriangleGroup:
 
@@ -25,59 +137,166 @@ class TriangleGroup:
     # TODO: Add write to STL
     # TODO: Pyglet display
 
-    def __init__(self):
-        # It would be nice to make this a set but I need indices from this.
-        self.mVertices = [ ] # list of Vectors
-        self.mEdges = [ ] # list of (i,j) tuples of vertex indices
-        self.mTriangles = [ ]
+    def __init__(self, tolerance=None, compact=False):
+        """Initialize an empty triangle group.
+
+        tolerance controls how vertices are merged. If it is None (the
+        default) two vertices are the same only if their coordinates are
+        exactly equal. Otherwise coordinates are snapped to a grid with
+        spacing tolerance, and vertices falling in the same grid cell are
+        merged into the first one added.
+
+        If compact is True, vertices are stored as 3 doubles each in a
+        flat array('d') (24 bytes per vertex) and edges and triangles as
+        ints in array('i'), instead of as lists of Vectors and tuples.
+        mVertices, mEdges and mTriangles still behave like lists, but
+        vertices are handed out as new Vector objects on each access."""
+        if tolerance is not None and tolerance <= 0.0:
+            raise ValueError('tolerance must be positive.')
+        self.mTolerance = tolerance
+        self.mCompact = compact
+        self._clear()
+
+    def _clear(self):
+        """Remove all vertices, edges and triangles."""
+        if self.mCompact:
+            self.mVertices = _PackedVectorList()
+            self.mEdges = _PackedTupleList(2)
+            self.mTriangles = _PackedTupleList(3)
+        else:
+            self.mVertices = [ ] # list of Vectors
+            self.mEdges = [ ] # list of (i,j) tuples of vertex indices
+            self.mTriangles = [ ] # list of (i,j,k) tuples of vertex indices
+        self.mVertexIndex = { } # vertex key -> index into mVertices
+        self.mEdgeIndex = { } # sorted (i,j) -> index into mEdges
+        self.mTriangleIndex = { } # canonical (i,j,k) -> index into mTriangles
+
+    def releaseIndex(self):
+        """Free the hash indices used to merge duplicate vertices, edges
+        and triangles. For a compact group these take far more memory
+        than the mesh itself. They are rebuilt automatically if anything
+        is added to the group later."""
+        self.mVertexIndex = None
+        self.mEdgeIndex = None
+        self.mTriangleIndex = None
+
+    def _buildIndex(self):
+        """Rebuild the hash indices from the stored mesh."""
+        self.mVertexIndex = { }
+        for i, vertex in enumerate(self.mVertices):
+            self.mVertexIndex.setdefault(self._vertexKey(vertex), i)
+        self.mEdgeIndex = { }
+        for i, (i1, i2) in enumerate(self.mEdges):
+            self.mEdgeIndex.setdefault((min(i1, i2), max(i1, i2)), i)
+        self.mTriangleIndex = { }
+        for i, triangle in enumerate(self.mTriangles):
+            self.mTriangleIndex.setdefault(
+                TriangleGroup._triangleKey(triangle), i)
+
+    def _vertexKey(self, vertex):
+        """Return the hashable key under which a vertex is stored in the
+        vertex index."""
+        if self.mTolerance is None:
+            return tuple(vertex[:])
+        scale = 1.0 / self.mTolerance
+        return tuple([ int(round(x * scale)) for x in vertex[:] ])
 
     def _addVertex(self, vertex):
         """Add a vertex to the list of vertices. If the vertex has 
         already been added it will be ignored. Return the index
-        of the vertex in the list."""
-        for i in range(len(self.mVertices)):
-            if self.mVertices[i] == vertex:
-                return i
+        of the vertex in the list.
+
+        The lookup goes through a hash index, so this is amortized O(1).
+        Vertices are keyed by their coordinates at the time they are
+        added; modifying a vertex in place afterwards is not tracked."""
+        if self.mVertexIndex is None:
+            self._buildIndex()
+        key = self._vertexKey(vertex)
+        i = self.mVertexIndex.get(key)
+        if i is not None:
+            return i
         i = len(self.mVertices)
         self.mVertices.append(vertex)
+        self.mVertexIndex[key] = i
+        return i
+
+    def _addCoords(self, coords):
+        """Add a vertex given as a tuple of coordinates and return its
+        index. A Vector is only created if the vertex is new, and not at
+        all for a compact group."""
+        if self.mVertexIndex is None:
+            self._buildIndex()
+        if self.mTolerance is None:
+            key = coords
+        else:
+            key = self._vertexKey(coords)
+        i = self.mVertexIndex.get(key)
+        if i is not None:
+            return i
+        i = len(self.mVertices)
+        if self.mCompact:
+            self.mVertices.append(coords)
+        else:
+            self.mVertices.append(Vector(*coords))
+        self.mVertexIndex[key] = i
         return i
 
     def _addEdge(self, edge):
         """Add an edge to the list of edges. An edge is represented as
         a 2-tuple specifying two vertices. (A,B) and (B,A) are considered
-        to be equivalent."""
+        to be equivalent. Return the index of the edge in the list."""
         (i1, i2) = edge
         if i1 == i2:
             raise ValueError('An edge must refer to two different vertices!')
-        for i in range(len(self.mEdges)):
-            (j1, j2) = self.mEdges[i]
-            if i1 == j1 and i2 == j2:
-                return i
-            elif i1 == j2 and i2 == j1:
-                return i
+        if self.mEdgeIndex is None:
+            self._buildIndex()
+        if i1 < i2:
+            key = (i1, i2)
+        else:
+            key = (i2, i1)
+        i = self.mEdgeIndex.get(key)
+        if i is not None:
+            return i
         i = len(self.mEdges)
         self.mEdges.append(edge)
+        self.mEdgeIndex[key] = i
+        return i
+
+    @staticmethod
+    def _triangleKey(triangle):
+        """Return the canonical form of a triangle: the rotation of the
+        vertex triple which starts with the lowest vertex index. All three
+        rotations of a triangle share a key, while the reversed triangle
+        (the same face with the opposite normal) does not."""
+        (a, b, c) = triangle
+        if a < b and a < c:
+            return (a, b, c)
+        elif b < c:
+            return (b, c, a)
+        else:
+            return (c, a, b)
 
     def _addTriangle(self, triangle):
         """Add a triangle to the list of triangles. A triangle is represented
         as a 3-tuple specifying three vertices, in counteclockwise order
         as viewed from the direction pointed to by the triangle's surface
         normal. Therefore (A,B,C) is not considered to be equivalent to
-        (A,C,B), even though they contain the same vertices."""
+        (A,C,B), even though they contain the same vertices. Return the
+        index of the triangle in the list."""
         (a1, b1, c1) = triangle
         if a1 == b1 or a1 == c1 or b1 == c1:
             raise ValueError(
                 'A triangle must refer to three different vertices!')
-        for i in range(len(self.mTriangles)):
-            (a2, b2, c2) = self.mTriangles[i]
-            if a1 == a2 and b1 == b2 and c1 == c2:
-                return i
-            elif a1 == b2 and b1 == c2 and c1 == a2:
-                return i
-            elif a1 == c2 and b1 == a2 and c1 == b2:
-                return i
+        if self.mTriangleIndex is None:
+            self._buildIndex()
+        key = TriangleGroup._triangleKey(triangle)
+        i = self.mTriangleIndex.get(key)
+        if i is not None:
+            return i
         i = len(self.mTriangles)
         self.mTriangles.append(triangle)
+        self.mTriangleIndex[key] = i
+        return i
 
     def addTriangle(self, vertex1, vertex2, vertex3):
         """Add a triangle to the group. The vertices should be specified in
@@ -86,7 +305,11 @@ class TriangleGroup:
         index1 = self._addVertex(vertex1)
         index2 = self._addVertex(vertex2)
         index3 = self._addVertex(vertex3)
+        self._addIndexedTriangle(index1, index2, index3)
 
+    def _addIndexedTriangle(self, index1, index2, index3):
+        """Add a triangle, and its edges, given the indices of three
+        vertices which have already been added."""
         self._addEdge((index1, index2))
         self._addEdge((index2, index3))
         self._addEdge((index3, index1))
@@ -114,20 +337,31 @@ class TriangleGroup:
         """Make a copy of this object.
         :rtype : new object, a clone of this one.
         """
-        rv = TriangleGroup()
+        rv = TriangleGroup(self.mTolerance, self.mCompact)
         rv.mEdges = self.mEdges[:]
         rv.mVertices = self.mVertices[:]
         rv.mTriangles = self.mTriangles[:]
+        if self.mVertexIndex is None:
+            rv.releaseIndex()
+        else:
+            rv.mEdgeIndex = self.mEdgeIndex.copy()
+            rv.mVertexIndex = self.mVertexIndex.copy()
+            rv.mTriangleIndex = self.mTriangleIndex.copy()
         return rv
 
     @staticmethod
-    def _findTriangleCentroid(A, B, C):
+    def _findTriangleCentroid(A, B, C, out=None):
         """Given 3 vertices, which are assumed to be the vertices of a
         triangle, compute and return the location of the triangle's
-        barycenter.
+        barycenter. If out is given, the barycenter is written into it.
         """
-
-        centroid = (A + B + C).mults(0.333333333333)
+        if out is None:
+            out = Vector.zeros(3)
+        centroid = out
+        centroid.mV[:] = A.mV
+        centroid += B
+        centroid += C
+        centroid.scale(0.333333333333)
 
         return centroid
 
@@ -148,24 +382,45 @@ class TriangleGroup:
 
         vertices = self.mVertices[:]
         triangles = self.mTriangles[:]
-        self.mEdges = [ ] # remove the existing edges.
-        self.mTriangles = [ ] # remove the existing triangles
-        self.mVertices = [ ] # remove the existing vertices
-        
+        self._clear() # remove the existing vertices, edges and triangles
+
+        # New vertices are computed in these scratch vectors and only
+        # copied into the mesh if they have not been seen before.
+        D = Vector.zeros(3)
+        E = Vector.zeros(3)
+        F = Vector.zeros(3)
+        G = Vector.zeros(3)
+        addCoords = self._addCoords
+        addTriangle = self._addIndexedTriangle
+
         for triangle in triangles:
             (A, B, C) = [vertices[idx] for idx in triangle]
 
-            D = (A + B).normalize()
-            E = (B + C).normalize()
-            F = (C + A).normalize()
-            G = TriangleGroup._findTriangleCentroid(A, B, C).normalize()
-
-            self.addTriangle(A, D, G)
-            self.addTriangle(D, B, G)
-            self.addTriangle(B, E, G)
-            self.addTriangle(E, C, G)
-            self.addTriangle(C, F, G)
-            self.addTriangle(A, G, F)
+            D.mV[:] = A.mV
+            D += B
+            D.normalize()
+            E.mV[:] = B.mV
+            E += C
+            E.normalize()
+            F.mV[:] = C.mV
+            F += A
+            F.normalize()
+            TriangleGroup._findTriangleCentroid(A, B, C, G).normalize()
+
+            iA = addCoords(tuple(A.mV))
+            iD = addCoords(tuple(D.mV))
+            iG = addCoords(tuple(G.mV))
+            iB = addCoords(tuple(B.mV))
+            iE = addCoords(tuple(E.mV))
+            iC = addCoords(tuple(C.mV))
+            iF = addCoords(tuple(F.mV))
+
+            addTriangle(iA, iD, iG)
+            addTriangle(iD, iB, iG)
+            addTriangle(iB, iE, iG)
+            addTriangle(iE, iC, iG)
+            addTriangle(iC, iF, iG)
+            addTriangle(iA, iG, iF)
 
         return self
 
@@ -177,15 +432,26 @@ class TriangleGroup:
         the polygon mesh approximates a sphere."""
         maxDifference = 0.0
 
+        # Scratch vectors, reused for every triangle.
+        AC = Vector.zeros(3)
+        BA = Vector.zeros(3)
+        BC = Vector.zeros(3)
+
         for triangle in self.mTriangles:
             (A, B, C) = [self.mVertices[idx] for idx in triangle]
             
             # Determine the diameter of the circumcircle, the circle
             # which includes triangle ABC (points A, B, and C are all
             # on the circle):
-            LAC = (A - C).norm() # length of A-C
-            BA = (A - B).normalize()
-            BC = (C - B).normalize()
+            AC.mV[:] = A.mV
+            AC -= C
+            LAC = AC.norm() # length of A-C
+            BA.mV[:] = A.mV
+            BA -= B
+            BA.normalize()
+            BC.mV[:] = C.mV
+            BC -= B
+            BC.normalize()
             ABC = math.acos(BA.dot(BC)) # Angle opposite
             diameter = LAC / math.sin(ABC)
 
@@ -199,33 +465,236 @@ class TriangleGroup:
 
         return maxDifference
 
-    def toStl(self, name=None):
-        """Write the triangle group out to STL."""
+    def _stlFacet(self, triangle):
+        """Return the STL text for a single facet."""
+        (A, B, C) = [self.mVertices[i] for i in triangle]
+        # Compute the surface normal
+        surfaceNormal = (B - A).cross(C - A).normalize()
+        return ('facet normal {0:.6e} {1:.6e} {2:.6e}\nouter loop\n'
+                '{3}\n{4}\n{5}\nendloop\nendfacet\n').format(
+            surfaceNormal[0], surfaceNormal[1], surfaceNormal[2],
+            A.toStl(), B.toStl(), C.toStl())
+
+    def iterStl(self, name=None, chunkSize=256):
+        """Generate the STL representation of the triangle group as a
+        sequence of strings, each holding at most chunkSize facets.
+        Concatenating the chunks gives the same text as toStl(), but only
+        one chunk needs to be held in memory at a time."""
         if name is None:
             name = 'TriangleGroup'
-        out = 'solid %s\n' % name
+        yield 'solid %s\n' % name
+        chunk = [ ]
         for triangle in self.mTriangles:
-            # Compute the surface normal
-            (A, B, C) = [self.mVertices[i] for i in triangle]
-            AB = B - A
-            AC = C - A
-            surfaceNormal = AB.cross(AC).normalize()
-            out += 'facet normal {0:.6e} {1:.6e} {2:.6e}\n'.format(
-                surfaceNormal[0], surfaceNormal[1], surfaceNormal[2])
-            out += 'outer loop\n'
-            out += A.toStl() + '\n'
-            out += B.toStl() + '\n'
-            out += C.toStl() + '\n'
-            out += 'endloop\nendfacet\n'
-        out += 'endsolid %s' % name
-        return out
+            chunk.append(self._stlFacet(triangle))
+            if len(chunk) >= chunkSize:
+                yield ''.join(chunk)
+                chunk = [ ]
+        if chunk:
+            yield ''.join(chunk)
+        yield 'endsolid %s' % name
+
+    def toStl(self, name=None):
+        """Write the triangle group out to STL."""
+        return ''.join(self.iterStl(name))
+
+    def writeStl(self, fileobj, name=None):
+        """Stream the STL representation of the TriangleGroup to an open
+        file object, one chunk of facets at a time."""
+        fileobj.writelines(self.iterStl(name))
 
     def writeStlToFile(self, filename, name=None):
         """Write the STL representation of the TriangleGroup to
         a file."""
-        f = file(filename, 'w')
-        f.write(self.toStl())
-        f.close()
+        f = open(filename, 'w')
+        try:
+            self.writeStl(f, name)
+        finally:
+            f.close()
+
+    @staticmethod
+    def iterStlFacets(fileobj, blockSize=STL_BLOCK_SIZE):
+        """Lazily parse an ASCII STL stream from an open file object,
+        generating one (normal, vertex1, vertex2, vertex3) tuple of
+        coordinate tuples per facet.
+
+        The stream is read blockSize bytes at a time and each block is
+        tokenized with a single split(), so only one block is held in
+        memory regardless of the size of the file. Every facet occupies
+        exactly 21 tokens:
+
+        facet normal nx ny nz outer loop
+        vertex x y z  vertex x y z  vertex x y z
+        endloop endfacet
+
+        Tokens outside of facets (solid and endsolid lines, and the solid
+        name) are skipped.
+        """
+        pending = [ ]
+        carry = ''
+        while True:
+            block = fileobj.read(blockSize)
+            if block:
+                tokens = (carry + block).split()
+                # A token cut off by the end of the block is completed
+                # by the next block.
+                if tokens and not block[-1].isspace():
+                    carry = tokens.pop()
+                else:
+                    carry = ''
+            else:
+                tokens = carry.split()
+                carry = ''
+            if pending:
+                tokens = pending + tokens
+
+            i = 0
+            n = len(tokens)
+            while i < n:
+                if tokens[i] != 'facet':
+                    i += 1
+                    continue
+                if i + 21 > n:
+                    break
+                t = tokens
+                if (t[i+1] != 'normal' or t[i+5] != 'outer' or
+                    t[i+6] != 'loop' or t[i+7] != 'vertex' or
+                    t[i+11] != 'vertex' or t[i+15] != 'vertex' or
+                    t[i+19] != 'endloop' or t[i+20] != 'endfacet'):
+                    raise ValueError('Malformed STL facet: %s' %
+                                     ' '.join(t[i:i+21]))
+                yield ((float(t[i+2]), float(t[i+3]), float(t[i+4])),
+                       (float(t[i+8]), float(t[i+9]), float(t[i+10])),
+                       (float(t[i+12]), float(t[i+13]), float(t[i+14])),
+                       (float(t[i+16]), float(t[i+17]), float(t[i+18])))
+                i += 21
+            pending = tokens[i:]
+
+            if not block:
+                break
+
+        if pending:
+            raise ValueError('Truncated STL facet.')
+
+    @staticmethod
+    def readStl(fileobj, tolerance=None, blockSize=STL_BLOCK_SIZE,
+                compact=False):
+        """Read an ASCII STL stream from an open file object and return a
+        new TriangleGroup. Facet normals in the file are ignored; they are
+        recomputed from the vertices when the group is written. Facets
+        which collapse to fewer than three distinct vertices are
+        skipped."""
+        g = TriangleGroup(tolerance, compact)
+        addCoords = g._addCoords
+        for (_, A, B, C) in TriangleGroup.iterStlFacets(fileobj, blockSize):
+            i1 = addCoords(A)
+            i2 = addCoords(B)
+            i3 = addCoords(C)
+            if i1 != i2 and i2 != i3 and i3 != i1:
+                g._addIndexedTriangle(i1, i2, i3)
+        return g
+
+    @staticmethod
+    def fromStl(filename, tolerance=None, compact=False):
+        """Read an ASCII STL file and return a new TriangleGroup."""
+        f = open(filename, 'r')
+        try:
+            return TriangleGroup.readStl(f, tolerance, compact=compact)
+        finally:
+            f.close()
+
+    def _facetNormals(self, coords):
+        """Compute the unit surface normal of every triangle in one pass,
+        given the vertex coordinates as a list of tuples. Degenerate
+        triangles get a zero normal."""
+        normals = [ ]
+        for (i, j, k) in self.mTriangles:
+            (ax, ay, az) = coords[i]
+            (bx, by, bz) = coords[j]
+            (cx, cy, cz) = coords[k]
+            (ux, uy, uz) = (bx - ax, by - ay, bz - az)
+            (vx, vy, vz) = (cx - ax, cy - ay, cz - az)
+            nx = uy * vz - uz * vy
+            ny = uz * vx - ux * vz
+            nz = ux * vy - uy * vx
+            n = math.sqrt(nx * nx + ny * ny + nz * nz)
+            if n > 0.0:
+                n = 1.0 / n
+            normals.append((nx * n, ny * n, nz * n))
+        return normals
+
+    def writeBinaryStl(self, fileobj, name=None):
+        """Write the triangle group to an open file object in binary STL
+        format. Facets are packed STL_CHUNK at a time."""
+        if name is None:
+            name = 'TriangleGroup'
+        coords = [ tuple(v[:]) for v in self.mVertices ]
+        normals = self._facetNormals(coords)
+        triangles = self.mTriangles
+        nFaces = len(triangles)
+
+        fileobj.write(name[:STL_HEADER_SIZE].ljust(STL_HEADER_SIZE, ' '))
+        fileobj.write(STL_COUNT.pack(nFaces))
+        packer = struct.Struct('<' + '12fH' * STL_CHUNK)
+        for start in range(0, nFaces, STL_CHUNK):
+            stop = min(start + STL_CHUNK, nFaces)
+            if stop - start < STL_CHUNK:
+                packer = struct.Struct('<' + '12fH' * (stop - start))
+            values = [ ]
+            for f in range(start, stop):
+                (i, j, k) = triangles[f]
+                values.extend(normals[f])
+                values.extend(coords[i])
+                values.extend(coords[j])
+                values.extend(coords[k])
+                values.append(0)
+            fileobj.write(packer.pack(*values))
+
+    def writeBinaryStlToFile(self, filename, name=None):
+        """Write the triangle group to a file in binary STL format."""
+        f = open(filename, 'wb')
+        try:
+            self.writeBinaryStl(f, name)
+        finally:
+            f.close()
+
+    @staticmethod
+    def readBinaryStl(fileobj, tolerance=None, compact=False):
+        """Read a binary STL stream from an open file object and return a
+        new TriangleGroup. Records are unpacked STL_CHUNK at a time and
+        their coordinates go straight into the vertex index, so a Vector
+        is only created for each distinct vertex. Facets which collapse to
+        fewer than three distinct vertices are skipped."""
+        g = TriangleGroup(tolerance, compact)
+        fileobj.read(STL_HEADER_SIZE)
+        data = fileobj.read(STL_COUNT.size)
+        if len(data) != STL_COUNT.size:
+            raise ValueError('Truncated binary STL header.')
+        (nFaces,) = STL_COUNT.unpack(data)
+        addCoords = g._addCoords
+        remaining = nFaces
+        while remaining > 0:
+            n = min(remaining, STL_CHUNK)
+            data = fileobj.read(n * STL_RECORD.size)
+            if len(data) != n * STL_RECORD.size:
+                raise ValueError('Truncated binary STL file.')
+            values = struct.unpack('<' + '12fH' * n, data)
+            for r in range(0, 13 * n, 13):
+                i1 = addCoords(values[r+3:r+6])
+                i2 = addCoords(values[r+6:r+9])
+                i3 = addCoords(values[r+9:r+12])
+                if i1 != i2 and i2 != i3 and i3 != i1:
+                    g._addIndexedTriangle(i1, i2, i3)
+            remaining -= n
+        return g
+
+    @staticmethod
+    def fromBinaryStl(filename, tolerance=None, compact=False):
+        """Read a binary STL file and return a new TriangleGroup."""
+        f = open(filename, 'rb')
+        try:
+            return TriangleGroup.readBinaryStl(f, tolerance, compact)
+        finally:
+            f.close()
 
     @staticmethod
     def tetrahedron():
@@ -423,6 +892,273 @@ class TriangleGroupTest(unittest.TestCase):
         t = TriangleGroup.tetrahedron()
         t.sphericalBarycentricSubdivide()
 
+    def testVertexIndex(self):
+        """Test that duplicate vertices are merged via the vertex index."""
+        g = TriangleGroup()
+        assert g._addVertex(Vector(1, 2, 3)) == 0
+        assert g._addVertex(Vector(4, 5, 6)) == 1
+        assert g._addVertex(Vector(1.0, 2.0, 3.0)) == 0
+        assert g._addVertex(Vector(1, 2, 3.0000001)) == 2
+        assert g.nVertices() == 3
+
+        g = TriangleGroup(tolerance=1e-4)
+        assert g._addVertex(Vector(1, 2, 3)) == 0
+        assert g._addVertex(Vector(1, 2, 3.00000001)) == 0
+        assert g._addVertex(Vector(1, 2, 3.001)) == 1
+        assert g.nVertices() == 2
+
+        hitError = False
+        try:
+            TriangleGroup(tolerance=0.0)
+        except ValueError:
+            hitError = True
+        assert hitError
+
+    def testEdgeAndTriangleIndex(self):
+        """Test that equivalent edges and triangles are merged."""
+        g = TriangleGroup()
+        assert g._addEdge((0, 1)) == 0
+        assert g._addEdge((1, 2)) == 1
+        assert g._addEdge((1, 0)) == 0
+        assert g.nEdges() == 2
+
+        assert g._addTriangle((0, 1, 2)) == 0
+        assert g._addTriangle((1, 2, 0)) == 0
+        assert g._addTriangle((2, 0, 1)) == 0
+        assert g._addTriangle((0, 2, 1)) == 1
+        assert g._addTriangle((2, 1, 0)) == 1
+        assert g.nFaces() == 2
+        assert g.mTriangles[1] == (0, 2, 1)
+
+        hitError = False
+        try:
+            g._addEdge((3, 3))
+        except ValueError:
+            hitError = True
+        assert hitError
+
+        hitError = False
+        try:
+            g._addTriangle((3, 4, 3))
+        except ValueError:
+            hitError = True
+        assert hitError
+
+    def testToStl(self):
+        """Test the ASCII STL writer against a saved model."""
+        g = TriangleGroup.tetrahedron()
+        f = open(os.path.join(MODEL_DIR, 'fig1.stl'))
+        expected = f.read()
+        f.close()
+        assert g.toStl() == expected
+
+        g.sphericalBarycentricSubdivide()
+        chunks = list(g.iterStl('sphere', chunkSize=5))
+        assert len(chunks) == 2 + 5 # header, 24 facets in 5s, trailer
+        assert chunks[0] == 'solid sphere\n'
+        assert chunks[-1] == 'endsolid sphere'
+        assert ''.join(chunks) == g.toStl('sphere')
+
+    def testWriteStlToFile(self):
+        """Test streaming STL output to a file."""
+        g = TriangleGroup.icosahedron()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'ico.stl')
+            g.writeStlToFile(filename, 'ico')
+            f = open(filename)
+            text = f.read()
+            f.close()
+            assert text == g.toStl('ico')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testFromStl(self):
+        """Test reading the saved ASCII STL models."""
+        g = TriangleGroup.fromStl(os.path.join(MODEL_DIR, 'fig1.stl'))
+        t = TriangleGroup.tetrahedron()
+        assert g.nFaces() == 4
+        assert g.nVertices() == 4
+        assert g.nEdges() == 6
+        assert g.mTriangles == t.mTriangles
+        for (v1, v2) in zip(g.mVertices, t.mVertices):
+            assert (v1 - v2).norm() < 1e-6
+        vertexLines = lambda text: [ line for line in text.split('\n')
+                                     if line.startswith('vertex') ]
+        assert vertexLines(g.toStl()) == vertexLines(t.toStl())
+
+        counts = { 'fig2.stl' : 16, 'fig3.stl' : 24, 'fig4.stl' : 144,
+                   'fig5.stl' : 120, 'fig6.stl' : 720 }
+        for (name, nFaces) in counts.items():
+            g = TriangleGroup.fromStl(os.path.join(MODEL_DIR, name))
+            assert g.nFaces() == nFaces, name
+            # These are all closed surfaces.
+            assert g.nVertices() - g.nEdges() + g.nFaces() == 2, name
+
+    def testIterStlFacets(self):
+        """Test lazy facet parsing across block boundaries."""
+        text = TriangleGroup.icosahedron().toStl('ico')
+        expected = list(TriangleGroup.iterStlFacets(StringIO(text)))
+        assert len(expected) == 20
+        for blockSize in (1, 7, 64, 1000):
+            facets = list(TriangleGroup.iterStlFacets(StringIO(text),
+                                                      blockSize))
+            assert facets == expected, blockSize
+        g = TriangleGroup.readStl(StringIO(text), blockSize=13)
+        assert g.toStl('ico') == text
+
+        hitError = False
+        try:
+            list(TriangleGroup.iterStlFacets(StringIO(text[:-40])))
+        except ValueError:
+            hitError = True
+        assert hitError
+
+        for (good, bad) in (('outer loop\nvertex', 'outer loop\nvortex'),
+                            ('outer loop', 'outr loop'),
+                            ('outer loop', 'outer lop'),
+                            ('endloop', 'endlop')):
+            hitError = False
+            try:
+                list(TriangleGroup.iterStlFacets(StringIO(
+                    text.replace(good, bad, 1))))
+            except ValueError:
+                hitError = True
+            assert hitError, bad
+
+    def testBinaryStl(self):
+        """Test binary STL round-tripping."""
+        g = TriangleGroup.icosahedron()
+        buf = StringIO()
+        g.writeBinaryStl(buf, 'ico')
+        data = buf.getvalue()
+        assert len(data) == 84 + 50 * 20
+        assert data[:3] == 'ico'
+        assert STL_COUNT.unpack(data[80:84]) == (20,)
+
+        # The first record holds the facet normal, then the vertices.
+        record = STL_RECORD.unpack(data[84:134])
+        normal = (g.mVertices[1] - g.mVertices[0]).cross(
+            g.mVertices[2] - g.mVertices[0]).normalize()
+        for i in range(3):
+            assert abs(record[i] - normal[i]) < 1e-6
+            assert abs(record[3+i] - g.mVertices[0][i]) < 1e-6
+        assert record[12] == 0
+
+        g2 = TriangleGroup.readBinaryStl(StringIO(data))
+        assert g2.nFaces() == 20
+        assert g2.nVertices() == 12
+        assert g2.nEdges() == 30
+        assert g2.mTriangles == g.mTriangles
+        for (v1, v2) in zip(g.mVertices, g2.mVertices):
+            assert (v1 - v2).norm() < 1e-6
+
+        hitError = False
+        try:
+            TriangleGroup.readBinaryStl(StringIO(data[:-10]))
+        except ValueError:
+            hitError = True
+        assert hitError
+
+    def testBinaryStlFile(self):
+        """Test binary STL file output and input of a larger mesh."""
+        g = TriangleGroup.icosahedron()
+        g.sphericalBarycentricSubdivide()
+        g.sphericalBarycentricSubdivide()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'sphere.stl')
+            g.writeBinaryStlToFile(filename)
+            assert os.path.getsize(filename) == 84 + 50 * g.nFaces()
+            g2 = TriangleGroup.fromBinaryStl(filename)
+        finally:
+            shutil.rmtree(tmpdir)
+        assert g2.nFaces() == g.nFaces()
+        assert g2.nVertices() == g.nVertices()
+        assert g2.nEdges() == g.nEdges()
+
+    def testCompact(self):
+        """Test the compact storage mode."""
+        g = TriangleGroup(compact=True)
+        A = Vector(1, 0, 0)
+        B = Vector(0, 1, 0)
+        C = Vector(0, 0, 1)
+        D = Vector(-1, 0, 0)
+        g.addTriangle(A, B, C)
+        g.addTriangle(C, B, D)
+        g.addTriangle(A, B, C)
+        assert g.nVertices() == 4
+        assert g.nEdges() == 5
+        assert g.nFaces() == 2
+        assert g.mVertices[3] == D
+        assert g.mVertices[-1] == D
+        assert g.mEdges[4] == (3, 2)
+        assert g.mTriangles[1] == (2, 1, 3)
+        assert list(g.mTriangles) == [ (0, 1, 2), (2, 1, 3) ]
+        assert g.edgeLength(0) == math.sqrt(2.0)
+
+        # 24 bytes per vertex, 8 per edge and 12 per triangle.
+        assert g.mVertices.mData.itemsize * len(g.mVertices.mData) == 4 * 24
+        assert g.mEdges.mData.itemsize * len(g.mEdges.mData) == 5 * 8
+        assert g.mTriangles.mData.itemsize * len(g.mTriangles.mData) == 2 * 12
+
+        # Modifying a vertex that was handed out does not change the group.
+        v = g.mVertices[0]
+        v[0] = 5.0
+        assert g.mVertices[0] == A
+
+        g2 = g.clone()
+        g2.addTriangle(D, B, Vector(0, 0, -1))
+        assert g2.nFaces() == 3
+        assert g.nFaces() == 2
+
+    def testCompactMatchesDefault(self):
+        """Test that compact and list storage build the same mesh."""
+        g1 = TriangleGroup.icosahedron()
+        g2 = TriangleGroup(compact=True)
+        for triangle in g1.mTriangles:
+            g2.addTriangle(*[ g1.mVertices[i] for i in triangle ])
+        g1.sphericalBarycentricSubdivide()
+        g2.sphericalBarycentricSubdivide()
+        assert g2.mCompact
+        assert g2.toStl() == g1.toStl()
+        assert g2.mTriangles == g1.mTriangles
+        assert list(g2.mEdges) == g1.mEdges
+        assert g2.maxSphericalDeviation() == g1.maxSphericalDeviation()
+
+        buf = StringIO()
+        g1.writeBinaryStl(buf)
+        g3 = TriangleGroup.readBinaryStl(StringIO(buf.getvalue()),
+                                         compact=True)
+        assert g3.nVertices() == g1.nVertices()
+        assert g3.nFaces() == g1.nFaces()
+
+    def testReleaseIndex(self):
+        """Test that released indices are rebuilt when needed."""
+        ico = TriangleGroup.icosahedron()
+        for compact in (False, True):
+            g = TriangleGroup(compact=compact)
+            for triangle in ico.mTriangles:
+                g.addTriangle(*[ ico.mVertices[i] for i in triangle ])
+            g.releaseIndex()
+            assert g.mVertexIndex is None
+            g2 = g.clone()
+            assert g2.mVertexIndex is None
+            g.addTriangle(*[ ico.mVertices[i] for i in ico.mTriangles[3] ])
+            assert g.nVertices() == 12
+            assert g.nFaces() == 20
+            assert g.mVertexIndex is not None
+
+    def testSubdivisionTopology(self):
+        """Test that subdivision shares vertices between triangles."""
+        g = TriangleGroup.icosahedron()
+        g.sphericalBarycentricSubdivide()
+        assert g.nFaces() == 120
+        assert g.nVertices() == 12 + 30 + 20
+        assert g.nEdges() == 180
+        g2 = g.clone()
+        assert g2._addVertex(g.mVertices[7].clone()) == 7
+
 
 
 
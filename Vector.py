@@ -14,13 +14,22 @@ Vector definition.
 """
 
 import math
+import sys
 import unittest
 
+_new = object.__new__
+
 ########################################################################
-class Vector:
+class Vector(object):
 
     """Vector : a 1-dimensional array of real numbers."""
 
+    # Vectors are created in very large numbers, so they carry no
+    # per-instance __dict__.
+    __slots__ = ('mV',)
+
+    mPrintSpec = '%f' # String formatter for elements
+
     def __init__(self, *args, **kwargs):
         """Initialize a vector with the passed elements.
 
@@ -32,8 +41,12 @@ class Vector:
         items allocated to accomodate any previously specified elements.
 
         """
+        if len(args) == 3 and not kwargs:
+            # Fast path for 3-vectors, by far the most common case.
+            self.mV = [ float(args[0]), float(args[1]), float(args[2]) ]
+            return
+
         self.mV = [] # Elements of the vector
-        self.mPrintSpec = '%f' # String formatter for elements
         for x in args:
             self.mV.append(float(x))
         
@@ -51,6 +64,15 @@ class Vector:
                     self.mV.append(0.0)
                     nToAdd -= 1
 
+    @staticmethod
+    def _fromList(values): # returns Vector
+        """Wrap a list of floats in a Vector without copying or converting
+        it. This is for internal use, where the list is newly built and its
+        elements are already known to be numbers."""
+        v = _new(Vector)
+        v.mV = values
+        return v
+
     @staticmethod
     def fromSequence(seq): # returns Vector
         """Initialize a vector from a single sequence object, e.g. a list
@@ -73,8 +95,7 @@ class Vector:
 
     def clone(self):
         """Return a copy of the Vector."""
-        v = self.mV[:]
-        return Vector.fromSequence(v)
+        return Vector._fromList(self.mV[:])
 
     def toStl(self):
         """Write the triangle out in STL format."""
@@ -112,27 +133,97 @@ class Vector:
         self.mV.__delitem__(key)
 
     def __add__(self, v):
-        if (len(self) != len(v)):
+        a = self.mV
+        n = len(a)
+        if (n != len(v)):
             raise IndexError('Vectors to be added must be the same size.')
-        return Vector.fromSequence([ x[0]+x[1] for x in zip(self, v) ])
+        if n == 3:
+            return Vector._fromList([ a[0] + v[0], a[1] + v[1], a[2] + v[2] ])
+        return Vector._fromList([ x[0]+x[1] for x in zip(a, v) ])
 
     def __sub__(self, v):
-        if (len(self) != len(v)):
+        a = self.mV
+        n = len(a)
+        if (n != len(v)):
+            raise IndexError('Vectors to be added must be the same size.')
+        if n == 3:
+            return Vector._fromList([ a[0] - v[0], a[1] - v[1], a[2] - v[2] ])
+        return Vector._fromList([ x[0]-x[1] for x in zip(a, v) ])
+
+    def __iadd__(self, v):
+        """Add v to this vector in place."""
+        a = self.mV
+        n = len(a)
+        if (n != len(v)):
             raise IndexError('Vectors to be added must be the same size.')
-        return Vector.fromSequence([ x[0]-x[1] for x in zip(self, v) ])
+        if n == 3:
+            (x, y, z) = (v[0], v[1], v[2])
+            a[0] += x
+            a[1] += y
+            a[2] += z
+        else:
+            for i in range(n):
+                a[i] += v[i]
+        return self
+
+    def __isub__(self, v):
+        """Subtract v from this vector in place."""
+        a = self.mV
+        n = len(a)
+        if (n != len(v)):
+            raise IndexError('Vectors to be added must be the same size.')
+        if n == 3:
+            (x, y, z) = (v[0], v[1], v[2])
+            a[0] -= x
+            a[1] -= y
+            a[2] -= z
+        else:
+            for i in range(n):
+                a[i] -= v[i]
+        return self
+
+    def __imul__(self, s):
+        """Scale this vector in place by scalar s."""
+        return self.scale(s)
+
+    def axpy(self, a, x):
+        """Add a * x to this vector in place, where a is a scalar and x is a
+        vector. Returns self."""
+        v = self.mV
+        n = len(v)
+        if (n != len(x)):
+            raise IndexError('Vectors to be added must be the same size.')
+        if n == 3:
+            (x0, x1, x2) = (x[0], x[1], x[2])
+            v[0] += a * x0
+            v[1] += a * x1
+            v[2] += a * x2
+        else:
+            for i in range(n):
+                v[i] += a * x[i]
+        return self
 
     def scale(self, s):
         """Scale a vector in place by a given scalar."""
-        for n in range(len(self.mV)):
-            self.mV[n] *= s
+        v = self.mV
+        for n in range(len(v)):
+            v[n] *= s
         return self
 
-    def mults(self, s):
+    def mults(self, s, out=None):
         """Multiply a vector by a scalar, return the scaled
-        vector. The original vector remains unchanged."""
-        prod = Vector.fromSequence(self.mV)
-        prod.scale(s)
-        return prod
+        vector. The original vector remains unchanged.
+
+        If out is given, the product is written into that vector, which
+        must be the same size, and out is returned."""
+        if out is None:
+            return Vector._fromList([ x * s for x in self.mV ])
+        if (len(out) != len(self.mV)):
+            raise IndexError('out must be the same size as the vector.')
+        o = out.mV
+        for (i, x) in enumerate(self.mV):
+            o[i] = x * s
+        return out
 
     def dot(self, v):
         """Dot Product or Scalar Product or Inner Product"""
@@ -155,7 +246,7 @@ class Vector:
         """Not equals"""
         return not(self.__eq__(v))
 
-    def cross(self, v):
+    def cross(self, v, out=None):
         """Cross Product or Vector Product
         Multiply 2 3x3 vectors to get a 3rd vector which obeys the relation
         R = v1 v2 sin theta
@@ -164,27 +255,46 @@ class Vector:
         | x1  y1  z1 |
         | x2  y2  z2 |
 
+        If out is given, the product is written into that 3-vector (which
+        may be self or v) and out is returned.
         """
         if (len(self.mV) != 3) or (len(v) != 3):
             raise IndexError('Cross product is only for 2 3-vectors.')
 
-        (x1, y1, z1) = (self.mV[0], self.mV[1], self.mV[2])
+        (x1, y1, z1) = self.mV
         (x2, y2, z2) = (v[0], v[1], v[2])
         x = y1 * z2 - y2 * z1
         y = z1 * x2 - z2 * x1
         z = x1 * y2 - x2 * y1
-        return Vector(x, y, z)
+        if out is None:
+            return Vector._fromList([ x, y, z ])
+        if len(out) != 3:
+            raise IndexError('out must be a 3-vector.')
+        o = out.mV
+        o[0] = x
+        o[1] = y
+        o[2] = z
+        return out
 
     def norm(self):
         """Return the Euclidean norm of the vector"""
         return math.sqrt(sum([x*x for x in self.mV]))
 
-    def normalize(self):
+    def normalize(self, out=None):
         """Turn the vector into a unit vector pointing in the same direction.
-        Do the operation in place."""
+        Do the operation in place.
+
+        If out is given, the unit vector is written into that vector
+        instead, leaving this one unchanged, and out is returned."""
         n = 1.0 / self.norm()
-        self.mV = [ x * n for x in self.mV ]
-        return self
+        if out is None:
+            out = self
+        elif (len(out) != len(self.mV)):
+            raise IndexError('out must be the same size as the vector.')
+        o = out.mV
+        for (i, x) in enumerate(self.mV):
+            o[i] = x * n
+        return out
 
     def round(self, places):
         'Round the vector elements to a given number of decimal places.'
@@ -443,6 +553,121 @@ class VectorTest(unittest.TestCase):
         assert n == 2
         assert v1.normalize() == [ 0.5, 0.5, 0.5, 0.5 ]
         
+    def testSlots(self):
+        """Test that vectors carry no per-instance attributes."""
+        v = Vector(1, 2, 3)
+        assert not hasattr(v, '__dict__')
+        hitError = False
+        try:
+            v.mFoo = 1
+        except AttributeError:
+            hitError = True
+        assert hitError
+        assert v.mPrintSpec == '%f'
+        assert sys.getsizeof(v) < 64
+
+    def testFastConstructors(self):
+        """Test the 3-vector construction paths."""
+        v = Vector('1', 2, 3.5)
+        assert v.mV == [ 1.0, 2.0, 3.5 ]
+        assert all([ type(x) is float for x in v.mV ])
+
+        hitError = False
+        try:
+            Vector(1, 2, 'x')
+        except ValueError:
+            hitError = True
+        assert hitError
+
+        values = [ 1.0, 2.0, 3.0 ]
+        v = Vector._fromList(values)
+        assert v.mV is values
+        assert type(v) is Vector
+
+        # Results of arithmetic never share storage with the operands.
+        a = Vector(1, 2, 3)
+        b = Vector(4, 5, 6)
+        for c in (a + b, a - b, a.cross(b), a.mults(1), a.clone()):
+            assert c.mV is not a.mV and c.mV is not b.mV
+        assert Vector(1, 2, 3, 4) + [ 1, 1, 1, 1 ] == [ 2, 3, 4, 5 ]
+        assert Vector(1, 2, 3, 4) - [ 1, 1, 1, 1 ] == [ 0, 1, 2, 3 ]
+
+    def testInPlaceOperators(self):
+        """Test the in-place arithmetic operators."""
+        v1 = Vector(1, 2, 3)
+        storage = v1.mV
+        v1 += [ 1, 1, 1 ]
+        v1 -= Vector(0, 2, 0)
+        assert v1 == [ 2, 1, 4 ]
+        v1 *= 2
+        assert v1 == [ 4, 2, 8 ]
+        assert v1.mV is storage
+
+        v2 = Vector(1, 2, 3, 4)
+        v2 += v2
+        assert v2 == [ 2, 4, 6, 8 ]
+        v2 -= [ 1, 1, 1, 1 ]
+        assert v2 == [ 1, 3, 5, 7 ]
+
+        hitException = False
+        try:
+            v1 += v2
+        except IndexError:
+            hitException = True
+        assert hitException
+
+        hitException = False
+        try:
+            v1 -= v2
+        except IndexError:
+            hitException = True
+        assert hitException
+
+    def testAxpy(self):
+        """Test the fused multiply-add."""
+        v1 = Vector(1, 2, 3)
+        assert v1.axpy(2, Vector(1, 0, -1)) is v1
+        assert v1 == [ 3, 2, 1 ]
+        v2 = Vector(1, 1, 1, 1)
+        v2.axpy(-0.5, [ 2, 4, 6, 8 ])
+        assert v2 == [ 0, -1, -2, -3 ]
+
+        hitException = False
+        try:
+            v1.axpy(1, v2)
+        except IndexError:
+            hitException = True
+        assert hitException
+
+    def testOutParameters(self):
+        """Test writing results into an existing vector."""
+        a = Vector(1, 0, 0)
+        b = Vector(0, 1, 0)
+        out = Vector.zeros(3)
+        assert a.cross(b, out) is out
+        assert out == [ 0, 0, 1 ]
+        a.cross(b, a)
+        assert a == [ 0, 0, 1 ]
+        assert b.cross(a, out=b) == [ 1, 0, 0 ]
+
+        v = Vector(3, 0, 4)
+        assert v.mults(2, out) is out
+        assert out == [ 6, 0, 8 ]
+        assert v == [ 3, 0, 4 ]
+        assert v.normalize(out) is out
+        assert out.round(12) == [ 0.6, 0, 0.8 ]
+        assert v == [ 3, 0, 4 ]
+
+        for call in (lambda: v.mults(2, Vector.zeros(2)),
+                     lambda: v.normalize(Vector.zeros(4)),
+                     lambda: v.cross(b, Vector.zeros(2))):
+            hitException = False
+            try:
+                call()
+            except IndexError:
+                hitException = True
+            assert hitException
+
     def testClone(self):
         'Test the clone function.'
         v1 = Vector(1, 2, 3, 4, 5, 6, 7)
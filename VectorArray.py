@@ -0,0 +1,334 @@
+#!/usr/bin/python
+
+# Disable some pylint messages
+# pylint: disable=C0103,R0201,R0904,W0511
+# C0103 : Invalid name "%s" (should match %s)
+# R0201 : Method could be a function
+# R0904 : Too many public methods
+# W0511 : TODO/FIXME/XXX
+# W0212 : Access to a protected member %s of a client class
+
+"""
+VectorArray definition.
+"""
+
+import math
+import operator
+import unittest
+from array import array
+
+from Vector import Vector
+from TriangleGroup import TriangleGroup
+from Backend import Backend
+
+########################################################################
+class VectorArray:
+
+    """VectorArray : a packed sequence of 3-vectors.
+
+    The vectors are stored as interleaved x, y, z values in a single
+    array('d'), and the batched operations below work on whole columns at
+    a time instead of dispatching through one Vector per point. Each
+    batched operation matches the Vector method of the same name applied
+    to every element. Where an operation takes another operand, that may
+    be a VectorArray of the same length, or a single 3-vector which is
+    then used with every element.
+    """
+
+    def __init__(self, n=0):
+        """Initialize an array of n zero vectors."""
+        self.mV = array('d', [ 0.0 ]) * (3 * n)
+
+    @staticmethod
+    def fromArray(data):
+        """Initialize from a flat sequence of interleaved x, y, z values.
+        The values are copied."""
+        if len(data) % 3 != 0:
+            raise IndexError('Length must be a multiple of 3.')
+        rv = VectorArray()
+        rv.mV = array('d', data)
+        return rv
+
+    @staticmethod
+    def fromVectors(vectors):
+        """Initialize from a sequence of 3-vectors, such as a list of Vectors
+        or the mVertices of a TriangleGroup."""
+        rv = VectorArray()
+        packed = getattr(vectors, 'mData', None)
+        if isinstance(packed, array) and packed.typecode == 'd':
+            # A compact TriangleGroup vertex list is already laid out
+            # the same way.
+            rv.mV = array('d', packed)
+            return rv
+        data = rv.mV
+        for v in vectors:
+            if len(v) != 3:
+                raise IndexError('Only 3-vectors can be stored.')
+            data.extend(v[:])
+        return rv
+
+    @staticmethod
+    def fromTriangleGroup(group):
+        """Initialize from the vertices of a TriangleGroup."""
+        return VectorArray.fromVectors(group.mVertices)
+
+    def toVectors(self):
+        """Return the contents as a list of Vectors."""
+        d = self.mV
+        return [ Vector._fromList([ d[i], d[i+1], d[i+2] ])
+                 for i in xrange(0, len(d), 3) ]
+
+    def clone(self):
+        """Return a copy of this array."""
+        return VectorArray.fromArray(self.mV)
+
+    def __len__(self):
+        "Return the number of vectors."
+        return len(self.mV) // 3
+
+    def _index(self, i):
+        """Return the position in mV of the first element of vector i."""
+        n = len(self)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError('Index out of bounds : %s' % i)
+        return 3 * i
+
+    def __getitem__(self, i):
+        "Return a copy of vector i, as a Vector."
+        j = self._index(i)
+        d = self.mV
+        return Vector._fromList([ d[j], d[j+1], d[j+2] ])
+
+    def __setitem__(self, i, v):
+        "Set vector i from any 3-vector."
+        j = self._index(i)
+        if len(v) != 3:
+            raise IndexError('Only 3-vectors can be stored.')
+        (self.mV[j], self.mV[j+1], self.mV[j+2]) = (v[0], v[1], v[2])
+
+    def __iter__(self):
+        d = self.mV
+        for i in xrange(0, len(d), 3):
+            yield Vector._fromList([ d[i], d[i+1], d[i+2] ])
+
+    def __eq__(self, other):
+        """Equality with another sequence of 3-vectors."""
+        if len(self) != len(other):
+            return False
+        for (v1, v2) in zip(self, other):
+            if v1 != v2:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        return '[ %s ]' % ', '.join([ str(v) for v in self ])
+
+    def _operand(self, other):
+        """Return other as a flat array of the same length as mV, repeating
+        it if it is a single 3-vector."""
+        if isinstance(other, VectorArray):
+            if len(other) != len(self):
+                raise IndexError('Arrays must be the same size.')
+            return other.mV
+        if len(other) != 3:
+            raise IndexError('Operand must be a 3-vector or a VectorArray.')
+        return array('d', [ other[0], other[1], other[2] ]) * len(self)
+
+    def _columns(self, other=None):
+        """Return the x, y and z columns of self, or of other."""
+        d = self.mV if other is None else self._operand(other)
+        return (d[0::3], d[1::3], d[2::3])
+
+    def _fromColumns(self, xs, ys, zs):
+        """Interleave three columns into a new VectorArray."""
+        rv = VectorArray(len(xs))
+        rv.mV[0::3] = array('d', xs)
+        rv.mV[1::3] = array('d', ys)
+        rv.mV[2::3] = array('d', zs)
+        return rv
+
+    def add(self, other):
+        """Return self + other as a new VectorArray."""
+        rv = VectorArray()
+        b = self._operand(other)
+        k = Backend.mKernels
+        if k is not None:
+            rv.mV = k.add(self.mV, b)
+        else:
+            rv.mV = array('d', map(operator.add, self.mV, b))
+        return rv
+
+    def sub(self, other):
+        """Return self - other as a new VectorArray."""
+        rv = VectorArray()
+        b = self._operand(other)
+        k = Backend.mKernels
+        if k is not None:
+            rv.mV = k.sub(self.mV, b)
+        else:
+            rv.mV = array('d', map(operator.sub, self.mV, b))
+        return rv
+
+    def mults(self, s):
+        """Return every vector multiplied by scalar s, as a new
+        VectorArray."""
+        rv = VectorArray()
+        rv.mV = array('d', [ x * s for x in self.mV ])
+        return rv
+
+    def scale(self, s):
+        """Scale every vector in place by scalar s."""
+        self.mV = array('d', [ x * s for x in self.mV ])
+        return self
+
+    def dot(self, other):
+        """Return the dot products of corresponding vectors, as an
+        array('d')."""
+        k = Backend.mKernels
+        if k is not None:
+            return k.dot(self.mV, self._operand(other))
+        (x1, y1, z1) = self._columns()
+        (x2, y2, z2) = self._columns(other)
+        return array('d', [ a * d + b * e + c * f for (a, b, c, d, e, f)
+                            in zip(x1, y1, z1, x2, y2, z2) ])
+
+    def cross(self, other):
+        """Return the cross products of corresponding vectors, as a new
+        VectorArray."""
+        k = Backend.mKernels
+        if k is not None:
+            rv = VectorArray()
+            rv.mV = k.cross(self.mV, self._operand(other))
+            return rv
+        (x1, y1, z1) = self._columns()
+        (x2, y2, z2) = self._columns(other)
+        xs = map(operator.sub, map(operator.mul, y1, z2),
+                 map(operator.mul, y2, z1))
+        ys = map(operator.sub, map(operator.mul, z1, x2),
+                 map(operator.mul, z2, x1))
+        zs = map(operator.sub, map(operator.mul, x1, y2),
+                 map(operator.mul, x2, y1))
+        return self._fromColumns(xs, ys, zs)
+
+    def norm(self):
+        """Return the Euclidean norms of the vectors, as an array('d')."""
+        k = Backend.mKernels
+        if k is not None:
+            return k.norm(self.mV)
+        (xs, ys, zs) = self._columns()
+        return array('d', [ math.sqrt(x * x + y * y + z * z)
+                            for (x, y, z) in zip(xs, ys, zs) ])
+
+    def normalize(self):
+        """Turn every vector into a unit vector in place."""
+        k = Backend.mKernels
+        if k is not None:
+            k.normalize(self.mV)
+            return self
+        (xs, ys, zs) = self._columns()
+        r = [ 1.0 / math.sqrt(x * x + y * y + z * z)
+              for (x, y, z) in zip(xs, ys, zs) ]
+        self.mV[0::3] = array('d', map(operator.mul, xs, r))
+        self.mV[1::3] = array('d', map(operator.mul, ys, r))
+        self.mV[2::3] = array('d', map(operator.mul, zs, r))
+        return self
+
+########################################################################
+# VectorArray Unit Tests
+class VectorArrayTest(unittest.TestCase):
+    """Unit tests for VectorArray class."""
+
+    def setUp(self):
+        'Set up some test vectors.'
+        self.mVectors = [ Vector(1, 2, 3), Vector(-4, 0.5, 2),
+                          Vector(0, 0, 1), Vector(3, -7, 0.25) ]
+        self.mOthers = [ Vector(2, 0, -1), Vector(1, 1, 1),
+                         Vector(0, 5, 0), Vector(-2, 3, 4) ]
+
+    def testConversions(self):
+        'Test conversions to and from Vectors.'
+        va = VectorArray.fromVectors(self.mVectors)
+        assert len(va) == 4
+        assert va == self.mVectors
+        assert va.toVectors() == self.mVectors
+        assert va[1] == [ -4, 0.5, 2 ]
+        assert va[-1] == [ 3, -7, 0.25 ]
+        va[1] = [ 9, 8, 7 ]
+        assert va[1] == Vector(9, 8, 7)
+        assert list(va.mV[:3]) == [ 1, 2, 3 ]
+
+        va2 = va.clone()
+        va2[0] = Vector(0, 0, 0)
+        assert va[0] == [ 1, 2, 3 ]
+
+        assert len(VectorArray(5)) == 5
+        assert VectorArray.fromArray([ 1, 2, 3, 4, 5, 6 ])[1] == [ 4, 5, 6 ]
+
+        for call in (lambda: va[4],
+                     lambda: VectorArray.fromArray([ 1, 2 ]),
+                     lambda: VectorArray.fromVectors([ Vector(1, 2) ])):
+            hitError = False
+            try:
+                call()
+            except IndexError:
+                hitError = True
+            assert hitError
+
+    def testFromTriangleGroup(self):
+        'Test conversion from TriangleGroup vertex lists.'
+        g = TriangleGroup.icosahedron()
+        va = VectorArray.fromTriangleGroup(g)
+        assert va == g.mVertices
+
+        g2 = TriangleGroup(compact=True)
+        for triangle in g.mTriangles:
+            g2.addTriangle(*[ g.mVertices[i] for i in triangle ])
+        va2 = VectorArray.fromTriangleGroup(g2)
+        assert va2 == g.mVertices
+        assert va2.mV is not g2.mVertices.mData
+
+    def testArithmetic(self):
+        'Test batched operations against the Vector methods.'
+        va = VectorArray.fromVectors(self.mVectors)
+        vb = VectorArray.fromVectors(self.mOthers)
+        pairs = zip(self.mVectors, self.mOthers)
+        assert va.add(vb) == [ v1 + v2 for (v1, v2) in pairs ]
+        assert va.sub(vb) == [ v1 - v2 for (v1, v2) in pairs ]
+        assert va.cross(vb) == [ v1.cross(v2) for (v1, v2) in pairs ]
+        assert list(va.dot(vb)) == [ v1.dot(v2) for (v1, v2) in pairs ]
+        assert va.mults(-3) == [ v.mults(-3) for v in self.mVectors ]
+        assert list(va.norm()) == [ v.norm() for v in self.mVectors ]
+
+        w = Vector(1, -1, 2)
+        assert va.add(w) == [ v + w for v in self.mVectors ]
+        assert va.sub(w) == [ v - w for v in self.mVectors ]
+        assert va.cross(w) == [ v.cross(w) for v in self.mVectors ]
+        assert list(va.dot(w)) == [ v.dot(w) for v in self.mVectors ]
+
+        hitError = False
+        try:
+            va.add(VectorArray(3))
+        except IndexError:
+            hitError = True
+        assert hitError
+
+        hitError = False
+        try:
+            va.dot(Vector(1, 2))
+        except IndexError:
+            hitError = True
+        assert hitError
+
+    def testInPlace(self):
+        'Test the in-place operations.'
+        va = VectorArray.fromVectors(self.mVectors)
+        assert va.normalize() is va
+        assert va == [ v.clone().normalize() for v in self.mVectors ]
+        va = VectorArray.fromVectors(self.mVectors)
+        va.scale(2)
+        assert va == [ v.mults(2) for v in self.mVectors ]
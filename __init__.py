@@ -30,35 +30,18 @@ hopefully a greater!) level of understanding.
 
 from Vector import Vector, VectorTest
 from Matrix import Matrix, MatrixTest
+from Matrix3 import Matrix3, Matrix3Test
+from Matrix4 import Matrix4, Matrix4Test
+from LUFactorization import LUFactorization, LUFactorizationTest
+from BatchSolver import BatchSolver, BatchSolverTest
+from SparseMatrix import SparseMatrix, SparseMatrixTest
 from MathUtil import MathUtil, MathUtilTest
 from CoordinateSys import CoordinateSys, CoordinateSysTest
 from Quaternion import Quaternion, QuaternionTest
+from QuaternionArray import QuaternionArray, QuaternionArrayTest
 from TriangleGroup import TriangleGroup, TriangleGroupTest
-
-# import time                                                
-
-# q1 = Quaternion(1, 2, 3, 4)
-# q2 = Quaternion(5, 6, 7, 8)
-
-# def useMul1(nTimes):
-#     startTime = int(round(time.time() * 1000))
-#     i = 0
-#     while i < nTimes:
-#         q3 = q1.mul1(q2)
-#         i = i + 1
-#     endTime = int(round(time.time() * 1000))
-#     print 'Total time = %s ms' % (endTime - startTime)
-
-# def useMul2(nTimes):
-#     startTime = int(round(time.time() * 1000))
-#     i = 0
-#     while i < nTimes:
-#         q3 = q1.mul2(q2)
-#         i = i + 1
-#     endTime = int(round(time.time() * 1000))
-#     print 'Total time = %s ms' % (endTime - startTime)
-
-
-
-
-
+from BinaryStlView import BinaryStlView, BinaryStlViewTest
+from VectorArray import VectorArray, VectorArrayTest
+from Backend import Backend, BackendTest
+from Benchmarks import Benchmarks, BenchmarksTest
+from Instrumentation import Instrumentation, InstrumentationTest